@@ -0,0 +1,455 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+# -*- coding: utf-8 -*-
+"""
+================
+TracRemote.cache
+================
+
+On-disk caches that allow separate invocations of trac-remote to share
+state.
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from hashlib import sha1
+
+
+def content_hash(data):
+    """Compute a hash of file or page content.
+
+    Parameters
+    ----------
+    data : :class:`str` or :class:`bytes`
+        The content.  Strings are encoded as UTF-8.
+
+    Returns
+    -------
+    :class:`str`
+        The hexadecimal digest.
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return sha1(data).hexdigest()
+
+
+def file_hash(filename, chunk_size=2**16):
+    """Compute the same hash as :func:`content_hash` for the contents of a
+    file, without reading the whole file into memory.
+
+    Parameters
+    ----------
+    filename : :class:`str`
+        Name of the file.
+    chunk_size : :class:`int`, optional
+        Number of bytes to read at a time.
+
+    Returns
+    -------
+    :class:`str`
+        The hexadecimal digest.
+    """
+    h = sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cache_dir():
+    """Return the top-level cache directory.
+
+    This is ``$XDG_CACHE_HOME/trac-remote`` if ``XDG_CACHE_HOME`` is set,
+    otherwise ``~/.cache/trac-remote``.
+
+    Returns
+    -------
+    :class:`str`
+        The name of the cache directory.  It may not exist yet.
+    """
+    try:
+        top = os.environ['XDG_CACHE_HOME']
+    except KeyError:
+        top = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(top, 'trac-remote')
+
+
+def cache_key(*args):
+    """Convert a set of strings into a name suitable for a cache file.
+
+    Parameters
+    ----------
+    args : :class:`tuple`
+        Strings, such as the URL of the Trac server, that identify the
+        cache entry.
+
+    Returns
+    -------
+    :class:`str`
+        A hexadecimal digest of `args`.
+    """
+    return sha1('\n'.join(args).encode('utf-8')).hexdigest()
+
+
+def write_private(filename, data):
+    """Atomically write `data` to a file readable only by its owner.
+
+    Parameters
+    ----------
+    filename : :class:`str`
+        Name of the file.  The directory containing it will be created
+        with owner-only permissions if necessary.
+    data : :class:`bytes`
+        Data to write.
+    """
+    d = os.path.dirname(filename)
+    if not os.path.isdir(d):
+        os.makedirs(d, mode=0o700)
+    tmp = '{0}.{1:d}.{2:d}.tmp'.format(filename, os.getpid(),
+                                       threading.get_ident())
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, filename)
+    return
+
+
+def read_mark(filename):
+    """Read a high-water mark, the time of the latest change seen.
+
+    Parameters
+    ----------
+    filename : :class:`str`
+        File containing the mark.
+
+    Returns
+    -------
+    :class:`~datetime.datetime`
+        The time, or ``None`` if the file does not exist.
+    """
+    try:
+        with open(filename) as f:
+            return datetime.strptime(f.read().strip(), '%Y-%m-%dT%H:%M:%S%z')
+    except (IOError, ValueError):
+        return None
+
+
+def write_mark(filename, mark):
+    """Write a high-water mark.
+
+    Parameters
+    ----------
+    filename : :class:`str`
+        File to contain the mark.
+    mark : :class:`~datetime.datetime`
+        A timezone-aware time.
+    """
+    with open(filename, 'w') as f:
+        f.write(mark.strftime('%Y-%m-%dT%H:%M:%S%z') + '\n')
+    return
+
+
+class SessionCache(object):
+    """Store authenticated Trac session cookies on disk.
+
+    Parameters
+    ----------
+    directory : :class:`str`, optional
+        Directory holding the cached sessions.  Defaults to a ``sessions``
+        directory in :func:`cache_dir`.
+
+    Attributes
+    ----------
+    cookies : :class:`tuple`
+        Names of the cookies that are cached.
+    """
+    cookies = ('trac_form_token', 'trac_auth')
+
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = os.path.join(cache_dir(), 'sessions')
+        self.directory = directory
+        return
+
+    def _filename(self, url, username):
+        return os.path.join(self.directory,
+                            cache_key(url, username) + '.json')
+
+    def load(self, url, username):
+        """Load a cached session.
+
+        Parameters
+        ----------
+        url : :class:`str`
+            The base URL of the Trac server.
+        username : :class:`str`
+            The Trac username.
+
+        Returns
+        -------
+        :class:`list`
+            A list of dictionaries, each describing one cookie, suitable
+            for passing to :meth:`requests.cookies.RequestsCookieJar.set`.
+            If there is no complete cached session, returns ``None``.
+        """
+        try:
+            with open(self._filename(url, username)) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return None
+        cookies = data.get('cookies', [])
+        names = set([c['name'] for c in cookies])
+        if not names.issuperset(self.cookies):
+            return None
+        return cookies
+
+    def save(self, url, username, jar):
+        """Cache the session cookies.
+
+        Parameters
+        ----------
+        url : :class:`str`
+            The base URL of the Trac server.
+        username : :class:`str`
+            The Trac username.
+        jar : :class:`requests.cookies.RequestsCookieJar`
+            The cookie jar of an authenticated session.
+        """
+        cookies = [{'name': c.name, 'value': c.value,
+                    'domain': c.domain, 'path': c.path}
+                   for c in jar if c.name in self.cookies]
+        data = {'url': url, 'username': username, 'cookies': cookies}
+        write_private(self._filename(url, username),
+                      json.dumps(data).encode('utf-8'))
+        return
+
+    def remove(self, url, username):
+        """Remove a cached session, for example after logging out.
+
+        Parameters
+        ----------
+        url : :class:`str`
+            The base URL of the Trac server.
+        username : :class:`str`
+            The Trac username.
+        """
+        try:
+            os.remove(self._filename(url, username))
+        except OSError:
+            pass
+        return
+
+
+class Manifest(dict):
+    """A dictionary of content hashes, stored in a JSON file.
+
+    Parameters
+    ----------
+    filename : :class:`str`
+        Name of the file.  If it exists, its contents are loaded.
+    """
+
+    def __init__(self, filename):
+        super(Manifest, self).__init__()
+        self.filename = filename
+        try:
+            with open(filename) as f:
+                self.update(json.load(f))
+        except (IOError, ValueError):
+            pass
+        return
+
+    def save(self):
+        """Write the manifest to its file.
+        """
+        tmp = '{0}.{1:d}.{2:d}.tmp'.format(self.filename, os.getpid(),
+                                           threading.get_ident())
+        with open(tmp, 'w') as f:
+            json.dump(self, f, indent=0, sort_keys=True)
+        os.replace(tmp, self.filename)
+        return
+
+
+class PageCache(object):
+    """Cache wiki page text on disk along with its HTTP validators.
+
+    The least recently used pages are removed when the total size of the
+    cache exceeds `max_size`.
+
+    Parameters
+    ----------
+    directory : :class:`str`, optional
+        Directory holding the cached pages.  Defaults to a ``pages``
+        directory in :func:`cache_dir`.
+    max_size : :class:`int`, optional
+        Maximum size of the cache in bytes.
+    """
+
+    def __init__(self, directory=None, max_size=100*2**20):
+        if directory is None:
+            directory = os.path.join(cache_dir(), 'pages')
+        self.directory = directory
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        return
+
+    def _filename(self, url):
+        return os.path.join(self.directory, cache_key(url) + '.json')
+
+    def get(self, url):
+        """Look up a cached page.
+
+        Parameters
+        ----------
+        url : :class:`str`
+            URL of the page.
+
+        Returns
+        -------
+        :class:`dict`
+            A dictionary containing the ``text`` of the page and the
+            ``etag`` and ``last_modified`` validators, or ``None`` if the
+            page is not cached.
+        """
+        filename = self._filename(url)
+        try:
+            with open(filename) as f:
+                entry = json.load(f)
+            os.utime(filename)
+        except (IOError, OSError, ValueError):
+            return None
+        return entry
+
+    def put(self, url, text, etag=None, last_modified=None):
+        """Add a page to the cache.
+
+        Parameters
+        ----------
+        url : :class:`str`
+            URL of the page.
+        text : :class:`str`
+            Text of the page.
+        etag : :class:`str`, optional
+            Value of the ETag header.
+        last_modified : :class:`str`, optional
+            Value of the Last-Modified header.
+        """
+        entry = {'url': url, 'text': text, 'etag': etag,
+                 'last_modified': last_modified}
+        data = json.dumps(entry).encode('utf-8')
+        if len(data) > self.max_size:
+            return
+        with self._lock:
+            write_private(self._filename(url), data)
+            self._evict()
+        return
+
+    def _evict(self):
+        """Remove least recently used pages until the cache is small enough.
+        """
+        entries = list()
+        total = 0
+        for f in os.listdir(self.directory):
+            if not f.endswith('.json'):
+                continue
+            #
+            # Other processes sharing the cache may remove files at any
+            # time.
+            #
+            try:
+                st = os.stat(os.path.join(self.directory, f))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, f))
+            total += st.st_size
+        entries.sort()
+        while total > self.max_size and entries:
+            mtime, size, f = entries.pop(0)
+            try:
+                os.remove(os.path.join(self.directory, f))
+            except OSError:
+                pass
+            total -= size
+        return
+
+
+class IndexCache(object):
+    """Cache the list of wiki pages on disk for a limited time.
+
+    Parameters
+    ----------
+    directory : :class:`str`, optional
+        Directory holding the cached lists.  Defaults to an ``index``
+        directory in :func:`cache_dir`.
+    ttl : :class:`float`, optional
+        Time in seconds after which a cached list is no longer used.
+    """
+
+    def __init__(self, directory=None, ttl=300):
+        if directory is None:
+            directory = os.path.join(cache_dir(), 'index')
+        self.directory = directory
+        self.ttl = ttl
+        return
+
+    def _filename(self, url):
+        return os.path.join(self.directory, cache_key(url) + '.json')
+
+    def get(self, url):
+        """Look up a cached list of pages.
+
+        Parameters
+        ----------
+        url : :class:`str`
+            The base URL of the Trac server.
+
+        Returns
+        -------
+        :func:`tuple`
+            The time the list was cached, as returned by :func:`time.time`,
+            and the list of pages, or ``None`` if there is no list younger
+            than `ttl`.
+        """
+        try:
+            with open(self._filename(url)) as f:
+                entry = json.load(f)
+            t = float(entry['time'])
+            pages = entry['pages']
+        except (IOError, KeyError, TypeError, ValueError):
+            return None
+        if not 0 <= time.time() - t < self.ttl:
+            return None
+        return (t, pages)
+
+    def put(self, url, pages, t=None):
+        """Cache a list of pages.
+
+        Parameters
+        ----------
+        url : :class:`str`
+            The base URL of the Trac server.
+        pages : :class:`list`
+            The pages.
+        t : :class:`float`, optional
+            The time the list was obtained, by default now.
+        """
+        if t is None:
+            t = time.time()
+        entry = {'url': url, 'time': t, 'pages': pages}
+        write_private(self._filename(url), json.dumps(entry).encode('utf-8'))
+        return
+
+    def remove(self, url):
+        """Remove a cached list, for example after a page was added.
+
+        Parameters
+        ----------
+        url : :class:`str`
+            The base URL of the Trac server.
+        """
+        try:
+            os.remove(self._filename(url))
+        except OSError:
+            pass
+        return
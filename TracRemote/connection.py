@@ -7,131 +7,2077 @@ TracRemote.connection
 
 Contains a class for establishing and using connections to Trac servers.
 """
+import os
+import threading
+import time
+import xmlrpc.client
+from codecs import getincrementaldecoder
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from os.path import basename
-from urllib.parse import unquote
+from urllib.parse import quote, unquote
+from xml.parsers.expat import ExpatError
 import requests as r
-from .util import (CRLF, SimpleAttachmentHTMLParser, SimpleIndexHTMLParser,
-                   SimpleWikiHTMLParser)
+from urllib3.exceptions import HTTPError as URLLibError
+from .cache import (IndexCache, Manifest, PageCache, SessionCache,
+                    content_hash, file_hash, read_mark, write_mark)
+from .metrics import Metrics, RequestMetrics, TimedHTTPAdapter, connect_time
+from .retry import RetryPolicy, TokenBucket
+from .util import (CRLF, MultipartEncoder, SimpleAttachmentHTMLParser,
+                   SimpleIndexHTMLParser, SimpleRecentChangesHTMLParser,
+                   SimpleWikiHTMLParser, attachment_filename, filename_page,
+                   page_filename, parse_timeline)
 
 
-class Connection(object):
+class _ConnectionBase(object):
+    """Methods shared by :class:`Connection` and :class:`AsyncConnection`.
+    """
+
+    def _credentials(self, url, passfile):
+        """Set the URL of the Trac server and find the login credentials.
+
+        Parameters
+        ----------
+        url : :class:`str`
+            The base URL of the Trac server.
+        passfile : :class:`str`
+            A file containing username and password, or ``None`` to
+            use ~/.netrc.
+
+        Returns
+        -------
+        :func:`tuple`
+            A tuple containing the username and password.
+        """
+        if url is None:
+            raise ValueError("A Trac URL is required!")
+        self.url = url
+        foo = self.url.split('/')
+        self._baseurl = foo[0] + '//' + foo[2]
+        if passfile is None:
+            username, password = self._readPasswordNetrc(self._baseurl)
+        else:
+            username, password = self._readPassword(passfile)
+        if password is None:
+            raise ValueError(('Could not find a password for ' +
+                              '{0}!').format(self.url))
+        return (username, password)
+
+    def _edit_form(self, text, comment, version):
+        """Construct the POST data for a wiki edit.
+
+        Parameters
+        ----------
+        text : :class:`str`
+            The wiki text.
+        comment : :class:`str`
+            A comment on the change, or ``None``.
+        version : :class:`str`
+            The version of the page being replaced.
+
+        Returns
+        -------
+        :class:`dict`
+            The form data.
+        """
+        postdata = {'__FORM_TOKEN': self._form_token,
+                    'from_editor': '1',
+                    'action': 'edit',
+                    'version': version,
+                    'save': 'Submit changes',
+                    'text': CRLF(text)}
+        if comment is not None:
+            postdata['comment'] = CRLF(comment)
+        return postdata
+
+    def _parse(self, response, parser, chunk_size=2**14):
+        """Feed a streamed response to an HTML parser, and stop reading
+        as soon as the parser has found what it needs.
+
+        Parameters
+        ----------
+        response : :class:`requests.Response`
+            A response obtained with ``stream=True``.
+        parser : :class:`html.parser.HTMLParser`
+            A parser with a ``done`` attribute.
+        chunk_size : :class:`int`, optional
+            Number of bytes to read at a time.
+
+        Returns
+        -------
+        :class:`html.parser.HTMLParser`
+            The `parser`.
+        """
+        for parser in self._iter_parse(response, parser, chunk_size):
+            pass
+        return parser
+
+    def _parse_text(self, response, parse):
+        """Parse the body of a response that has already been read.
+
+        Parameters
+        ----------
+        response : :class:`requests.Response`
+            A response obtained without ``stream=True``.
+        parse : callable
+            Called with the text of the response.
+
+        Returns
+        -------
+        :class:`object`
+            The value returned by `parse`.
+        """
+        record = getattr(response, '_record', None)
+        t0 = time.perf_counter()
+        result = parse(response.text)
+        if record is not None:
+            record.parse += time.perf_counter() - t0
+            self._fire('on_parse_end', record)
+        return result
+
+    def _iter_parse(self, response, parser, chunk_size=2**14):
+        """Like :meth:`_parse`, but yield the parser after each chunk, so
+        that results can be used while the rest of the page is read.
+
+        Parameters
+        ----------
+        response : :class:`requests.Response`
+            A response obtained with ``stream=True``.
+        parser : :class:`html.parser.HTMLParser`
+            A parser with a ``done`` attribute.
+        chunk_size : :class:`int`, optional
+            Number of bytes to read at a time.
+
+        Yields
+        ------
+        :class:`html.parser.HTMLParser`
+            The `parser`.
+        """
+        decoder = getincrementaldecoder(response.encoding or
+                                        'utf-8')(errors='replace')
+        record = getattr(response, '_metrics', None)
+        try:
+            for chunk in self._stream(response, chunk_size):
+                if record is None:
+                    parser.feed(decoder.decode(chunk))
+                else:
+                    t0 = time.perf_counter()
+                    parser.feed(decoder.decode(chunk))
+                    record.parse += time.perf_counter() - t0
+                yield parser
+                if parser.done:
+                    break
+            else:
+                parser.feed(decoder.decode(b'', final=True))
+                yield parser
+        finally:
+            #
+            # The rest of a large page is not downloaded; its connection
+            # is dropped from the pool instead.
+            #
+            self._finish(response)
+        if record is not None:
+            self._fire('on_parse_end', record)
+        return
+
+    def _finish(self, response, drain=2**16):
+        """Close a streamed response, and complete its measurements.
+
+        If no more than `drain` bytes of the body are left, they are read
+        and discarded, so that the connection can be reused.  Closing a
+        partly read response would drop its connection from the pool, and
+        the next request would pay for a new TCP (and TLS) handshake.
+
+        Parameters
+        ----------
+        response : :class:`requests.Response`
+            A response obtained with ``stream=True``.
+        drain : :class:`int`, optional
+            Maximum number of unread bytes to read before closing.
+        """
+        record = getattr(response, '_metrics', None)
+        raw = response.raw
+        try:
+            remaining = (int(response.headers['Content-Length']) -
+                         raw.tell())
+        except (AttributeError, KeyError, TypeError, ValueError):
+            remaining = None
+        if raw is not None and (remaining is None or remaining <= drain):
+            read = 0
+            try:
+                for chunk in raw.stream(2**14, decode_content=False):
+                    read += len(chunk)
+                    if read > drain:
+                        break
+                else:
+                    raw.release_conn()
+            except (OSError, URLLibError):
+                #
+                # The connection is closed below.
+                #
+                pass
+            if record is not None:
+                record.received += read
+        response.close()
+        if record is not None:
+            response._metrics = None
+            self._fire('on_request_end', record)
+        return
+
+    def _stream(self, response, chunk_size):
+        """Iterate over the body of a response, recording the time and
+        data transferred if the request is being measured.
+
+        Parameters
+        ----------
+        response : :class:`requests.Response`
+            A response, usually obtained with ``stream=True``.
+        chunk_size : :class:`int`
+            Number of bytes to read at a time.
+
+        Yields
+        ------
+        :class:`bytes`
+            Chunks of the body.
+        """
+        record = getattr(response, '_metrics', None)
+        if record is None:
+            yield from response.iter_content(chunk_size)
+            return
+        t0 = time.perf_counter()
+        for chunk in response.iter_content(chunk_size):
+            record.transfer += time.perf_counter() - t0
+            record.received += len(chunk)
+            yield chunk
+            t0 = time.perf_counter()
+        return
+
+    def _readPassword(self, passfile):
+        """Read the password file & return the username & password.
+
+        Parameters
+        ----------
+        passfile : :class:`str`
+            File containing Trac username and password.
+
+        Returns
+        -------
+        :func:`tuple`
+            A tuple containing the username and password.
+        """
+        with open(passfile, 'r') as pf:
+            username = (pf.readline()).strip()
+            password = (pf.readline()).strip()
+        return (username, password)
+
+    def _readPasswordNetrc(self, url):
+        """Read the Trac username and password from a .netrc file.
+
+        Parameters
+        ----------
+        url : :class:`str`
+            URL of the Trac server
+
+        Returns
+        -------
+        :func:`tuple`
+            A tuple containing the username and password.  If there is no
+            .netrc file, or if the Trac server is not present,
+            returns ``None``.
+        """
+        from netrc import netrc
+        try:
+            rc = netrc()
+        except IOError:
+            return None
+        trachost = url[url.index('//')+2:]
+        if trachost.find('/') > 0:
+            foo = hostname.split('/')
+            trachost = foo[0]
+        try:
+            username, account, password = rc.hosts[trachost]
+        except KeyError:
+            return None
+        return (username, password)
+
+
+class Connection(_ConnectionBase):
     """A representation of the connection to Trac.
 
-    Parameters
-    ----------
-    url : :class:`str`
-        The base URL of the Trac server.
-    passfile : :class:`str`, optional
-        A file containing username and password.  Overrides ~/.netrc.
-    realm : :class:`str`, optional
-        If the Trac instance uses basic or digest authentication, set this
-        to the authentication realm.
-    debug : :class:`bool`, optional
-        If set to ``True``, print more information.
-    """
+    Parameters
+    ----------
+    url : :class:`str`
+        The base URL of the Trac server.
+    passfile : :class:`str`, optional
+        A file containing username and password.  Overrides ~/.netrc.
+    realm : :class:`str`, optional
+        If the Trac instance uses basic or digest authentication, set this
+        to the authentication realm.
+    debug : :class:`bool`, optional
+        If set to ``True``, print more information.
+    pool_size : :class:`int`, optional
+        Maximum number of keep-alive connections to hold open to the
+        Trac server.  This should be at least as large as the number of
+        threads sharing the connection.
+    session_cache : :class:`bool` or :class:`str`, optional
+        If set, store the authenticated session on disk and reuse it
+        in later connections to the same server by the same user, skipping
+        the login requests.  If a string, this is the directory holding
+        the cache, otherwise a default location is used.
+    page_cache : :class:`bool` or :class:`str`, optional
+        If set, cache the text of wiki pages on disk, and revalidate it
+        with conditional requests in :meth:`get`.  If a string, this is the
+        directory holding the cache, otherwise a default location is used.
+    page_cache_size : :class:`int`, optional
+        Maximum size in bytes of the page cache.
+    optimistic : :class:`bool`, optional
+        If set, :meth:`set` remembers the version of each page it writes,
+        and uses it for the next change to the same page instead of
+        downloading the edit form first.  If the page has been changed by
+        someone else in the meantime, the edit is retried once with the
+        current version.
+    retry : :class:`int` or :class:`~TracRemote.retry.RetryPolicy`, optional
+        Retry requests that fail because of a transient error, such as a
+        reset connection or a 503 response.  If an integer, this is the
+        maximum number of retries of each request, with the default
+        :class:`~TracRemote.retry.RetryPolicy`.
+    rate : :class:`float` or :class:`~TracRemote.retry.TokenBucket`, optional
+        Limit the average number of requests per second, shared by all
+        threads using the connection.
+    metrics : :class:`bool` or :class:`~TracRemote.metrics.Metrics`, optional
+        If set, measure every request, including the login.  The
+        measurements are available in the `metrics` attribute.
+    hooks : :class:`dict`, optional
+        Functions to call for every request, including the login, keyed by
+        event.  See :meth:`add_hook`.
+    index_ttl : :class:`float`, optional
+        If positive, keep the list of wiki pages returned by :meth:`index`
+        for this many seconds, instead of downloading the TitleIndex
+        every time.  The list is dropped when :meth:`set` creates a page.
+    index_cache : :class:`bool` or :class:`str`, optional
+        If set, also store the list of wiki pages on disk, so that later
+        connections to the same server can use it for the rest of
+        `index_ttl`.  If a string, this is the directory holding the
+        cache, otherwise a default location is used.
+    rpc : :class:`bool`, optional
+        If set, use the XML-RPC interface of the XmlRpcPlugin_ to read and
+        write wiki pages, if the server provides it, and fall back to the
+        web interface otherwise.  Many pages can then be read or written
+        in a single request, see :meth:`get_many` and :meth:`set_many`.
+
+    Attributes
+    ----------
+    metrics : :class:`~TracRemote.metrics.Metrics`
+        Measurements of each request, or ``None`` if not requested.
+    hook_events : :class:`tuple`
+        Names of the events accepted by :meth:`add_hook`.
+    rpc_batch : :class:`int`
+        Maximum number of calls combined in one XML-RPC request.
+    max_daysback : :class:`int`
+        Number of days of history the server returns in the timeline, the
+        ``[timeline] max_daysback`` option of Trac.  An incremental
+        :meth:`export_all` whose last run is older than this saves all
+        pages.
+
+    .. _XmlRpcPlugin: https://trac-hacks.org/wiki/XmlRpcPlugin
+    """
+    hook_events = ('on_request_start', 'on_request_end', 'on_parse_end')
+    rpc_batch = 100
+    max_daysback = 90
+
+    def __init__(self, url=None, passfile=None, realm=None, debug=False,
+                 pool_size=10, session_cache=False, page_cache=False,
+                 page_cache_size=100*2**20, optimistic=False, retry=None,
+                 rate=None, metrics=False, hooks=None, index_ttl=0,
+                 index_cache=False, rpc=False):
+        self._realm = realm
+        if metrics is True:
+            metrics = Metrics()
+        self.metrics = metrics if metrics else None
+        self._hooks = dict()
+        if hooks is not None:
+            for event in hooks:
+                self.add_hook(event, hooks[event])
+        if isinstance(retry, int):
+            retry = RetryPolicy(retries=retry) if retry > 0 else None
+        self._retry = retry
+        if rate is not None and not isinstance(rate, TokenBucket):
+            rate = TokenBucket(rate)
+        self._rate = rate
+        self._debug = debug
+        self._optimistic = optimistic
+        self._versions = dict()
+        self._page_cache = None
+        if page_cache:
+            if page_cache is True:
+                self._page_cache = PageCache(max_size=page_cache_size)
+            else:
+                self._page_cache = PageCache(page_cache,
+                                             max_size=page_cache_size)
+        self._index_ttl = index_ttl
+        self._index = None
+        self._index_cache = None
+        if index_cache and index_ttl > 0:
+            if index_cache is True:
+                self._index_cache = IndexCache(ttl=index_ttl)
+            else:
+                self._index_cache = IndexCache(index_cache, ttl=index_ttl)
+        #
+        # The XML-RPC endpoint is found when it is first needed.
+        #
+        self._rpc = rpc
+        self._rpc_url = None
+        self._rpc_lock = threading.Lock()
+        #
+        # A single session holds both the cookie jar and the pool of
+        # keep-alive connections, so repeated requests to the same host
+        # do not pay for a new TCP (and TLS) handshake.
+        #
+        self._session = r.Session()
+        adapter = TimedHTTPAdapter(pool_connections=1,
+                                   pool_maxsize=pool_size)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._cookies = self._session.cookies
+        #
+        # Handle login
+        #
+        username, password = self._credentials(url, passfile)
+        self._username = username
+        self._password = password
+        #
+        # Try to reuse a cached session.  If the server rejects it later,
+        # _request() will log in again.
+        #
+        self._session_cache = None
+        self._cached_session = False
+        #
+        # Each login starts a new generation of the session, so that
+        # requests rejected at the same time only log in once.
+        #
+        self._generation = 0
+        self._login_lock = threading.Lock()
+        if session_cache:
+            if session_cache is True:
+                self._session_cache = SessionCache()
+            else:
+                self._session_cache = SessionCache(session_cache)
+            cookies = self._session_cache.load(self.url, username)
+            if cookies is not None:
+                for c in cookies:
+                    self._cookies.set(c['name'], c['value'],
+                                      domain=c['domain'], path=c['path'])
+                self._form_token = self._cookies['trac_form_token']
+                self._cached_session = True
+                return
+        self._login()
+        return
+
+    def _login(self, stale=()):
+        """Log in to the Trac server, and cache the session if requested.
+
+        Parameters
+        ----------
+        stale : :class:`list`, optional
+            Cookies of a rejected session, as :class:`http.cookiejar.Cookie`
+            objects, to remove once they have been replaced.
+        """
+        # if self._realm is not None:
+        #     auth_handler = HTTPDigestAuthHandler()
+        #     auth_handler.add_password(realm=self._realm,
+        #                               uri=self.url,
+        #                               user=username,
+        #                               passwd=password)
+        #     self.opener.add_handler(auth_handler)
+        response = self._request('GET', self.url + "/login", op='login')
+        assert 'trac_form_token' in self._cookies
+        #
+        # Trac only sets a new form token if the request had none.
+        #
+        self._form_token = response.cookies.get('trac_form_token')
+        if self._form_token is None:
+            self._form_token = self._cookies['trac_form_token']
+        if self._realm is None:
+            postdata = {'username': self._username,
+                        'password': self._password,
+                        '__FORM_TOKEN': self._form_token,
+                        'referer': self.url + "/login"}
+            #
+            # The cookie named 'trac_auth' is obtained after the POST to the
+            # login page but before the redirect to the wiki front page.
+            # Technically it is obtained in the HTTP headers of the redirect,
+            # which the session adds to its cookie jar automatically.
+            #
+            response = self._request('POST', self.url + "/login",
+                                     data=postdata, op='login')
+        assert 'trac_auth' in self._cookies
+        #
+        # Stale cookies that were not overwritten, for example because
+        # the new ones have a different domain, would be sent alongside
+        # the new ones.
+        #
+        for c in stale:
+            others = [k for k in self._cookies
+                      if k.name == c.name and k is not c]
+            if c in list(self._cookies) and others:
+                self._cookies.clear(c.domain, c.path, c.name)
+        if self._session_cache is not None:
+            self._session_cache.save(self.url, self._username, self._cookies)
+        return
+
+    def _relogin(self, generation):
+        """Log in again after the server rejected a cached session.
+
+        Only the first of several requests rejected at the same time logs
+        in; the others wait for it.  Cookies are replaced, not cleared, so
+        that requests in flight are not sent without a session.
+
+        Parameters
+        ----------
+        generation : :class:`int`
+            The generation of the session the rejected request was sent
+            with.
+        """
+        with self._login_lock:
+            if self._generation == generation:
+                stale = [c for c in self._cookies
+                         if c.name in SessionCache.cookies]
+                self._login(stale)
+                self._generation += 1
+                self._cached_session = False
+        return
+
+    def _request(self, method, url, op=None, **kwargs):
+        """Send a request through the shared session.
+
+        Parameters
+        ----------
+        method : :class:`str`
+            HTTP method, *e.g.* ``'GET'``.
+        url : :class:`str`
+            Full URL of the request.
+        op : :class:`str`, optional
+            Name of the operation making the request, used in `metrics`.
+        kwargs : :class:`dict`
+            Additional keyword arguments passed to
+            :meth:`requests.Session.request`.
+
+        Returns
+        -------
+        :class:`requests.Response`
+            The response from the server.
+        """
+        attempt = 0
+        generation = self._generation
+        cached = self._cached_session and op not in ('login', 'logout')
+        while True:
+            if self._rate is not None:
+                self._rate.acquire()
+            #
+            # Measurements are only made if someone is interested.
+            #
+            measure = self.metrics is not None or self._hooks
+            if measure:
+                record = RequestMetrics(op, method, url)
+                self._fire('on_request_start', record)
+                connect_time()
+                t0 = time.perf_counter()
+            try:
+                response = self._session.request(method, url, **kwargs)
+            except (r.ConnectionError, r.Timeout) as e:
+                if measure:
+                    record.error = e
+                    self._measure(record, t0, None, kwargs)
+                if (self._retry is None or
+                        not self._retry.retryable(method, attempt)):
+                    raise
+                delay = self._retry.delay(attempt)
+            else:
+                if measure:
+                    self._measure(record, t0, response, kwargs)
+                if self._debug:
+                    print(response.request.headers)
+                    print(response.status_code)
+                    print(response.headers)
+                if (self._retry is None or
+                        not self._retry.retryable(method, attempt,
+                                                  response.status_code)):
+                    break
+                delay = self._retry.delay(attempt,
+                                          response.headers.get('Retry-After'))
+                self._finish(response)
+            attempt += 1
+            time.sleep(delay)
+        if cached and (response.status_code in (401, 403) or
+                       'trac_auth' not in self._cookies):
+            #
+            # The cached session has expired, so log in again, unless
+            # another thread already has, refresh any form token in the
+            # request, and retry it once.  Trac may reject the session,
+            # or expire the trac_auth cookie and serve the page as to an
+            # anonymous user.
+            #
+            self._finish(response)
+            self._relogin(generation)
+            data = kwargs.get('data')
+            if isinstance(data, dict) and '__FORM_TOKEN' in data:
+                data['__FORM_TOKEN'] = self._form_token
+            if isinstance(data, MultipartEncoder):
+                data.replace('__FORM_TOKEN', self._form_token)
+            response = self._request(method, url, op=op, **kwargs)
+        return response
+
+    def _measure(self, record, t0, response, kwargs):
+        """Complete the measurements of a request, and add them to
+        `metrics`.  Unless the body of the response is streamed, the
+        request is finished.
+
+        Parameters
+        ----------
+        record : :class:`~TracRemote.metrics.RequestMetrics`
+            The measurements.
+        t0 : :class:`float`
+            Value of :func:`time.perf_counter` when the request was sent.
+        response : :class:`requests.Response`
+            The response, or ``None`` if the request failed.
+        kwargs : :class:`dict`
+            Keyword arguments of the request.
+        """
+        elapsed = time.perf_counter() - t0
+        record.connect = connect_time()
+        elapsed = max(0.0, elapsed - record.connect)
+        finished = True
+        if response is None:
+            record.ttfb = elapsed
+        else:
+            record.status = response.status_code
+            first = response.history[0] if response.history else response
+            body = first.request.body
+            if hasattr(body, '__len__'):
+                record.sent = len(body)
+            if kwargs.get('stream', False):
+                #
+                # The body has not been read yet, see _stream() and
+                # _finish().
+                #
+                record.ttfb = elapsed
+                response._metrics = record
+                finished = False
+            else:
+                hops = response.history + [response]
+                ttfb = sum([h.elapsed.total_seconds() for h in hops])
+                record.ttfb = min(max(0.0, ttfb - record.connect), elapsed)
+                record.transfer = elapsed - record.ttfb
+                record.received = len(response.content)
+                response._record = record
+        if self.metrics is not None:
+            self.metrics.add(record)
+        if finished:
+            self._fire('on_request_end', record)
+        return
+
+    def _fire(self, event, record):
+        """Call the functions registered for `event`.
+        """
+        for callback in self._hooks.get(event, ()):
+            callback(record)
+        return
+
+    def add_hook(self, event, callback):
+        """Register a function to be called for every request.
+
+        Parameters
+        ----------
+        event : :class:`str`
+            One of :attr:`hook_events`:
+
+            ``on_request_start``
+                Before the request is sent.
+            ``on_request_end``
+                After the response has been read completely, or the request
+                has failed.  For a failed request, the ``status`` is
+                ``None`` and ``error`` is set to the exception.
+            ``on_parse_end``
+                After an HTML or RSS response has been parsed.
+        callback : callable
+            A function taking a single argument, the
+            :class:`~TracRemote.metrics.RequestMetrics` of the request,
+            which contains its URL, operation name, sizes and timings so far.
+            The same object is passed to each event for a request.
+            Exceptions raised by `callback` are not caught.
+
+        Raises
+        ------
+        ValueError
+            If `event` is not known.
+        """
+        if event not in self.hook_events:
+            raise ValueError("Unknown event {0}!".format(event))
+        self._hooks.setdefault(event, list()).append(callback)
+        return
+
+    def remove_hook(self, event, callback):
+        """Remove a function registered with :meth:`add_hook`.
+
+        Parameters
+        ----------
+        event : :class:`str`
+            The event.
+        callback : callable
+            The function.
+        """
+        callbacks = self._hooks.get(event, list())
+        if callback in callbacks:
+            callbacks.remove(callback)
+        if not callbacks:
+            self._hooks.pop(event, None)
+        return
+
+    def _rpc_endpoint(self):
+        """Find the XML-RPC endpoint of the server, if any.
+
+        Returns
+        -------
+        :class:`str`
+            The URL of the endpoint, or ``None`` if XML-RPC was not
+            requested or the server does not support it.
+
+        Only a 404 response, or a reply that is not XML, shows that the
+        server has no XML-RPC interface.  After other errors, ``None`` is
+        returned, but the server is asked again next time.
+        """
+        if not self._rpc:
+            return None
+        with self._rpc_lock:
+            if self._rpc_url is None:
+                url = self.url + "/rpc"
+                method = 'system.getAPIVersion'
+                response = self._rpc_request(url, method, op='rpc')
+                mime = response.headers.get('Content-Type', '')
+                if (response.status_code == 404 or
+                        (response.status_code < 400 and 'xml' not in mime)):
+                    self._rpc_url = False
+                else:
+                    try:
+                        self._rpc_result(url, method, response)
+                    except ValueError:
+                        #
+                        # Other errors, such as 503, or 403 for a user
+                        # without the XML_RPC permission, may go away, so
+                        # use the web interface this time, and ask again
+                        # next time.
+                        #
+                        return None
+                    self._rpc_url = url
+        return self._rpc_url or None
+
+    def _rpc_request(self, url, method, params=(), op=None):
+        """Send an XML-RPC request.
+
+        Parameters
+        ----------
+        url : :class:`str`
+            URL of the XML-RPC endpoint.
+        method : :class:`str`
+            Name of the method, *e.g.* ``'wiki.getPage'``.
+        params : :class:`tuple`, optional
+            Parameters of the method.
+        op : :class:`str`, optional
+            Name of the operation making the request, used in `metrics`.
+
+        Returns
+        -------
+        :class:`requests.Response`
+            The response from the server.
+        """
+        body = xmlrpc.client.dumps(tuple(params), method, encoding='utf-8',
+                                   allow_none=True).encode('utf-8')
+        return self._request('POST', url, data=body,
+                             headers={'Content-Type': 'text/xml'}, op=op)
+
+    def _rpc_call(self, url, method, params=(), op=None):
+        """Call an XML-RPC method.
+
+        Parameters
+        ----------
+        url : :class:`str`
+            URL of the XML-RPC endpoint.
+        method : :class:`str`
+            Name of the method, *e.g.* ``'wiki.getPage'``.
+        params : :class:`tuple`, optional
+            Parameters of the method.
+        op : :class:`str`, optional
+            Name of the operation making the request, used in `metrics`.
+
+        Returns
+        -------
+        :class:`object`
+            The value returned by the method.
+
+        Raises
+        ------
+        ValueError
+            If the request failed, or the method returned a fault.
+        """
+        response = self._rpc_request(url, method, params, op=op)
+        return self._rpc_result(url, method, response)
+
+    def _rpc_result(self, url, method, response):
+        """Decode the response to an XML-RPC request.
+
+        Raises
+        ------
+        ValueError
+            If the request failed, or the method returned a fault.
+        """
+        mime = response.headers.get('Content-Type', '')
+        if response.status_code != 200 or 'xml' not in mime:
+            raise ValueError(("XML-RPC request to {0} failed with " +
+                              "status {1:d}!").format(url,
+                                                      response.status_code))
+        try:
+            return xmlrpc.client.loads(response.content)[0][0]
+        except xmlrpc.client.Fault as e:
+            raise ValueError(("XML-RPC method {0} failed: " +
+                              "{1}!").format(method, e.faultString))
+        except (ExpatError, IndexError, xmlrpc.client.ResponseError):
+            raise ValueError(("Invalid XML-RPC response from " +
+                              "{0}!").format(url))
+
+    @staticmethod
+    def _rpc_text(text):
+        """Restore the CRLF line endings of wiki text read with XML-RPC,
+        which XML parsers convert to LF, so that it matches the text
+        returned by the web interface.
+        """
+        return text.replace('\r\n', '\n').replace('\n', '\r\n')
+
+    def _rpc_multicall(self, calls, op=None):
+        """Call several XML-RPC methods with ``system.multicall``.
+
+        Parameters
+        ----------
+        calls : :class:`list`
+            Tuples of method name and parameters.
+        op : :class:`str`, optional
+            Name of the operation making the request, used in `metrics`.
+
+        Returns
+        -------
+        :class:`list`
+            The value returned by each method.
+
+        Raises
+        ------
+        ValueError
+            If the request failed, or any method returned a fault.
+        """
+        results = list()
+        for i in range(0, len(calls), self.rpc_batch):
+            batch = calls[i:i+self.rpc_batch]
+            multicall = [{'methodName': m, 'params': list(p)}
+                         for m, p in batch]
+            returned = self._rpc_call(self._rpc_url, 'system.multicall',
+                                      (multicall,), op=op)
+            for (m, p), result in zip(batch, returned):
+                #
+                # A fault is returned as a struct, a value as a
+                # one-element array.
+                #
+                if isinstance(result, dict):
+                    raise ValueError(("XML-RPC method {0} failed: " +
+                                      "{1}!").format(m,
+                                                     result['faultString']))
+                results.append(result[0])
+        return results
+
+    def index(self, prefix=None):
+        """Get and parse the TitleIndex page.
+
+        Parameters
+        ----------
+        prefix : :class:`str`, optional
+            Only list pages whose names start with `prefix`.
+
+        Returns
+        -------
+        index : :class:`list`
+            A list of all Trac wiki pages.
+        """
+        return list(self.iter_index(prefix))
+
+    def iter_index(self, prefix=None):
+        """Get and parse the TitleIndex page, yielding each page as soon as
+        it has been read.
+
+        Parameters
+        ----------
+        prefix : :class:`str`, optional
+            Only list pages whose names start with `prefix`.  The prefix
+            is also sent to the server, so that versions of Trac that
+            support it can send a smaller page.
+
+        Yields
+        ------
+        :class:`str`
+            The name of a Trac wiki page.
+        """
+        pages = self._cached_index()
+        if pages is not None:
+            for page in pages:
+                if prefix is None or unquote(page).startswith(prefix):
+                    yield page
+            return
+        t = time.time()
+        if self._rpc_endpoint() is not None:
+            #
+            # Return the names quoted, as they appear in the TitleIndex.
+            #
+            pages = [quote(p) for p in
+                     sorted(self._rpc_call(self._rpc_url, 'wiki.getAllPages',
+                                           op='index'))]
+            if prefix is None and self._index_ttl > 0:
+                self._store_index(pages, t)
+            for page in pages:
+                if prefix is None or unquote(page).startswith(prefix):
+                    yield page
+            return
+        params = None if prefix is None else {'prefix': prefix}
+        response = self._request('GET', self.url + "/wiki/TitleIndex",
+                                 params=params, stream=True, op='index')
+        n = 0
+        parser = SimpleIndexHTMLParser()
+        for parser in self._iter_parse(response, parser):
+            for page in parser.TitleIndex[n:]:
+                #
+                # Servers that do not support the prefix parameter send
+                # the complete index.
+                #
+                if prefix is None or unquote(page).startswith(prefix):
+                    yield page
+            n = len(parser.TitleIndex)
+        #
+        # An error or login page would be cached as an empty or partial
+        # index.
+        #
+        if (prefix is None and self._index_ttl > 0 and
+                response.status_code == 200 and parser.done):
+            self._store_index(parser.TitleIndex, t)
+        return
+
+    def _store_index(self, pages, t):
+        """Cache a complete list of wiki pages.
+
+        Parameters
+        ----------
+        pages : :class:`list`
+            The pages.
+        t : :class:`float`
+            The time the list was requested.
+        """
+        self._index = (t, pages)
+        if self._index_cache is not None:
+            self._index_cache.put(self.url, pages, t)
+        return
+
+    def _cached_index(self):
+        """Find a list of wiki pages younger than `index_ttl`.
+
+        Returns
+        -------
+        :class:`list`
+            The list, or ``None`` if there is none.
+        """
+        if self._index_ttl <= 0:
+            return None
+        cached = self._index
+        if cached is None and self._index_cache is not None:
+            cached = self._index_cache.get(self.url)
+        if cached is None:
+            return None
+        if not 0 <= time.time() - cached[0] < self._index_ttl:
+            return None
+        self._index = cached
+        return cached[1]
+
+    def _forget_index(self, pagepath):
+        """Drop cached lists of wiki pages that do not include `pagepath`.
+
+        Parameters
+        ----------
+        pagepath : :class:`str`
+            A page that exists.
+        """
+        if self._index_ttl <= 0:
+            return
+        pages = self._cached_index()
+        if pages is None or pagepath in pages:
+            return
+        if any([unquote(p) == pagepath for p in pages]):
+            return
+        self._index = None
+        if self._index_cache is not None:
+            self._index_cache.remove(self.url)
+        return
+
+    def get(self, pagepath):
+        """Requests a wiki page in text format.
+
+        Parameters
+        ----------
+        pagepath : :class:`str`
+            Wiki page to grab.
+
+        Returns
+        -------
+        :class:`str`
+            The text of the wiki page.  Note that in some cases, the text of
+            the page may contain UTF-8 characters, so a further conversion to
+            unicode may be warranted. The text may also contain Windows
+            (CRLF) line endings.
+
+        Raises
+        ------
+        ValueError
+            If the page does not exist, or could not be read.
+        """
+        if self._rpc_endpoint() is not None:
+            return self._rpc_text(self._rpc_call(self._rpc_url,
+                                                 'wiki.getPage',
+                                                 (unquote(pagepath),),
+                                                 op='get'))
+        text = self._read(pagepath)
+        if text is None:
+            raise ValueError("Wiki page {0} does not exist!".format(pagepath))
+        return text
+
+    def _read(self, pagepath):
+        """Read a wiki page through the web interface.
+
+        Parameters
+        ----------
+        pagepath : :class:`str`
+            Wiki page to grab.
+
+        Returns
+        -------
+        :class:`str`
+            The text of the wiki page, or ``None`` if it does not exist.
+
+        Raises
+        ------
+        ValueError
+            If the page could not be read.
+        """
+        url = self.url + "/wiki/" + pagepath + "?format=txt"
+        if self._page_cache is None:
+            response = self._request('GET', url, op='get')
+            return self._page_text(pagepath, response)
+        #
+        # Revalidate any cached copy of the page.
+        #
+        cached = self._page_cache.get(url)
+        headers = dict()
+        if cached is not None:
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+        response = self._request('GET', url, headers=headers, op='get')
+        if response.status_code == 304 and cached is not None:
+            return cached['text']
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if response.status_code == 200 and (etag or last_modified):
+            self._page_cache.put(url, response.text, etag, last_modified)
+        return self._page_text(pagepath, response)
+
+    @staticmethod
+    def _page_text(pagepath, response):
+        """Check the response to a request for the text of a wiki page.
+
+        Raises
+        ------
+        ValueError
+            If the server returned an error, other than 404.
+        """
+        if response.status_code == 404:
+            return None
+        if response.status_code != 200:
+            raise ValueError(("Could not read wiki page {0} (status " +
+                              "{1:d})!").format(pagepath,
+                                                response.status_code))
+        return response.text
+
+    def get_many(self, pagepaths, jobs=4):
+        """Get the text of several wiki pages.
+
+        With XML-RPC, up to `rpc_batch` pages are requested at once.
+
+        Parameters
+        ----------
+        pagepaths : :class:`list`
+            Wiki pages to grab.
+        jobs : :class:`int`, optional
+            Number of requests to make in parallel.
+
+        Returns
+        -------
+        :class:`list`
+            The text of each page, in the same order as `pagepaths`.
+        """
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            if self._rpc_endpoint() is None:
+                return list(executor.map(self.get, pagepaths))
+            batches = [[('wiki.getPage', (unquote(p),))
+                        for p in pagepaths[i:i+self.rpc_batch]]
+                       for i in range(0, len(pagepaths), self.rpc_batch)]
+            texts = list()
+            for t in executor.map(lambda b: self._rpc_multicall(b, op='get'),
+                                  batches):
+                texts += [self._rpc_text(text) for text in t]
+        return texts
+
+    def changes(self, since=None, statefile=None):
+        """Iterate over changes to wiki pages.
+
+        Changes are read from the RSS version of the timeline.  If that
+        is not available, the RecentChanges page is used instead, which only
+        provides the date of each change, not the time or author.  In that
+        case all changes made on the day of `since` are reported.
+
+        Parameters
+        ----------
+        since : :class:`~datetime.datetime`, optional
+            Only report changes after this time.  Times without a timezone
+            are assumed to be UTC.  By default, report all changes the
+            server will return.
+        statefile : :class:`str`, optional
+            A file holding a high-water mark.  If `since` is not set, it
+            is read from this file, and the file is updated with the time
+            of the latest change once all changes have been read.
+
+        Yields
+        ------
+        :func:`tuple`
+            The wiki page name, the time of the change as a
+            :class:`~datetime.datetime`, and the author, oldest first.
+        """
+        if since is None and statefile is not None:
+            since = read_mark(statefile)
+        if since is not None and since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        tomorrow = datetime.now(timezone.utc) + timedelta(days=1)
+        if since is None:
+            daysback = 36500
+        else:
+            daysback = (tomorrow - since).days + 1
+        params = {'from': tomorrow.strftime('%Y-%m-%d'),
+                  'daysback': str(daysback),
+                  'wiki': 'on',
+                  'format': 'rss'}
+        response = self._request('GET', self.url + "/timeline",
+                                 params=params, op='changes')
+        dates_only = False
+        try:
+            if response.status_code != 200:
+                raise ValueError(response.reason)
+            changes = self._parse_text(
+                response, lambda text: parse_timeline(text, self.url))
+        except ValueError:
+            response = self._request('GET', self.url +
+                                     "/wiki/RecentChanges", op='changes')
+            parser = SimpleRecentChangesHTMLParser(self.url)
+            self._parse_text(response, parser.feed)
+            changes = parser.changes
+            dates_only = True
+        latest = since
+        for change in sorted(changes, key=lambda c: c[1]):
+            if since is None:
+                new = True
+            elif dates_only:
+                #
+                # Changes on the same day as the mark may be later than
+                # the mark, so report them again.
+                #
+                new = change[1].date() >= since.astimezone(
+                    timezone.utc).date()
+            else:
+                new = change[1] > since
+            if new:
+                latest = change[1]
+                yield change
+        if statefile is not None and latest is not None:
+            write_mark(statefile, latest)
+        return
+
+    def export_all(self, destdir, pages=None, jobs=4, incremental=False):
+        """Save wiki pages to text files, fetching several pages at once.
+
+        Parameters
+        ----------
+        destdir : :class:`str`
+            Directory to write to.  Pages are written to files with the
+            same hierarchy as the wiki, see
+            :func:`~TracRemote.util.page_filename`.
+        pages : :class:`list`, optional
+            Wiki pages to save.  By default, all pages in :meth:`index`.
+        jobs : :class:`int`, optional
+            Number of pages to fetch in parallel.
+        incremental : :class:`bool`, optional
+            If ``True``, only save pages that have changed, according to
+            :meth:`changes`, since the previous incremental export to
+            `destdir`.  The first incremental export saves all pages, as
+            does an export whose previous run is older than
+            `max_daysback`.
+
+        Returns
+        -------
+        :class:`list`
+            The names of the files written.
+        """
+        statefile = os.path.join(destdir, '.trac-remote-timeline')
+        since = read_mark(statefile) if incremental else None
+        if since is not None and (datetime.now(timezone.utc) - since >
+                                  timedelta(days=self.max_daysback - 1)):
+            #
+            # The server would not report changes this old.
+            #
+            since = None
+        mark = None
+        if incremental:
+            #
+            # The mark is the time of the latest change reported by the
+            # server, so it does not depend on the clock of the client.
+            #
+            changed = list()
+            for pagepath, mtime, author in self.changes(since):
+                if pagepath not in changed:
+                    changed.append(pagepath)
+                mark = mtime
+            if since is not None:
+                if mark is None:
+                    mark = since
+                if pages is None:
+                    pages = changed
+                else:
+                    pages = [p for p in pages if p in changed]
+        if pages is None:
+            pages = self.index()
+
+        def save(pagepath, text):
+            filename = page_filename(destdir, pagepath)
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, 'w') as t:
+                t.write(text)
+            return filename
+
+        if self._rpc_endpoint() is None:
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                filenames = list(executor.map(
+                    lambda p: save(p, self.get(p)), pages))
+        else:
+            filenames = list(map(save, pages, self.get_many(pages, jobs)))
+        if mark is not None:
+            os.makedirs(destdir, exist_ok=True)
+            write_mark(statefile, mark)
+        return filenames
+
+    def set(self, pagepath, text, comment=None):
+        """Inputs text into the wiki input text box.
+
+        Parameters
+        ----------
+        pagepath : :class:`str`
+            Wiki page to update.
+        text : :class:`str`
+            The wiki text.
+        comment : :class:`str`, optional
+            A comment on the change.
+
+        Raises
+        ------
+        ValueError
+            If the server did not accept the change.
+        """
+        if self._rpc_endpoint() is not None:
+            self._rpc_call(self._rpc_url, 'wiki.putPage',
+                           (unquote(pagepath), text,
+                            {'comment': comment or ''}), op='set')
+            self._forget_index(pagepath)
+            return
+        version = None
+        if self._optimistic:
+            version = self._versions.get(pagepath)
+        remembered = version is not None
+        if version is None:
+            version = self._edit_version(pagepath)
+        postdata = self._edit_form(text, comment, version)
+        response = self._request('POST', self.url + "/wiki/" + pagepath,
+                                 data=postdata, op='set')
+        if (remembered and not response.history and
+                self._conflict(response, version)):
+            #
+            # A successful edit redirects to the page.  If the page has
+            # been changed since the version we remembered, Trac returns
+            # the edit form again, so read the current version and try
+            # once more.
+            #
+            version = self._edit_version(pagepath)
+            postdata = self._edit_form(text, comment, version)
+            response = self._request('POST', self.url + "/wiki/" + pagepath,
+                                     data=postdata, op='set')
+        if response.history:
+            try:
+                self._versions[pagepath] = str(int(version or 0) + 1)
+            except ValueError:
+                pass
+            self._forget_index(pagepath)
+        else:
+            self._versions.pop(pagepath, None)
+            raise ValueError(("Could not save wiki page {0} (status " +
+                              "{1:d})!").format(pagepath,
+                                                response.status_code))
+        return
+
+    def _edit_version(self, pagepath):
+        """Read the current version of a wiki page from its edit form.
+
+        Parameters
+        ----------
+        pagepath : :class:`str`
+            Wiki page to edit.
+
+        Returns
+        -------
+        :class:`str`
+            The version, or ``None`` if the form does not contain one.
+        """
+        response = self._request('GET', self.url + "/wiki/" + pagepath +
+                                 "?action=edit", stream=True, op='set')
+        parser = self._parse(response, SimpleWikiHTMLParser('version'))
+        return parser.search_value
+
+    def _conflict(self, response, version):
+        """Check whether an edit was rejected because the page has
+        changed since `version`.
+
+        Parameters
+        ----------
+        response : :class:`requests.Response`
+            The response to the edit.
+        version : :class:`str`
+            The version submitted with the edit.
+
+        Returns
+        -------
+        :class:`bool`
+            ``True`` if the server returned the edit form for a different
+            version.
+        """
+        if response.status_code != 200:
+            return False
+        parser = SimpleWikiHTMLParser('version')
+        self._parse_text(response, parser.feed)
+        return (parser.search_value is not None and
+                parser.search_value != version)
+
+    def set_many(self, pages, comment=None, jobs=4):
+        """Replace the text of several wiki pages.
+
+        With XML-RPC, up to `rpc_batch` pages are written at once.
+
+        Parameters
+        ----------
+        pages : :class:`dict`
+            The wiki text, keyed by page.
+        comment : :class:`str`, optional
+            A comment on the changes.
+        jobs : :class:`int`, optional
+            Number of requests to make in parallel.
+        """
+        pagepaths = sorted(pages)
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            if self._rpc_endpoint() is None:
+                list(executor.map(lambda p: self.set(p, pages[p], comment),
+                                  pagepaths))
+                return
+            batches = [[('wiki.putPage', (unquote(p), pages[p],
+                                          {'comment': comment or ''}))
+                        for p in pagepaths[i:i+self.rpc_batch]]
+                       for i in range(0, len(pagepaths), self.rpc_batch)]
+            list(executor.map(lambda b: self._rpc_multicall(b, op='set'),
+                              batches))
+        for p in pagepaths:
+            self._forget_index(p)
+        return
+
+    def push(self, srcdir, comment=None, manifest=None, jobs=4):
+        """Upload a directory of text files to the wiki, skipping pages
+        that have not changed.
+
+        Parameters
+        ----------
+        srcdir : :class:`str`
+            Directory containing ``.txt`` files laid out as by
+            :meth:`export_all`.
+        comment : :class:`str`, optional
+            A comment on the changes.
+        manifest : :class:`str`, optional
+            A file recording the hash of each page as last uploaded.  Pages
+            whose hash matches are skipped without contacting the server.
+            Otherwise, the text on the server is compared to the file.
+        jobs : :class:`int`, optional
+            Number of pages to process in parallel.
+
+        Returns
+        -------
+        :class:`dict`
+            A dictionary where the keys are wiki page names and the values
+            are ``True`` if the page was uploaded, ``False`` if it was
+            unchanged.
+        """
+        filenames = list()
+        for dirpath, dirnames, files in os.walk(srcdir):
+            dirnames.sort()
+            filenames += [os.path.join(dirpath, f) for f in sorted(files)
+                          if f.endswith('.txt')]
+        hashes = dict() if manifest is None else Manifest(manifest)
+        if self._rpc_endpoint() is not None:
+            try:
+                return self._push_rpc(srcdir, filenames, comment, hashes,
+                                      jobs)
+            finally:
+                if manifest is not None:
+                    hashes.save()
+
+        def push(filename):
+            pagepath = filename_page(srcdir, filename)
+            with open(filename) as t:
+                text = t.read()
+            h = content_hash(CRLF(text))
+            if hashes.get(pagepath) == h:
+                return (pagepath, False)
+            current = self._read(pagepath)
+            changed = current is None or CRLF(current) != CRLF(text)
+            if changed:
+                self.set(pagepath, text, comment)
+            hashes[pagepath] = h
+            return (pagepath, changed)
+
+        #
+        # Save the hashes of the pages written so far, even if one fails.
+        #
+        try:
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                pushed = dict(executor.map(push, filenames))
+        finally:
+            if manifest is not None:
+                hashes.save()
+        return pushed
+
+    def _push_rpc(self, srcdir, filenames, comment, hashes, jobs):
+        """Upload text files with XML-RPC, comparing and writing many
+        pages in each request.
+
+        Parameters
+        ----------
+        srcdir : :class:`str`
+            Directory containing the files.
+        filenames : :class:`list`
+            Files to upload.
+        comment : :class:`str`
+            A comment on the changes.
+        hashes : :class:`dict`
+            Hash of each page as last uploaded.  Updated in place.
+        jobs : :class:`int`
+            Number of requests to make in parallel.
+
+        Returns
+        -------
+        :class:`dict`
+            See :meth:`push`.
+        """
+        pushed = dict()
+        texts = dict()
+        for filename in filenames:
+            pagepath = filename_page(srcdir, filename)
+            with open(filename) as t:
+                text = t.read()
+            h = content_hash(CRLF(text))
+            if hashes.get(pagepath) == h:
+                pushed[pagepath] = False
+            else:
+                texts[pagepath] = (text, h)
+        #
+        # Reading a page that does not exist is a fault, so only compare
+        # pages that are in the index.
+        #
+        existing = set([unquote(p) for p in self.index()])
+        compare = sorted([p for p in texts if p in existing])
+        changed = dict([(p, texts[p][0]) for p in texts
+                        if p not in existing])
+        for pagepath, current in zip(compare, self.get_many(compare, jobs)):
+            if CRLF(current) != CRLF(texts[pagepath][0]):
+                changed[pagepath] = texts[pagepath][0]
+        self.set_many(changed, comment, jobs)
+        for pagepath in texts:
+            hashes[pagepath] = texts[pagepath][1]
+            pushed[pagepath] = pagepath in changed
+        return pushed
+
+    def attachments(self, pagepath):
+        """Return a list of files attached to a particular page.
+
+        Parameters
+        ----------
+        pagepath : :class:`str`
+            Wiki page to attach to.
+
+        Returns
+        -------
+        :class:`dict`
+            A dictionary where the keys are file names and the values are
+            sub-dictionaries that contain the size and mtime of the file.
+            If there are no attachments, the dictionary will be empty.
+        """
+        response = self._request('GET', self.url + "/attachment/wiki/" +
+                                 pagepath + "/", stream=True,
+                                 op='attachments')
+        parser = self._parse(response, SimpleAttachmentHTMLParser())
+        return parser.attachments
+
+    def attach(self, pagepath, filename, description=None, replace=False,
+               progress=None):
+        """Attaches a file to a wiki page.
 
-    def __init__(self, url=None, passfile=None, realm=None, debug=False):
-        self._realm = realm
-        self._debug = debug
+        The file is read from disk as it is uploaded, so memory use does not
+        depend on the size of the file.
+
+        Parameters
+        ----------
+        pagepath : :class:`str`
+            Wiki page to attach to.
+        filename : :class:`str`, :func:`tuple` or file object
+            Name of the file to attach.  If a tuple is passed, the first item
+            should be the name of the file, & the second item should be the
+            data that the file should contain, either :class:`bytes` or a
+            file object open in binary mode.  A file object opened in
+            binary mode may also be passed directly, if it has a ``name``.
+        description : :class:`str`, optional
+            If supplied, this description will be added as a comment on the
+            attachment.
+        replace : :class:`bool`, optional
+            Set this to ``True`` if the file is replacing an existing file.
+        progress : callable, optional
+            Called as ``progress(bytes_sent, total_bytes)`` during the upload.
+
+        Raises
+        ------
+        ValueError
+            If the server did not accept the file, or a file object has no
+            name.
+        """
         #
-        # Handle login
+        # Examine the file
         #
-        if url is None:
-            raise ValueError("A Trac URL is required!")
-        self.url = url
-        foo = self.url.split('/')
-        self._baseurl = foo[0] + '//' + foo[2]
-        if passfile is None:
-            username, password = self._readPasswordNetrc(self._baseurl)
+        close = False
+        if isinstance(filename, tuple):
+            fname = basename(filename[0])
+            f = filename[1]
+            if isinstance(f, bytes):
+                f = BytesIO(f)
+        elif hasattr(filename, 'read'):
+            #
+            # In-memory files, such as BytesIO, have no name.
+            #
+            name = getattr(filename, 'name', None)
+            if not isinstance(name, str):
+                raise ValueError("Pass a (name, file) tuple to attach a " +
+                                 "file object without a name!")
+            fname = basename(name)
+            f = filename
         else:
-            username, password = self._readPassword(passfile)
-        if password is None:
-            raise ValueError(('Could not find a password for ' +
-                              '{0}!').format(self.url))
-        # if self._realm is not None:
-        #     auth_handler = HTTPDigestAuthHandler()
-        #     auth_handler.add_password(realm=self._realm,
-        #                               uri=self.url,
-        #                               user=username,
-        #                               passwd=password)
-        #     self.opener.add_handler(auth_handler)
-        response = r.get(self.url + "/login")
-        self._cookies = response.cookies
-        if self._debug:
-            print(response.request.headers)
-            print(response.status_code)
-            print(response.headers)
-        assert 'trac_form_token' in self._cookies
-        self._form_token = self._cookies['trac_form_token']
-        if self._realm is None:
-            postdata = {'username': username,
-                        'password': password,
-                        '__FORM_TOKEN': self._form_token,
-                        'referer': self.url + "/login"}
-            response = r.post(self.url + "/login", data=postdata,
-                              cookies=self._cookies)
-            if self._debug:
-                print(response.request.headers)
-                print(response.status_code)
-                print(response.headers)
+            fname = basename(filename)
+            f = open(filename, 'rb')
+            close = True
+        fields = [('__FORM_TOKEN', self._form_token),
+                  ('action', 'new'),
+                  ('realm', 'wiki'),
+                  ('id', pagepath)]
+        if description is not None:
+            fields.append(('description', description))
+        if replace:
+            fields.append(('replace', 'on'))
+        fields.append(('attachment', (fname, f, 'application/octet-stream')))
+        try:
+            body = MultipartEncoder(fields, progress)
             #
-            # The cookie named 'trac_auth' is obtained after the POST to the
-            # login page but before the redirect to the wiki front page.
-            # Technically it is obtained in the HTTP headers of the redirect.
+            # If successful, the initial response should be a redirect.
             #
-            self._cookies.update(response.history[0].cookies)
-        assert 'trac_auth' in self._cookies
+            response = self._request('POST', self.url + "/attachment/wiki/" +
+                                     pagepath + "/?action=new", data=body,
+                                     headers={'Content-Type':
+                                              body.content_type}, op='attach')
+        finally:
+            if close:
+                f.close()
+        if not response.history:
+            raise ValueError(("Could not attach {0} to {1} (status " +
+                              "{2:d})!").format(fname, pagepath,
+                                                response.status_code))
         return
 
-    def _readPassword(self, passfile):
-        """Read the password file & return the username & password.
+    def sync_attachments(self, pagepath, srcdir, manifest=None, jobs=4):
+        """Upload the files in a directory that are missing from, or
+        different from, the attachments on a wiki page.
 
         Parameters
         ----------
-        passfile : :class:`str`
-            File containing Trac username and password.
+        pagepath : :class:`str`
+            Wiki page to attach to.
+        srcdir : :class:`str`
+            Directory containing the files.  Subdirectories are ignored.
+        manifest : :class:`str`, optional
+            A file recording the hash of each file as last uploaded.  If
+            set, a file is uploaded if its hash has changed.  Otherwise,
+            a file is uploaded if its size differs from the attachment, or it
+            was modified after the attachment was uploaded.
+        jobs : :class:`int`, optional
+            Number of files to upload in parallel.
 
         Returns
         -------
-        :func:`tuple`
-            A tuple containing the username and password.
+        :class:`dict`
+            A dictionary where the keys are file names and the values
+            are ``True`` if the file was uploaded, ``False`` if it was
+            unchanged.
         """
-        with open(passfile, 'r') as pf:
-            username = (pf.readline()).strip()
-            password = (pf.readline()).strip()
-        return (username, password)
+        listing = self.attachments(pagepath)
+        hashes = dict() if manifest is None else Manifest(manifest)
+        filenames = [os.path.join(srcdir, f)
+                     for f in sorted(os.listdir(srcdir))
+                     if os.path.isfile(os.path.join(srcdir, f))]
+        if manifest is not None:
+            filenames = [f for f in filenames
+                         if os.path.abspath(f) != os.path.abspath(manifest)]
 
-    def _readPasswordNetrc(self, url):
-        """Read the Trac username and password from a .netrc file.
+        def sync(filename):
+            fname = basename(filename)
+            remote = listing.get(fname, listing.get(quote(fname)))
+            key = pagepath + '/' + fname
+            st = os.stat(filename)
+            h = None
+            if remote is None:
+                changed = True
+            elif manifest is not None:
+                h = file_hash(filename)
+                changed = (hashes.get(key) != h or
+                           remote['size'] != st.st_size)
+            else:
+                changed = remote['size'] != st.st_size
+                try:
+                    mtime = datetime.strptime(remote['mtime'],
+                                              '%Y-%m-%dT%H:%M:%S%z')
+                    changed = changed or st.st_mtime > mtime.timestamp()
+                except (TypeError, ValueError):
+                    pass
+            if changed:
+                self.attach(pagepath, filename, replace=remote is not None)
+            if manifest is not None:
+                hashes[key] = h if h is not None else file_hash(filename)
+            return (fname, changed)
+
+        try:
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                synced = dict(executor.map(sync, filenames))
+        finally:
+            if manifest is not None:
+                hashes.save()
+        return synced
+
+    def _attachment_url(self, pagepath, filename):
+        """Construct the URL of the raw data of an attached file.
+        """
+        return (self.url + '/raw-attachment/wiki/' + pagepath + '/' +
+                basename(filename))
+
+    @staticmethod
+    def _validator(response):
+        """Return the strong ETag of `response`, or its Last-Modified
+        time, for use in an If-Range header.
+        """
+        etag = response.headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            return etag
+        return response.headers.get('Last-Modified')
+
+    def _resume(self, url, part, chunk_size):
+        """Download `url` into `part`, requesting only the bytes not
+        already in `part`.
+
+        The validator of the file, its ETag or Last-Modified time, is saved
+        in `part` plus ``.validator``, and sent with the Range request, so
+        that the server sends the whole file again if it has changed.  A
+        partial file without a validator is downloaded again.
 
         Parameters
         ----------
         url : :class:`str`
-            URL of the Trac server
+            URL of the file.
+        part : :class:`str`
+            Name of the partial file.  If the server ignores the Range
+            request, it is overwritten.
+        chunk_size : :class:`int`
+            Size in bytes of each chunk written.
+        """
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        validator_file = part + '.validator'
+        validator = None
+        if os.path.exists(validator_file):
+            with open(validator_file) as v:
+                validator = v.read().strip()
+        headers = dict()
+        if offset > 0 and validator:
+            headers['Range'] = 'bytes={0:d}-'.format(offset)
+            headers['If-Range'] = validator
+        response = self._request('GET', url, headers=headers, stream=True,
+                                 op='detach')
+        try:
+            if response.status_code == 416:
+                #
+                # Nothing left to download.
+                #
+                return
+            response.raise_for_status()
+            mode = 'wb'
+            if response.status_code == 206:
+                content_range = response.headers.get('Content-Range', '')
+                if (content_range.startswith('bytes {0:d}-'.format(offset))
+                        and self._validator(response) == validator):
+                    mode = 'ab'
+                else:
+                    #
+                    # Unexpected range, or the file has changed, start
+                    # again.
+                    #
+                    self._finish(response)
+                    response = self._request('GET', url, stream=True,
+                                             op='detach')
+                    response.raise_for_status()
+            if mode == 'wb':
+                validator = self._validator(response)
+                if validator:
+                    with open(validator_file, 'w') as v:
+                        v.write(validator + '\n')
+                elif os.path.exists(validator_file):
+                    os.remove(validator_file)
+            with open(part, mode) as f:
+                for chunk in self._stream(response, chunk_size):
+                    f.write(chunk)
+        finally:
+            self._finish(response)
+        return
+
+    def iter_detach(self, pagepath, filename, chunk_size=2**16):
+        """Iterate over the contents of a file attached to a wiki page,
+        without reading the whole file into memory.
+
+        Parameters
+        ----------
+        pagepath : :class:`str`
+            Wiki page that contains attached file.
+        filename : :class:`str`
+            Name of the file to read.
+        chunk_size : :class:`int`, optional
+            Size in bytes of each chunk.
+
+        Yields
+        ------
+        :class:`bytes`
+            Chunks of the file.
+        """
+        response = self._request('GET',
+                                 self._attachment_url(pagepath, filename),
+                                 stream=True, op='detach')
+        try:
+            response.raise_for_status()
+            for chunk in self._stream(response, chunk_size):
+                yield chunk
+        finally:
+            self._finish(response)
+        return
+
+    def detach(self, pagepath, filename, save=True, destination=None,
+               stream=False, chunk_size=2**16, resume=False):
+        """Grab a file attached to a wiki page.
+
+        Parameters
+        ----------
+        pagepath : :class:`str`
+            Wiki page that contains attached file.
+        filename : :class:`str`
+            Name of the file to read. The name had better match an
+            actual attached file!
+        save : :class:`bool`, optional
+            If set to ``False``, no file will be saved, but the data will still
+            be returned.
+        destination : :class:`str`, optional
+            Save the file with this name instead of `filename`.
+        stream : :class:`bool`, optional
+            If set to ``True``, write the file to disk in chunks of
+            `chunk_size` bytes, so memory use does not depend on the size of
+            the file.  The data are written to a temporary file that is
+            renamed when complete, and the name of the file is returned
+            instead of the data.  Use :meth:`iter_detach` to stream data
+            without saving.
+        chunk_size : :class:`int`, optional
+            Size in bytes of each chunk written in streaming mode.
+        resume : :class:`bool`, optional
+            If set to ``True``, stream the file to `destination` plus
+            ``.part``.  If that file already exists, from an interrupted
+            download of the same version of the file, only request the
+            missing bytes from the server.  The
+            size of the complete file is checked against
+            :meth:`attachments`.  Implies `stream`.
 
         Returns
         -------
-        :func:`tuple`
-            A tuple containing the username and password.  If there is no
-            .netrc file, or if the Trac server is not present,
-            returns ``None``.
+        :class:`str`
+            The raw data read from the file, or the name of the saved file in
+            streaming mode.
+
+        Raises
+        ------
+        ValueError
+            If the size of a resumed download does not match the list of
+            attachments, or the file is not in the list.
         """
-        from netrc import netrc
-        try:
-            rc = netrc()
-        except IOError:
-            return None
-        trachost = url[url.index('//')+2:]
-        if trachost.find('/') > 0:
-            foo = hostname.split('/')
-            trachost = foo[0]
+        if destination is None:
+            destination = unquote(filename)
+        if resume:
+            if not save:
+                raise ValueError("Resumable mode requires save=True!")
+            part = destination + '.part'
+            self._resume(self._attachment_url(pagepath, filename), part,
+                         chunk_size)
+            size = os.path.getsize(part)
+            listing = self.attachments(pagepath)
+            name = basename(filename)
+            if name not in listing:
+                name = quote(unquote(name))
+            if name not in listing:
+                raise ValueError(("{0} is not attached to " +
+                                  "{1}!").format(filename, pagepath))
+            expected = listing[name]['size']
+            if size != expected:
+                if size > expected:
+                    os.remove(part)
+                    if os.path.exists(part + '.validator'):
+                        os.remove(part + '.validator')
+                raise ValueError(("Downloaded {0:d} bytes of {1}, " +
+                                  "expected {2:d}!").format(size, filename,
+                                                            expected))
+            os.replace(part, destination)
+            if os.path.exists(part + '.validator'):
+                os.remove(part + '.validator')
+            return destination
+        if stream:
+            if not save:
+                raise ValueError("Streaming mode requires save=True!")
+            tmp = '{0}.{1:d}.{2:d}.tmp'.format(destination, os.getpid(),
+                                               threading.get_ident())
+            try:
+                with open(tmp, 'wb') as f:
+                    for chunk in self.iter_detach(pagepath, filename,
+                                                  chunk_size):
+                        f.write(chunk)
+                os.replace(tmp, destination)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+            return destination
+        #
+        # Get the file
+        #
+        response = self._request('GET',
+                                 self._attachment_url(pagepath, filename),
+                                 op='detach')
+        #
+        # Write the file
+        #
+        if save:
+            with open(destination, 'wb') as f:
+                f.write(response.content)
+        return response.content
+
+    def detach_all(self, pagepath, destdir, jobs=4):
+        """Download all files attached to a wiki page, several at once.
+
+        Parameters
+        ----------
+        pagepath : :class:`str`
+            Wiki page that contains attached files.
+        destdir : :class:`str`
+            Directory to save the files in.
+        jobs : :class:`int`, optional
+            Number of files to download in parallel.
+
+        Returns
+        -------
+        :class:`list`
+            The names of the files written.
+
+        Raises
+        ------
+        ValueError
+            If the size of any downloaded file does not match the size
+            in the list of attachments, or the name of a file is not
+            valid.
+        """
+        attachments = self.attachments(pagepath)
+        #
+        # Names sent by the server must not lead outside destdir.
+        #
+        destinations = dict([(fname, attachment_filename(destdir, fname))
+                             for fname in attachments])
+        os.makedirs(destdir, exist_ok=True)
+
+        def download(fname):
+            return self.detach(pagepath, fname,
+                               destination=destinations[fname], stream=True)
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            filenames = list(executor.map(download, attachments))
+        bad = [f for a, f in zip(attachments, filenames)
+               if attachments[a]['size'] != os.path.getsize(f)]
+        if bad:
+            raise ValueError(("Size of downloaded file(s) {0} does not " +
+                              "match the attachment list!").format(
+                                  ', '.join(bad)))
+        return filenames
+
+    def close(self, logout=True):
+        """Close the connection by logging out.
+
+        Parameters
+        ----------
+        logout : :class:`bool`, optional
+            If set to ``False``, only close the network connections, so
+            that a cached session can be used again.
+        """
+        if logout:
+            response = self._request('GET', self.url + '/logout',
+                                     op='logout')
+            if self._session_cache is not None:
+                self._session_cache.remove(self.url, self._username)
+        self._session.close()
+        return
+
+    logout = close
+
+
+class AsyncConnection(_ConnectionBase):
+    """A representation of the connection to Trac for use with
+    :mod:`asyncio`.
+
+    This requires the optional aiohttp_ package.  Log in with
+    :meth:`login`, or use the object as an asynchronous context manager::
+
+        async with AsyncConnection(url) as c:
+            pages = await c.index()
+
+    .. _aiohttp: https://docs.aiohttp.org
+
+    Parameters
+    ----------
+    url : :class:`str`
+        The base URL of the Trac server.
+    passfile : :class:`str`, optional
+        A file containing username and password.  Overrides ~/.netrc.
+    debug : :class:`bool`, optional
+        If set to ``True``, print more information.
+    concurrency : :class:`int`, optional
+        Maximum number of requests in flight at the same time.
+    """
+
+    def __init__(self, url=None, passfile=None, debug=False, concurrency=10):
         try:
-            username, account, password = rc.hosts[trachost]
-        except KeyError:
-            return None
-        return (username, password)
+            import aiohttp
+        except ImportError:
+            raise ImportError("AsyncConnection requires aiohttp!")
+        self._debug = debug
+        self._concurrency = concurrency
+        self._session = None
+        self._semaphore = None
+        self._username, self._password = self._credentials(url, passfile)
+        return
+
+    async def __aenter__(self):
+        await self.login()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+        return
 
-    def index(self):
+    async def _request(self, method, url, **kwargs):
+        """Send a request, limiting the number of requests in flight.
+
+        Parameters
+        ----------
+        method : :class:`str`
+            HTTP method, *e.g.* ``'GET'``.
+        url : :class:`str`
+            Full URL of the request.
+        kwargs : :class:`dict`
+            Additional keyword arguments passed to
+            :meth:`aiohttp.ClientSession.request`.
+
+        Returns
+        -------
+        :class:`bytes`
+            The body of the response.
+        """
+        async with self._semaphore:
+            async with self._session.request(method, url,
+                                             **kwargs) as response:
+                body = await response.read()
+                if self._debug:
+                    print(response.request_info.headers)
+                    print(response.status)
+                    print(response.headers)
+        return body
+
+    def _cookie(self, name):
+        """Return the value of a cookie set by the Trac server.
+        """
+        for cookie in self._session.cookie_jar:
+            if cookie.key == name:
+                return cookie.value
+        raise KeyError(name)
+
+    async def login(self):
+        """Log in to the Trac server.
+        """
+        import asyncio
+        import aiohttp
+        self._semaphore = asyncio.Semaphore(self._concurrency)
+        connector = aiohttp.TCPConnector(limit=self._concurrency)
+        self._session = aiohttp.ClientSession(connector=connector)
+        await self._request('GET', self.url + "/login")
+        self._form_token = self._cookie('trac_form_token')
+        postdata = {'username': self._username,
+                    'password': self._password,
+                    '__FORM_TOKEN': self._form_token,
+                    'referer': self.url + "/login"}
+        await self._request('POST', self.url + "/login", data=postdata)
+        assert self._cookie('trac_auth')
+        return
+
+    async def index(self):
         """Get and parse the TitleIndex page.
 
         Returns
@@ -139,16 +2085,12 @@ class Connection(object):
         index : :class:`list`
             A list of all Trac wiki pages.
         """
-        response = r.get(self.url + "/wiki/TitleIndex", cookies=self._cookies)
-        if self._debug:
-            print(response.request.headers)
-            print(response.status_code)
-            print(response.headers)
+        body = await self._request('GET', self.url + "/wiki/TitleIndex")
         parser = SimpleIndexHTMLParser()
-        parser.feed(response.text)
+        parser.feed(body.decode('utf-8'))
         return parser.TitleIndex
 
-    def get(self, pagepath):
+    async def get(self, pagepath):
         """Requests a wiki page in text format.
 
         Parameters
@@ -159,20 +2101,13 @@ class Connection(object):
         Returns
         -------
         :class:`str`
-            The text of the wiki page.  Note that in some cases, the text of
-            the page may contain UTF-8 characters, so a further conversion to
-            unicode may be warranted. The text may also contain Windows
-            (CRLF) line endings.
+            The text of the wiki page.
         """
-        response = r.get(self.url + "/wiki/" + pagepath + "?format=txt",
-                         cookies=self._cookies)
-        if self._debug:
-            print(response.request.headers)
-            print(response.status_code)
-            print(response.headers)
-        return response.text
+        body = await self._request('GET', self.url + "/wiki/" + pagepath +
+                                   "?format=txt")
+        return body.decode('utf-8')
 
-    def set(self, pagepath, text, comment=None):
+    async def set(self, pagepath, text, comment=None):
         """Inputs text into the wiki input text box.
 
         Parameters
@@ -184,32 +2119,16 @@ class Connection(object):
         comment : :class:`str`, optional
             A comment on the change.
         """
-        response = r.get(self.url + "/wiki/" + pagepath + "?action=edit",
-                         cookies=self._cookies)
-        if self._debug:
-            print(response.request.headers)
-            print(response.status_code)
-            print(response.headers)
+        body = await self._request('GET', self.url + "/wiki/" + pagepath +
+                                   "?action=edit")
         parser = SimpleWikiHTMLParser('version')
-        parser.feed(response.text)
-        postdata = {'__FORM_TOKEN': self._form_token,
-                    'from_editor': '1',
-                    'action': 'edit',
-                    'version': parser.search_value,
-                    'save': 'Submit changes',
-                    'text': CRLF(text)}
-        if comment is not None:
-            postdata['comment'] = CRLF(comment)
-        response = r.post(self.url + "/wiki/" + pagepath,
-                          data=postdata,
-                          cookies=self._cookies)
-        if self._debug:
-            print(response.request.headers)
-            print(response.status_code)
-            print(response.headers)
+        parser.feed(body.decode('utf-8'))
+        postdata = self._edit_form(text, comment, parser.search_value)
+        await self._request('POST', self.url + "/wiki/" + pagepath,
+                            data=postdata)
         return
 
-    def attachments(self, pagepath):
+    async def attachments(self, pagepath):
         """Return a list of files attached to a particular page.
 
         Parameters
@@ -222,19 +2141,15 @@ class Connection(object):
         :class:`dict`
             A dictionary where the keys are file names and the values are
             sub-dictionaries that contain the size and mtime of the file.
-            If there are no attachments, the dictionary will be empty.
         """
-        response = r.get(self.url + "/attachment/wiki/" + pagepath + "/",
-                         cookies=self._cookies)
-        if self._debug:
-            print(response.request.headers)
-            print(response.status_code)
-            print(response.headers)
+        body = await self._request('GET', self.url + "/attachment/wiki/" +
+                                   pagepath + "/")
         parser = SimpleAttachmentHTMLParser()
-        parser.feed(response.text)
+        parser.feed(body.decode('utf-8'))
         return parser.attachments
 
-    def attach(self, pagepath, filename, description=None, replace=False):
+    async def attach(self, pagepath, filename, description=None,
+                     replace=False):
         """Attaches a file to a wiki page.
 
         Parameters
@@ -244,50 +2159,88 @@ class Connection(object):
         filename : :class:`str` or :func:`tuple`
             Name of the file to attach.  If a tuple is passed, the first item
             should be the name of the file, & the second item should be the
-            data that the file should contain.
+            data that the file should contain, either :class:`bytes` or a
+            file object open in binary mode.
         description : :class:`str`, optional
             If supplied, this description will be added as a comment on the
             attachment.
         replace : :class:`bool`, optional
             Set this to ``True`` if the file is replacing an existing file.
         """
-        #
-        # Read and examine the file
-        #
+        import asyncio
+        import aiohttp
         if isinstance(filename, tuple):
             fname = basename(filename[0])
-            fbytes = filename[1]
+            f = filename[1]
+            close = False
         else:
-            with open(filename, 'rb') as f:
-                fbytes = f.read()
+            #
+            # aiohttp reads an open file in a thread as it is uploaded, so
+            # the event loop is not blocked by file I/O.
+            #
             fname = basename(filename)
-        #
-        # Filename = None prevents the filename from being set in the
-        # multipart/form-data payload.
-        #
-        files = {'attachment': (fname, fbytes, 'application/octet-stream'),
-                 '__FORM_TOKEN': (None, self._form_token),
-                 'action': (None, 'new'),
-                 'realm': (None, 'wiki'),
-                 'id': (None, pagepath)}
-        if description is not None:
-            files['description'] = (None, description)
-        if replace:
-            files['replace'] = (None, 'on')
-        response = r.post(self.url + "/attachment/wiki/" +
-                          pagepath + "/?action=new", files=files,
-                          cookies=self._cookies)
-        #
-        # If successful, the initial response should be a redirect.
-        #
-        if self._debug:
-            print(response.request.headers)
-            print(response.request.body)
-            print(response.status_code)
-            print(response.headers)
+            loop = asyncio.get_running_loop()
+            f = await loop.run_in_executor(None, open, filename, 'rb')
+            close = True
+        try:
+            form = aiohttp.FormData()
+            form.add_field('attachment', f, filename=fname,
+                           content_type='application/octet-stream')
+            form.add_field('__FORM_TOKEN', self._form_token)
+            form.add_field('action', 'new')
+            form.add_field('realm', 'wiki')
+            form.add_field('id', pagepath)
+            if description is not None:
+                form.add_field('description', description)
+            if replace:
+                form.add_field('replace', 'on')
+            await self._request('POST', self.url + "/attachment/wiki/" +
+                                pagepath + "/?action=new", data=form)
+        finally:
+            if close:
+                f.close()
         return
 
-    def detach(self, pagepath, filename, save=True):
+    async def _download(self, url, destination, chunk_size=2**16):
+        """Save the body of a response to a file as it arrives.
+
+        The file is written in a thread, so the event loop is not blocked
+        by file I/O.
+
+        Parameters
+        ----------
+        url : :class:`str`
+            Full URL of the request.
+        destination : :class:`str`
+            Name of the file to write.
+        chunk_size : :class:`int`, optional
+            Size in bytes of each chunk written.
+
+        Returns
+        -------
+        :class:`bytes`
+            The body of the response.
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        chunks = list()
+        async with self._semaphore:
+            async with self._session.get(url) as response:
+                if self._debug:
+                    print(response.request_info.headers)
+                    print(response.status)
+                    print(response.headers)
+                f = await loop.run_in_executor(None, open, destination, 'wb')
+                try:
+                    async for chunk in response.content.iter_chunked(
+                            chunk_size):
+                        await loop.run_in_executor(None, f.write, chunk)
+                        chunks.append(chunk)
+                finally:
+                    await loop.run_in_executor(None, f.close)
+        return b''.join(chunks)
+
+    async def detach(self, pagepath, filename, save=True, destination=None):
         """Grab a file attached to a wiki page.
 
         Parameters
@@ -295,47 +2248,31 @@ class Connection(object):
         pagepath : :class:`str`
             Wiki page that contains attached file.
         filename : :class:`str`
-            Name of the file to read. The name had better match an
-            actual attached file!
+            Name of the file to read.
         save : :class:`bool`, optional
             If set to ``False``, no file will be saved, but the data will still
             be returned.
+        destination : :class:`str`, optional
+            Save the file with this name instead of `filename`.
 
         Returns
         -------
-        :class:`str`
+        :class:`bytes`
             The raw data read from the file.
         """
-        #
-        # Construct url for attachment
-        #
-        fullurl = (self.url + '/raw-attachment/wiki/' + pagepath + '/' +
-                   basename(filename))
-        #
-        # Get the file
-        #
-        response = r.get(fullurl, cookies=self._cookies)
-        if self._debug:
-            print(response.request.headers)
-            print(response.status_code)
-            print(response.headers)
-        #
-        # Write the file
-        #
+        url = (self.url + '/raw-attachment/wiki/' + pagepath + '/' +
+               basename(filename))
         if save:
-            ff = unquote(filename)
-            with open(ff, 'wb') as f:
-                f.write(response.content)
-        return response.content
+            if destination is None:
+                destination = unquote(filename)
+            return await self._download(url, destination)
+        return await self._request('GET', url)
 
-    def close(self):
+    async def close(self):
         """Close the connection by logging out.
         """
-        response = r.get(self.url + '/logout', cookies=self._cookies)
-        if self._debug:
-            print(response.request.headers)
-            print(response.status_code)
-            print(response.headers)
+        await self._request('GET', self.url + '/logout')
+        await self._session.close()
         return
 
     logout = close
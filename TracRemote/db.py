@@ -0,0 +1,295 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+# -*- coding: utf-8 -*-
+"""
+=============
+TracRemote.db
+=============
+
+Read wiki pages and attachments directly from a Trac environment, for
+fast bulk exports on the Trac host.
+"""
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from hashlib import sha1
+from urllib.parse import quote, unquote
+from .util import page_filename
+
+
+def attachment_path(env, pagepath, filename):
+    """Find the file holding an attachment in a Trac environment.
+
+    Trac 1.0 and later store attachments under a hash of the page and
+    file names, keeping the file name extension.
+
+    Parameters
+    ----------
+    env : :class:`str`
+        Directory of the Trac environment.
+    pagepath : :class:`str`
+        Wiki page the file is attached to.
+    filename : :class:`str`
+        Name of the attached file.
+
+    Returns
+    -------
+    :class:`str`
+        The name of the file.
+    """
+    parent = sha1(pagepath.encode('utf-8')).hexdigest()
+    name = sha1(filename.encode('utf-8')).hexdigest()
+    ext = os.path.splitext(filename)[1]
+    return os.path.join(env, 'files', 'attachments', 'wiki', parent[0:3],
+                        parent, name + ext)
+
+
+class DatabaseConnection(object):
+    """Read-only access to the wiki of a Trac environment, through its
+    database and attachment files.
+
+    The read methods match those of
+    :class:`~TracRemote.connection.Connection`, so that export tools running
+    on the Trac host can use either.  Page and file names are returned
+    quoted, as they appear in the web interface.
+
+    .. _psycopg2: https://www.psycopg.org
+
+    Parameters
+    ----------
+    env : :class:`str`
+        Directory of the Trac environment.  Unless `dsn` is set, the
+        database is the SQLite file ``db/trac.db`` in this directory.
+    dsn : :class:`str`, optional
+        Connection string of a PostgreSQL database, which requires the
+        optional psycopg2_ package.
+
+    Raises
+    ------
+    ValueError
+        If the SQLite database does not exist.
+    """
+
+    def __init__(self, env, dsn=None):
+        self.env = env
+        self._lock = threading.Lock()
+        if dsn is None:
+            db = os.path.join(env, 'db', 'trac.db')
+            if not os.path.exists(db):
+                raise ValueError(("Could not find a Trac database in " +
+                                  "{0}!").format(env))
+            self._db = sqlite3.connect('file:{0}?mode=ro'.format(quote(db)),
+                                       uri=True, check_same_thread=False)
+            self._param = '?'
+        else:
+            try:
+                import psycopg2
+            except ImportError:
+                raise ImportError("PostgreSQL databases require psycopg2!")
+            self._db = psycopg2.connect(dsn)
+            self._db.set_session(readonly=True, autocommit=True)
+            self._param = '%s'
+        return
+
+    def _query(self, sql, params=()):
+        """Run a query.
+
+        Parameters
+        ----------
+        sql : :class:`str`
+            The query, with ``?`` as a placeholder for each parameter.
+        params : :class:`tuple`, optional
+            Parameters of the query.
+
+        Returns
+        -------
+        :class:`list`
+            The rows returned.
+        """
+        with self._lock:
+            cursor = self._db.cursor()
+            try:
+                cursor.execute(sql.replace('?', self._param), params)
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+
+    def index(self, prefix=None):
+        """List the wiki pages.
+
+        Parameters
+        ----------
+        prefix : :class:`str`, optional
+            Only list pages whose names start with `prefix`.
+
+        Returns
+        -------
+        :class:`list`
+            A list of all Trac wiki pages.
+        """
+        if prefix is None:
+            rows = self._query("SELECT DISTINCT name FROM wiki")
+        else:
+            rows = self._query("SELECT DISTINCT name FROM wiki " +
+                               "WHERE substr(name, 1, ?) = ?",
+                               (len(prefix), prefix))
+        return [quote(name) for name in sorted([row[0] for row in rows])]
+
+    def get(self, pagepath):
+        """Read the latest version of a wiki page.
+
+        Parameters
+        ----------
+        pagepath : :class:`str`
+            Wiki page to read.
+
+        Returns
+        -------
+        :class:`str`
+            The text of the wiki page.
+
+        Raises
+        ------
+        ValueError
+            If the page does not exist.
+        """
+        rows = self._query("SELECT text FROM wiki WHERE name = ? " +
+                           "ORDER BY version DESC LIMIT 1",
+                           (unquote(pagepath),))
+        if not rows:
+            raise ValueError(("Wiki page {0} does not " +
+                              "exist!").format(pagepath))
+        return rows[0][0]
+
+    def export_all(self, destdir, pages=None):
+        """Save wiki pages to text files.
+
+        Parameters
+        ----------
+        destdir : :class:`str`
+            Directory to write to, see
+            :meth:`~TracRemote.connection.Connection.export_all`.
+        pages : :class:`list`, optional
+            Wiki pages to save.  By default, all pages in :meth:`index`.
+
+        Returns
+        -------
+        :class:`list`
+            The names of the files written.
+        """
+        if pages is None:
+            pages = self.index()
+        filenames = list()
+        for pagepath in pages:
+            filename = page_filename(destdir, pagepath)
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, 'w') as t:
+                t.write(self.get(pagepath))
+            filenames.append(filename)
+        return filenames
+
+    def attachments(self, pagepath):
+        """Return a list of files attached to a particular page.
+
+        Parameters
+        ----------
+        pagepath : :class:`str`
+            Wiki page.
+
+        Returns
+        -------
+        :class:`dict`
+            A dictionary where the keys are file names and the values are
+            sub-dictionaries that contain the size, mtime, author and
+            comment of the file, as in
+            :meth:`~TracRemote.connection.Connection.attachments`.
+        """
+        rows = self._query("SELECT filename, size, time, author, " +
+                           "description FROM attachment " +
+                           "WHERE type = 'wiki' AND id = ? " +
+                           "ORDER BY time, filename", (unquote(pagepath),))
+        attachments = OrderedDict()
+        for filename, size, t, author, description in rows:
+            #
+            # Since Trac 0.12, times are microseconds since the epoch.
+            #
+            mtime = datetime.fromtimestamp(t / 1000000, timezone.utc)
+            attachments[quote(filename)] = {
+                'size': size,
+                'mtime': mtime.isoformat(timespec='seconds'),
+                'author': author,
+                'comment': description}
+        return attachments
+
+    def _attachment_file(self, pagepath, filename):
+        """Find the file holding an attachment.
+
+        Raises
+        ------
+        ValueError
+            If the file does not exist.
+        """
+        path = attachment_path(self.env, unquote(pagepath),
+                               unquote(filename))
+        if not os.path.exists(path):
+            raise ValueError(("{0} is not attached to " +
+                              "{1}!").format(filename, pagepath))
+        return path
+
+    def iter_detach(self, pagepath, filename, chunk_size=2**16):
+        """Read a file attached to a wiki page in chunks.
+
+        Parameters
+        ----------
+        pagepath : :class:`str`
+            Wiki page that contains attached file.
+        filename : :class:`str`
+            Name of the file to read.
+        chunk_size : :class:`int`, optional
+            Size of each chunk in bytes.
+
+        Yields
+        ------
+        :class:`bytes`
+            The data of the file.
+        """
+        with open(self._attachment_file(pagepath, filename), 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                yield chunk
+        return
+
+    def detach(self, pagepath, filename, save=True, destination=None):
+        """Read a file attached to a wiki page.
+
+        Parameters
+        ----------
+        pagepath : :class:`str`
+            Wiki page that contains attached file.
+        filename : :class:`str`
+            Name of the file to read.
+        save : :class:`bool`, optional
+            If set to ``False``, no file will be saved, but the data will
+            still be returned.
+        destination : :class:`str`, optional
+            Save the file with this name instead of `filename`.
+
+        Returns
+        -------
+        :class:`bytes`
+            The data read from the file.
+        """
+        if destination is None:
+            destination = unquote(filename)
+        with open(self._attachment_file(pagepath, filename), 'rb') as f:
+            data = f.read()
+        if save:
+            with open(destination, 'wb') as f:
+                f.write(data)
+        return data
+
+    def close(self):
+        """Close the database connection.
+        """
+        self._db.close()
+        return
@@ -7,9 +7,16 @@ TracRemote.main
 
 Contains entry point for command-line scripts.
 """
+#
+# Only modules needed to parse and validate the command line are imported
+# here.  The HTTP client is imported when a command actually runs.
+#
 import os
 import sys
-from .connection import Connection
+import threading
+import time
+from contextlib import redirect_stdout
+from io import StringIO
 
 
 def main_args(args=None):
@@ -34,7 +41,12 @@ def main_args(args=None):
     Attach a file to a wiki page. The author will be set using the login.
 
 export <page> <name> [destination]
-    Grab an attachment from a wiki page and save it to a file.
+    Grab an attachment from a wiki page and save it to a file.  With
+    --resume, continue an interrupted download.
+
+export-all <page> <destdir>
+    Save all attachments on a wiki page to destdir.  Files are
+    downloaded in parallel, see --jobs.
 
 list <page>
     List attachments on a wiki page.
@@ -42,33 +54,110 @@ list <page>
 replace <page> <path> [description]
     Replace an existing attachment. The author will be set using the login.
 
+sync <page> <srcdir>
+    Upload the files in srcdir that are new or have changed compared to
+    the attachments on a wiki page.  See also --manifest and --jobs.
+
 """
     wiki_help = """export <path> [filename]
     Save a wiki page to a text file or stdout.
 
+export-all <destdir>
+    Save all wiki pages to text files in destdir, mirroring the wiki
+    hierarchy.  Pages are fetched in parallel, see --jobs.  With
+    --incremental, only save pages changed since the last export.
+
 import <path> [filename] [comment]
     Create a new wiki page from a text file or stdin.
 
-list
-    List wiki pages.
+list [prefix]
+    List wiki pages, optionally only those whose names start with prefix.
+
+push <srcdir> [comment]
+    Upload all text files in srcdir, as written by export-all, skipping
+    pages that have not changed.  See also --manifest.
 
 replace <path> [filename] [comment]
     Replace an existing page with a text file.
 
+"""
+    batch_help = """Read commands from FILE, or stdin if FILE is -.
+
+Each line contains one attachment or wiki command, either written as
+on the command line, for example
+
+    wiki export WikiStart WikiStart.txt
+
+or as JSON, either a list of arguments or an object with "args" and
+an optional "id" that is copied to the result, for example
+
+    {"id": 1, "args": ["attachment", "list", "WikiStart"]}
+
+Blank lines and lines starting with # are ignored.  A JSON result
+is written to stdout for each command.
 """
     parser = ArgumentParser(description=description,
                             formatter_class=RawTextHelpFormatter)
     parser.add_argument('URL', help="URL for Trac instance.")
     parser.add_argument('-d', '--debug', action='store_true',
                         help='Enable debug output.')
+    parser.add_argument('-L', '--local', action='store_true',
+                        help=('Do not forward commands to a running ' +
+                              '"serve" process.'))
+    parser.add_argument('--index-ttl', metavar='SECONDS', type=float,
+                        default=0, dest='index_ttl',
+                        help=('Cache the list of wiki pages on disk, and ' +
+                              'reuse it for SECONDS in later invocations.'))
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=4,
+                        help=('Run up to N requests in parallel for bulk ' +
+                              'commands (default %(default)s).'))
+    parser.add_argument('-m', '--manifest', metavar='FILE', default=None,
+                        help=('Record content hashes in FILE, so that bulk ' +
+                              'uploads can skip unchanged files without ' +
+                              'contacting the server.'))
+    parser.add_argument('-o', '--optimistic', action='store_true',
+                        help=('Reuse the version number of a page from a ' +
+                              'previous edit, instead of downloading the ' +
+                              'edit form before each change.'))
+    parser.add_argument('--page-cache', action='store_true',
+                        dest='page_cache',
+                        help=('Cache wiki pages on disk and revalidate ' +
+                              'them with conditional requests.'))
     parser.add_argument('-p', '--password', metavar='FILE',
                         default=None,
                         help=('Read password information from FILE ' +
                               'instead of %(default)s.'))
+    parser.add_argument('--rate', metavar='R', type=float, default=None,
+                        help=('Send at most R requests per second, on ' +
+                              'average, to the Trac server.'))
     parser.add_argument('-r', '--realm', metavar='REALM', default=None,
                         help=('Set basic or digest authentication realm, if ' +
                               'the Trac instance does not use its own ' +
                               'authentication mechanism.'))
+    parser.add_argument('--retries', metavar='N', type=int, default=3,
+                        help=('Retry requests that fail with a transient ' +
+                              'error up to N times, waiting longer after ' +
+                              'each attempt (default %(default)s).  Only ' +
+                              'requests that do not change the wiki are ' +
+                              'retried.'))
+    parser.add_argument('--rpc', action='store_true',
+                        help=('Read and write wiki pages with the XML-RPC ' +
+                              'interface of the server, if it has one.'))
+    parser.add_argument('--stats', action='store_const', const='table',
+                        default=None,
+                        help=('Print a table summarizing the time and data ' +
+                              'spent on requests to stderr.  Implies ' +
+                              '--local.'))
+    parser.add_argument('--stats-json', action='store_const', const='json',
+                        dest='stats',
+                        help='Print the summary of --stats as JSON.')
+    parser.add_argument('-S', '--socket', metavar='SOCKET', default=None,
+                        help=('Name of the socket used by the "serve" ' +
+                              'command.'))
+    parser.add_argument('-s', '--session-cache', action='store_true',
+                        dest='session_cache',
+                        help=('Cache the authenticated session on disk and ' +
+                              'reuse it in later invocations.'))
     parser.add_argument('-v', '--version', action='version',
                         version='%(prog)s '+tr_version)
     subparsers = parser.add_subparsers(dest='cmd_name')
@@ -76,18 +165,40 @@ replace <path> [filename] [comment]
                                           formatter_class=RawTextHelpFormatter,
                                           help='Manage attached files.')
     parser_attach.add_argument('command',
-                               choices=['add', 'export', 'list', 'replace'],
+                               choices=['add', 'export', 'export-all', 'list',
+                                        'replace', 'sync'],
                                help=attachment_help)
+    parser_attach.add_argument('-R', '--resume', action='store_true',
+                               help=('Resume an interrupted export from ' +
+                                     'the partial file.'))
     parser_attach.add_argument('arguments', nargs='*',
                                help='Arguments to one of the commands above.')
     parser_wiki = subparsers.add_parser('wiki',
                                         formatter_class=RawTextHelpFormatter,
                                         help='Manage wiki pages.')
     parser_wiki.add_argument('command',
-                             choices=['export', 'import', 'list', 'replace'],
+                             choices=['export', 'export-all', 'import',
+                                      'list', 'push', 'replace'],
                              help=wiki_help)
+    parser_wiki.add_argument('-i', '--incremental', action='store_true',
+                             help=('Only export pages changed since the ' +
+                                   'last incremental export.'))
     parser_wiki.add_argument('arguments', nargs='*',
                              help='Arguments to one of the commands above.')
+    parser_batch = subparsers.add_parser('batch',
+                                         formatter_class=RawTextHelpFormatter,
+                                         help=('Run many commands over a ' +
+                                               'single login.'))
+    parser_batch.add_argument('source', metavar='FILE',
+                              help=batch_help)
+    parser_batch.add_argument('-P', '--parallel', metavar='N', type=int,
+                              default=1,
+                              help=('Run up to N commands at the same ' +
+                                    'time (default %(default)s).'))
+    subparsers.add_parser('serve',
+                          help=('Keep a logged-in connection open, and ' +
+                                'run commands sent by other trac-remote ' +
+                                'processes.'))
     if args is None:
         options = parser.parse_args()
     else:
@@ -108,27 +219,82 @@ def validate_args(options):
     :class:`bool`
         ``True`` if the arguments are valid.
     """
-    nargs = {'attachment': {'add': 2, 'export': 2, 'list': 1, 'replace': 2},
-             'wiki': {'export': 1, 'import': 1, 'list': 0, 'replace': 1}
+    nargs = {'attachment': {'add': 2, 'export': 2, 'export-all': 2, 'list': 1,
+                            'replace': 2, 'sync': 2},
+             'wiki': {'export': 1, 'export-all': 1, 'import': 1, 'list': 0,
+                      'push': 1, 'replace': 1}
              }
     return len(options.arguments) >= nargs[options.cmd_name][options.command]
 
 
-def dispatch(options):
+#
+# Options used by connect(), which must match for two commands to share a
+# connection.
+#
+connection_options = ('URL', 'password', 'realm', 'debug', 'jobs',
+                      'session_cache', 'page_cache', 'optimistic', 'retries',
+                      'rate', 'index_ttl', 'rpc')
+
+#
+# Arguments of each command that are names of files, by position.
+#
+path_arguments = {('attachment', 'add'): (1,),
+                  ('attachment', 'export'): (2,),
+                  ('attachment', 'export-all'): (1,),
+                  ('attachment', 'replace'): (1,),
+                  ('attachment', 'sync'): (1,),
+                  ('wiki', 'export'): (1,),
+                  ('wiki', 'export-all'): (0,),
+                  ('wiki', 'import'): (1,),
+                  ('wiki', 'push'): (0,),
+                  ('wiki', 'replace'): (1,)}
+
+
+def connect(options):
+    """Open a connection to the Trac server described by `options`.
+
+    Parameters
+    ----------
+    options : :class:`argparse.Namespace`
+        Parsed options.
+
+    Returns
+    -------
+    :class:`~TracRemote.connection.Connection`
+        A logged-in connection.
+    """
+    from .connection import Connection
+    return Connection(options.URL, options.password, options.realm,
+                      options.debug, pool_size=max(10, options.jobs),
+                      session_cache=options.session_cache,
+                      page_cache=options.page_cache,
+                      optimistic=options.optimistic,
+                      retry=options.retries, rate=options.rate,
+                      metrics=options.stats is not None,
+                      index_ttl=options.index_ttl,
+                      index_cache=options.index_ttl > 0,
+                      rpc=options.rpc)
+
+
+def dispatch(options, connection=None):
     """Determine function to run, given arguments.
 
     Parameters
     ----------
     options : :class:`argparse.Namespace`
         Parsed options.
+    connection : :class:`~TracRemote.connection.Connection`, optional
+        Run the command over an existing connection, instead of logging in.
 
     Returns
     -------
     :class:`str`
         Any output from the commands.
     """
-    c = Connection(options.URL, options.password, options.realm,
-                   options.debug)
+    if connection is None:
+        c = connect(options)
+    else:
+        c = connection
     output = ''
     if options.cmd_name == 'attachment':
         if options.command == 'add':
@@ -139,17 +305,20 @@ def dispatch(options):
                 c.attach(options.arguments[0], options.arguments[1],
                          description=options.arguments[2], replace=False)
         if options.command == 'export':
-            #
-            # If a destination is specified, we *don't* want detach to save it.
-            #
             if len(options.arguments) > 2:
-                data = c.detach(options.arguments[0], options.arguments[1],
-                                False)
-                with open(options.arguments[2], 'wb') as f:
-                    f.write(data)
+                c.detach(options.arguments[0], options.arguments[1],
+                         destination=options.arguments[2], stream=True,
+                         resume=options.resume)
             else:
-                foo = c.detach(options.arguments[0], options.arguments[1],
-                               True)
+                c.detach(options.arguments[0], options.arguments[1],
+                         stream=True, resume=options.resume)
+        if options.command == 'export-all':
+            t0 = time.time()
+            filenames = c.detach_all(options.arguments[0],
+                                     options.arguments[1], jobs=options.jobs)
+            dt = time.time() - t0
+            output = ("Exported {0:d} attachments in {1:.1f} s.").format(
+                len(filenames), dt)
         if options.command == 'list':
             at = c.attachments(options.arguments[0])
             for fname in at:
@@ -162,6 +331,15 @@ def dispatch(options):
             else:
                 c.attach(options.arguments[0], options.arguments[1],
                          description=options.arguments[2], replace=True)
+        if options.command == 'sync':
+            t0 = time.time()
+            synced = c.sync_attachments(options.arguments[0],
+                                        options.arguments[1],
+                                        manifest=options.manifest,
+                                        jobs=options.jobs)
+            dt = time.time() - t0
+            output = ("Uploaded {0:d} of {1:d} files in {2:.1f} s.").format(
+                sum(synced.values()), len(synced), dt)
     if options.cmd_name == 'wiki':
         if options.command == 'export':
             text = c.get(options.arguments[0])
@@ -170,6 +348,14 @@ def dispatch(options):
                     t.write(text)
             else:
                 output = text
+        if options.command == 'export-all':
+            t0 = time.time()
+            filenames = c.export_all(options.arguments[0], jobs=options.jobs,
+                                     incremental=options.incremental)
+            dt = time.time() - t0
+            rate = len(filenames)/dt if dt > 0 else 0.0
+            output = ("Exported {0:d} pages in {1:.1f} s " +
+                      "({2:.1f} pages/s).").format(len(filenames), dt, rate)
         if options.command == 'import' or options.command == 'replace':
             if len(options.arguments) > 1:
                 if os.path.exists(options.arguments[1]):
@@ -182,12 +368,221 @@ def dispatch(options):
                       options.arguments[2])
             else:
                 c.set(options.arguments[0], text)
+        if options.command == 'push':
+            t0 = time.time()
+            comment = None
+            if len(options.arguments) > 1:
+                comment = options.arguments[1]
+            pushed = c.push(options.arguments[0], comment=comment,
+                            manifest=options.manifest, jobs=options.jobs)
+            dt = time.time() - t0
+            output = ("Uploaded {0:d} of {1:d} pages in {2:.1f} s.").format(
+                sum(pushed.values()), len(pushed), dt)
         if options.command == 'list':
-            title_index = c.index()
+            prefix = None
+            if options.arguments:
+                prefix = options.arguments[0]
+            title_index = c.index(prefix)
             output = "\n".join(title_index)+"\n"
     return output
 
 
+def batch_commands(stream):
+    """Parse the commands read by the ``batch`` command.
+
+    Parameters
+    ----------
+    stream : file-like
+        An open text file.
+
+    Yields
+    ------
+    :class:`tuple`
+        The line number, an optional identifier supplied with the command,
+        and the list of command-line arguments.  If a line cannot be
+        parsed, the list of arguments is replaced by the error message.
+    """
+    import json
+    import shlex
+    for n, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        tag = None
+        try:
+            if line.startswith('[') or line.startswith('{'):
+                command = json.loads(line)
+                if isinstance(command, dict):
+                    tag = command.get('id')
+                    command = command.get('args')
+                if (not isinstance(command, list) or
+                        not all([isinstance(a, str) for a in command])):
+                    raise ValueError('Expected a list of strings.')
+            else:
+                command = shlex.split(line)
+        except ValueError as e:
+            command = str(e)
+        yield (n, tag, command)
+
+
+_stdout_lock = threading.Lock()
+
+
+def batch_run(options, connection, line, tag, command):
+    """Run one command for the ``batch`` command.
+
+    Parameters
+    ----------
+    options : :class:`argparse.Namespace`
+        Options of the ``batch`` command.  Global options such as
+        ``--jobs`` apply to every command.
+    connection : :class:`~TracRemote.connection.Connection`
+        The shared connection.
+    line : :class:`int`
+        Line number of the command.
+    tag : object
+        Identifier supplied with the command, or ``None``.
+    command : :class:`list` or :class:`str`
+        Command-line arguments, or an error message from
+        :func:`batch_commands`.
+
+    Returns
+    -------
+    :class:`dict`
+        The result, containing ``ok``, and either ``output`` or ``error``.
+    """
+    from argparse import Namespace
+    result = {'line': line}
+    if tag is not None:
+        result['id'] = tag
+    if isinstance(command, str):
+        result['ok'] = False
+        result['error'] = command
+        return result
+    result['command'] = command
+    #
+    # Help and version messages are printed to stdout, which would break
+    # the stream of results, so they become the output of the command.
+    # sys.stdout is shared by all threads, so only one command is parsed
+    # at a time.
+    #
+    printed = StringIO()
+    try:
+        with _stdout_lock, redirect_stdout(printed):
+            o = main_args([options.URL] + command)
+    except SystemExit as e:
+        if not e.code:
+            result['ok'] = True
+            result['output'] = printed.getvalue()
+            return result
+        #
+        # argparse has already described the problem on stderr.
+        #
+        result['ok'] = False
+        result['error'] = 'Invalid command.'
+        return result
+    if o.cmd_name not in ('attachment', 'wiki'):
+        result['ok'] = False
+        result['error'] = 'Expected an attachment or wiki command.'
+        return result
+    if not validate_args(o):
+        result['ok'] = False
+        result['error'] = ('too few or invalid arguments to ' +
+                           '"{0.cmd_name} {0.command}"').format(o)
+        return result
+    if (o.cmd_name == 'wiki' and o.command in ('import', 'replace') and
+            len(o.arguments) < 2):
+        result['ok'] = False
+        result['error'] = 'Reading a page from stdin is not supported.'
+        return result
+    merged = Namespace(**vars(options))
+    merged.cmd_name = o.cmd_name
+    merged.command = o.command
+    merged.arguments = o.arguments
+    merged.resume = getattr(o, 'resume', False)
+    merged.incremental = getattr(o, 'incremental', False)
+    try:
+        result['output'] = dispatch(merged, connection)
+        result['ok'] = True
+    except Exception as e:
+        result['ok'] = False
+        result['error'] = '{0}: {1}'.format(type(e).__name__, e)
+    return result
+
+
+def batch(options, connection=None, output=None):
+    """Run the ``batch`` command.
+
+    Parameters
+    ----------
+    options : :class:`argparse.Namespace`
+        Parsed options.
+    connection : :class:`~TracRemote.connection.Connection`, optional
+        Run the commands over an existing connection, instead of logging in.
+    output : file-like, optional
+        Write results here instead of stdout.
+
+    Returns
+    -------
+    :class:`int`
+        The number of commands that failed.
+    """
+    import json
+    from concurrent.futures import ThreadPoolExecutor
+    if output is None:
+        output = sys.stdout
+    if connection is None:
+        c = connect(options)
+    else:
+        c = connection
+    if options.source == '-':
+        stream = sys.stdin
+    else:
+        stream = open(options.source)
+    failed = 0
+    try:
+        commands = batch_commands(stream)
+        if options.parallel > 1:
+            #
+            # Results are written in the order of the commands.  Only
+            # up to 2*parallel commands are read ahead, so that results
+            # are written as soon as they are available.
+            #
+            with ThreadPoolExecutor(max_workers=options.parallel) as pool:
+                pending = list()
+                for command in commands:
+                    pending.append(pool.submit(batch_run, options, c,
+                                               *command))
+                    while (len(pending) >= 2*options.parallel or
+                           (pending and pending[0].done())):
+                        result = pending.pop(0).result()
+                        failed += not result['ok']
+                        output.write(json.dumps(result) + '\n')
+                        output.flush()
+                for p in pending:
+                    result = p.result()
+                    failed += not result['ok']
+                    output.write(json.dumps(result) + '\n')
+                    output.flush()
+        else:
+            for command in commands:
+                result = batch_run(options, c, *command)
+                failed += not result['ok']
+                output.write(json.dumps(result) + '\n')
+                output.flush()
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+        if options.stats is not None:
+            print(c.metrics.report(options.stats), file=sys.stderr)
+        if connection is None:
+            #
+            # Logging out would end a cached session.
+            #
+            c.close(logout=not options.session_cache)
+    return failed
+
+
 def main():
     """Main entry point for the trac-remote script.
 
@@ -197,6 +592,17 @@ def main():
         An integer suitable for passing to :func:`sys.exit`.
     """
     options = main_args()
+    if options.cmd_name == 'serve':
+        from .server import serve
+        return serve(options)
+    if options.cmd_name == 'batch':
+        if options.password is not None:
+            if not os.path.exists(options.password):
+                print('Password file {0} is missing!'.format(options.password))
+                return 2
+        if batch(options) > 0:
+            return 3
+        return 0
     valid = validate_args(options)
     if not valid:
         print(('trac-remote: error: too few or invalid arguments to ' +
@@ -206,7 +612,28 @@ def main():
         if not os.path.exists(options.password):
             print('Password file {0} is missing!'.format(options.password))
             return 2
-    output = dispatch(options)
+    if not (options.local or options.stats is not None or
+            (options.cmd_name == 'wiki' and
+             options.command in ('import', 'replace') and
+             len(options.arguments) < 2)):
+        #
+        # Commands that read stdin, or measure their own requests, always
+        # run here.
+        #
+        from .server import forward
+        result = forward(sys.argv[1:], path=options.socket)
+        if result is not None:
+            if not result['ok']:
+                print('trac-remote: error: {0}'.format(result['error']),
+                      file=sys.stderr)
+                return 4
+            if result['output']:
+                print(result['output'])
+            return 0
+    c = connect(options)
+    output = dispatch(options, c)
     if output:
         print(output)
+    if options.stats is not None:
+        print(c.metrics.report(options.stats), file=sys.stderr)
     return 0
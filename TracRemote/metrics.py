@@ -0,0 +1,284 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+# -*- coding: utf-8 -*-
+"""
+==================
+TracRemote.metrics
+==================
+
+Measure the time and data spent on each request to the Trac server.
+"""
+import json
+import threading
+import time
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+#
+# Time spent opening connections by the current thread, since the last
+# call to connect_time().
+#
+_local = threading.local()
+
+
+def connect_time():
+    """Return the time spent opening connections by the current thread.
+
+    Returns
+    -------
+    :class:`float`
+        Time in seconds since the last call, including any TLS handshake.
+    """
+    t = getattr(_local, 'connect', 0.0)
+    _local.connect = 0.0
+    return t
+
+
+class TimedHTTPConnection(HTTPConnection):
+    """HTTP connection that records the time spent connecting.
+    """
+
+    def connect(self):
+        t0 = time.perf_counter()
+        try:
+            super(TimedHTTPConnection, self).connect()
+        finally:
+            _local.connect = (getattr(_local, 'connect', 0.0) +
+                              time.perf_counter() - t0)
+        return
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    """HTTPS connection that records the time spent connecting.
+    """
+
+    def connect(self):
+        t0 = time.perf_counter()
+        try:
+            super(TimedHTTPSConnection, self).connect()
+        finally:
+            _local.connect = (getattr(_local, 'connect', 0.0) +
+                              time.perf_counter() - t0)
+        return
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """Transport adapter whose connections record the time spent
+    connecting, see :func:`connect_time`.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(TimedHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool}
+        return
+
+
+def percentile(values, p):
+    """Compute a percentile by linear interpolation.
+
+    Parameters
+    ----------
+    values : :class:`list`
+        Sorted values.
+    p : :class:`float`
+        Percentile, between 0 and 100.
+
+    Returns
+    -------
+    :class:`float`
+        The percentile.
+    """
+    if not values:
+        return float('nan')
+    k = (len(values) - 1) * p / 100.0
+    i = int(k)
+    if i + 1 >= len(values):
+        return values[-1]
+    return values[i] + (values[i + 1] - values[i]) * (k - i)
+
+
+class RequestMetrics(object):
+    """Measurements of a single request.
+
+    Times are in seconds.  For requests whose body is streamed, `received`,
+    `transfer` and `parse` grow as the body is read.
+
+    Parameters
+    ----------
+    op : :class:`str`
+        Name of the operation, for example ``'get'``.
+    method : :class:`str`
+        HTTP method.
+    url : :class:`str`
+        URL of the request.
+
+    Attributes
+    ----------
+    status : :class:`int`
+        HTTP status code, or ``None`` if the request failed without a
+        response.
+    sent : :class:`int`
+        Size of the request body in bytes, if known.
+    received : :class:`int`
+        Size of the response body in bytes.
+    connect : :class:`float`
+        Time spent opening a new connection, zero for a reused
+        keep-alive connection.
+    ttfb : :class:`float`
+        Time from sending the request until the response headers arrived,
+        excluding `connect`.
+    transfer : :class:`float`
+        Time spent reading the response body.
+    parse : :class:`float`
+        Time spent parsing the response body.
+    error : :class:`Exception`
+        The exception raised if the request failed without a response.
+    """
+
+    def __init__(self, op, method, url):
+        self.op = op
+        self.method = method
+        self.url = url
+        self.status = None
+        self.sent = 0
+        self.received = 0
+        self.connect = 0.0
+        self.ttfb = 0.0
+        self.transfer = 0.0
+        self.parse = 0.0
+        self.error = None
+        return
+
+    @property
+    def total(self):
+        """Total time of the request, in seconds.
+        """
+        return self.connect + self.ttfb + self.transfer + self.parse
+
+    def to_dict(self):
+        """Convert to a dictionary, suitable for conversion to JSON.
+
+        Returns
+        -------
+        :class:`dict`
+            The measurements.
+        """
+        return {'op': self.op, 'method': self.method, 'url': self.url,
+                'status': self.status, 'sent': self.sent,
+                'received': self.received, 'connect': self.connect,
+                'ttfb': self.ttfb, 'transfer': self.transfer,
+                'parse': self.parse, 'total': self.total}
+
+
+class Metrics(object):
+    """Collect :class:`RequestMetrics` from any number of threads.
+    """
+    #
+    # Columns of the summary table, in milliseconds.
+    #
+    times = ('connect', 'ttfb', 'transfer', 'parse')
+
+    def __init__(self):
+        self._records = list()
+        self._lock = threading.Lock()
+        return
+
+    def add(self, record):
+        """Add the measurements of a request.
+
+        Parameters
+        ----------
+        record : :class:`RequestMetrics`
+            The measurements.
+        """
+        with self._lock:
+            self._records.append(record)
+        return
+
+    @property
+    def records(self):
+        """A list of all measurements so far.
+        """
+        with self._lock:
+            return list(self._records)
+
+    def clear(self):
+        """Remove all measurements.
+        """
+        with self._lock:
+            self._records = list()
+        return
+
+    def summary(self):
+        """Summarize the measurements for each operation.
+
+        Returns
+        -------
+        :class:`dict`
+            For each operation, the number of requests and errors, bytes
+            sent and received, 50th, 90th and 99th percentile of the total
+            time, and the mean time spent in each phase of the request.
+            Times are in milliseconds.
+        """
+        ops = dict()
+        for r in self.records:
+            ops.setdefault(r.op or 'other', list()).append(r)
+        summary = dict()
+        for op in sorted(ops):
+            records = ops[op]
+            n = len(records)
+            totals = sorted([1000 * r.total for r in records])
+            s = {'count': n,
+                 'errors': len([r for r in records
+                                if r.status is None or r.status >= 400]),
+                 'sent': sum([r.sent for r in records]),
+                 'received': sum([r.received for r in records]),
+                 'p50': percentile(totals, 50),
+                 'p90': percentile(totals, 90),
+                 'p99': percentile(totals, 99)}
+            for t in self.times:
+                s[t] = 1000 * sum([getattr(r, t) for r in records]) / n
+            summary[op] = s
+        return summary
+
+    def report(self, format='table'):
+        """Format a summary of the measurements.
+
+        Parameters
+        ----------
+        format : :class:`str`, optional
+            Either ``'table'`` or ``'json'``.
+
+        Returns
+        -------
+        :class:`str`
+            The report.
+        """
+        summary = self.summary()
+        if format == 'json':
+            return json.dumps(summary, indent=1, sort_keys=True)
+        lines = [('{0:<16} {1:>6} {2:>6} {3:>10} {4:>10} {5:>8} {6:>8} ' +
+                  '{7:>8} {8:>8} {9:>8} {10:>8} {11:>8}').format(
+                      'operation', 'count', 'errors', 'sent', 'received',
+                      'p50 ms', 'p90 ms', 'p99 ms', 'connect', 'ttfb',
+                      'transfer', 'parse')]
+        for op in summary:
+            s = summary[op]
+            lines.append(('{0:<16} {1[count]:>6d} {1[errors]:>6d} ' +
+                          '{1[sent]:>10d} {1[received]:>10d} ' +
+                          '{1[p50]:>8.1f} {1[p90]:>8.1f} {1[p99]:>8.1f} ' +
+                          '{1[connect]:>8.1f} {1[ttfb]:>8.1f} ' +
+                          '{1[transfer]:>8.1f} {1[parse]:>8.1f}').format(
+                              op, s))
+        lines.append('Phase columns are mean times in milliseconds.')
+        return '\n'.join(lines)
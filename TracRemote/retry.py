@@ -0,0 +1,163 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+# -*- coding: utf-8 -*-
+"""
+================
+TracRemote.retry
+================
+
+Retry failed requests and limit the rate of requests.
+"""
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+
+class RetryPolicy(object):
+    """Decide whether and when to retry a failed request.
+
+    The delay before each retry grows exponentially, with random "full"
+    jitter, so that parallel workers do not retry in lockstep.  A
+    ``Retry-After`` header sent by the server takes precedence.
+
+    Parameters
+    ----------
+    retries : :class:`int`, optional
+        Maximum number of retries of a single request.
+    backoff : :class:`float`, optional
+        Upper limit of the first delay, in seconds.  The limit doubles with
+        each retry.
+    max_backoff : :class:`float`, optional
+        Maximum delay, in seconds, including any ``Retry-After`` delay.
+    statuses : :class:`tuple`, optional
+        HTTP status codes that indicate a transient failure.
+    methods : :class:`tuple`, optional
+        HTTP methods that may be retried.  By default only idempotent
+        methods are retried, since retrying, for example, a POST that
+        reached the server could change a page twice.
+    """
+
+    def __init__(self, retries=3, backoff=0.5, max_backoff=30.0,
+                 statuses=(429, 502, 503, 504),
+                 methods=('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = statuses
+        self.methods = methods
+        return
+
+    def retryable(self, method, attempt, status=None):
+        """Check whether a request should be retried.
+
+        Parameters
+        ----------
+        method : :class:`str`
+            HTTP method of the request.
+        attempt : :class:`int`
+            Number of retries already made.
+        status : :class:`int`, optional
+            HTTP status code of the response, or ``None`` if the request
+            failed without a response, for example because the connection
+            was reset.
+
+        Returns
+        -------
+        :class:`bool`
+            ``True`` if the request should be retried.
+        """
+        if attempt >= self.retries or method.upper() not in self.methods:
+            return False
+        return status is None or status in self.statuses
+
+    def delay(self, attempt, retry_after=None):
+        """Compute the delay before a retry.
+
+        Parameters
+        ----------
+        attempt : :class:`int`
+            Number of retries already made.
+        retry_after : :class:`str`, optional
+            Value of the ``Retry-After`` header, either a number of seconds
+            or an HTTP date.
+
+        Returns
+        -------
+        :class:`float`
+            The delay in seconds.
+        """
+        if retry_after is not None:
+            try:
+                d = float(retry_after)
+            except ValueError:
+                try:
+                    d = (parsedate_to_datetime(retry_after) -
+                         datetime.now(timezone.utc)).total_seconds()
+                except (TypeError, ValueError):
+                    d = None
+            if d is not None:
+                return min(max(d, 0.0), self.max_backoff)
+        return random.uniform(0, min(self.max_backoff,
+                                     self.backoff * 2**attempt))
+
+
+class TokenBucket(object):
+    """Limit the rate of requests made by any number of threads.
+
+    Parameters
+    ----------
+    rate : :class:`float`
+        Average number of requests per second.
+    burst : :class:`int`, optional
+        Number of requests that may be made at once after a quiet period.
+        Defaults to one second's worth of requests.
+    clock : callable, optional
+        Function returning the current time in seconds.
+    sleep : callable, optional
+        Function used to wait.
+
+    Raises
+    ------
+    ValueError
+        If `rate` is not positive.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic,
+                 sleep=time.sleep):
+        if rate <= 0:
+            raise ValueError("The rate must be positive!")
+        self.rate = float(rate)
+        if burst is None:
+            burst = max(1, int(rate))
+        self.burst = burst
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(burst)
+        self._last = clock()
+        self._lock = threading.Lock()
+        return
+
+    def acquire(self):
+        """Wait until a request may be made.
+
+        Returns
+        -------
+        :class:`float`
+            The time spent waiting, in seconds.
+        """
+        #
+        # Take a token, even if that leaves a deficit, so that waiting
+        # threads are served in the order they arrived.  The wait happens
+        # outside the lock.
+        #
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            self._sleep(wait)
+        return wait
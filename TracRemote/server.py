@@ -0,0 +1,320 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+# -*- coding: utf-8 -*-
+"""
+=================
+TracRemote.server
+=================
+
+Keep logged-in connections open in a long-running process, and forward
+commands to it over a Unix domain socket.
+
+Start the server with ``trac-remote URL serve``.  While it is running,
+``trac-remote`` sends attachment and wiki commands to it, instead of
+logging in itself.
+"""
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+from socketserver import ThreadingMixIn, UnixStreamServer, StreamRequestHandler
+from .cache import cache_dir
+
+
+def socket_path():
+    """Return the default location of the server socket.
+
+    This is ``$XDG_RUNTIME_DIR/trac-remote.sock`` if ``XDG_RUNTIME_DIR``
+    is set, otherwise it is in :func:`~TracRemote.cache.cache_dir`.
+
+    Returns
+    -------
+    :class:`str`
+        The name of the socket.
+    """
+    try:
+        top = os.environ['XDG_RUNTIME_DIR']
+    except KeyError:
+        top = cache_dir()
+    return os.path.join(top, 'trac-remote.sock')
+
+
+def listening(path):
+    """Check whether a server is listening on a socket.
+
+    Parameters
+    ----------
+    path : :class:`str`
+        Name of the socket.
+
+    Returns
+    -------
+    :class:`bool`
+        ``True`` if a connection to the socket succeeds.
+    """
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+    except OSError:
+        return False
+    finally:
+        s.close()
+    return True
+
+
+def forward(args, cwd=None, path=None):
+    """Send a command to a running server.
+
+    Parameters
+    ----------
+    args : :class:`list`
+        Command-line arguments, as passed to
+        :func:`~TracRemote.main.main_args`.
+    cwd : :class:`str`, optional
+        Run the command in this directory.  Defaults to the current
+        directory.
+    path : :class:`str`, optional
+        Name of the server socket.  Defaults to :func:`socket_path`.
+
+    Returns
+    -------
+    :class:`dict`
+        The result, containing ``ok``, and either ``output`` or ``error``,
+        or ``None`` if no server is running.
+    """
+    if cwd is None:
+        cwd = os.getcwd()
+    if path is None:
+        path = socket_path()
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            s.connect(path)
+        except OSError:
+            return None
+        request = {'args': args, 'cwd': cwd}
+        try:
+            s.sendall(json.dumps(request).encode('utf-8') + b'\n')
+            s.shutdown(socket.SHUT_WR)
+            response = b''.join(iter(lambda: s.recv(2**16), b''))
+        except OSError:
+            response = b''
+    finally:
+        s.close()
+    try:
+        return json.loads(response.decode('utf-8'))
+    except ValueError:
+        #
+        # For example, the server stopped while running the command.
+        #
+        return {'ok': False, 'error': 'The server closed the connection.'}
+
+
+def resolve_paths(options, cwd):
+    """Make the file names in a command absolute.
+
+    Parameters
+    ----------
+    options : :class:`argparse.Namespace`
+        Parsed options of the command.  Changed in place.
+    cwd : :class:`str`
+        Directory of the client, which relative file names are relative
+        to.
+    """
+    from urllib.parse import unquote
+    from .main import path_arguments
+    for o in ('password', 'manifest'):
+        if getattr(options, o, None) is not None:
+            setattr(options, o, os.path.join(cwd, getattr(options, o)))
+    arguments = options.arguments
+    if (options.cmd_name, options.command) == ('attachment', 'export'):
+        if len(arguments) == 2:
+            #
+            # The file is saved under its own name by default.
+            #
+            arguments.append(unquote(arguments[1]))
+    for i in path_arguments.get((options.cmd_name, options.command), ()):
+        if i < len(arguments):
+            arguments[i] = os.path.join(cwd, arguments[i])
+    return
+
+
+class TracRemoteHandler(StreamRequestHandler):
+    """Run one command received by :class:`TracRemoteServer`.
+
+    A request is a single line of JSON, containing the command-line
+    ``args`` and the ``cwd`` of the client.  The response is a single line
+    of JSON, as returned by :meth:`TracRemoteServer.run`.
+    """
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            #
+            # A client checking whether the server is running.
+            #
+            return
+        try:
+            request = json.loads(line.decode('utf-8'))
+            result = self.server.run(request['args'], request['cwd'])
+        except (ValueError, KeyError, TypeError):
+            result = {'ok': False, 'error': 'Invalid request.'}
+        self.wfile.write(json.dumps(result).encode('utf-8') + b'\n')
+        return
+
+
+class TracRemoteServer(ThreadingMixIn, UnixStreamServer):
+    """Serve commands over a Unix domain socket, keeping connections open.
+
+    Parameters
+    ----------
+    path : :class:`str`, optional
+        Name of the socket.  Defaults to :func:`socket_path`.  The socket
+        is only accessible to its owner.
+
+    Raises
+    ------
+    ValueError
+        If another server is already listening on `path`.
+    """
+    daemon_threads = True
+
+    def __init__(self, path=None):
+        if path is None:
+            path = socket_path()
+        self.path = path
+        d = os.path.dirname(path)
+        if d and not os.path.isdir(d):
+            os.makedirs(d, mode=0o700)
+        if os.path.exists(path):
+            if listening(path):
+                raise ValueError("A server is already listening on " +
+                                 "{0}!".format(path))
+            os.remove(path)
+        self.connections = dict()
+        #
+        # Commands run in parallel, but only one of them logs in to a
+        # server that has no connection yet.
+        #
+        self._lock = threading.Lock()
+        umask = os.umask(0o177)
+        try:
+            super(TracRemoteServer, self).__init__(path, TracRemoteHandler)
+        finally:
+            os.umask(umask)
+        os.chmod(path, 0o600)
+        return
+
+    def connection(self, options):
+        """Return an open connection for `options`, logging in if necessary.
+
+        Commands share a connection only if they agree on all the options
+        that configure it.  Use :func:`resolve_paths` first, so that the
+        password file of a client is found.
+
+        Parameters
+        ----------
+        options : :class:`argparse.Namespace`
+            Parsed options.
+
+        Returns
+        -------
+        :class:`~TracRemote.connection.Connection`
+            A logged-in connection.
+        """
+        from .main import connect, connection_options
+        if options.password is not None:
+            options.password = os.path.abspath(options.password)
+        key = tuple([getattr(options, o) for o in connection_options])
+        if key not in self.connections:
+            with self._lock:
+                if key not in self.connections:
+                    self.connections[key] = connect(options)
+        return self.connections[key]
+
+    def run(self, args, cwd):
+        """Run a command.
+
+        Parameters
+        ----------
+        args : :class:`list`
+            Command-line arguments, as passed to
+            :func:`~TracRemote.main.main_args`.
+        cwd : :class:`str`
+            Directory of the client.
+
+        Returns
+        -------
+        :class:`dict`
+            The result, containing ``ok``, and either ``output`` or
+            ``error``.
+        """
+        from .main import main_args, validate_args, dispatch
+        try:
+            options = main_args(args)
+        except SystemExit:
+            return {'ok': False, 'error': 'Invalid command.'}
+        if options.cmd_name not in ('attachment', 'wiki'):
+            return {'ok': False,
+                    'error': 'Expected an attachment or wiki command.'}
+        if not validate_args(options):
+            return {'ok': False,
+                    'error': ('too few or invalid arguments to ' +
+                              '"{0.cmd_name} {0.command}"').format(options)}
+        try:
+            resolve_paths(options, cwd)
+            c = self.connection(options)
+            output = dispatch(options, c)
+        except Exception as e:
+            return {'ok': False,
+                    'error': '{0}: {1}'.format(type(e).__name__, e)}
+        return {'ok': True, 'output': output}
+
+    def server_close(self):
+        """Remove the socket and log out.
+        """
+        super(TracRemoteServer, self).server_close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+        for c in self.connections.values():
+            c.close()
+        self.connections = dict()
+        return
+
+
+def serve(options):
+    """Run the ``serve`` command.
+
+    Parameters
+    ----------
+    options : :class:`argparse.Namespace`
+        Parsed options.  A connection to ``options.URL`` is opened
+        immediately.
+
+    Returns
+    -------
+    :class:`int`
+        An integer suitable for passing to :func:`sys.exit`.
+    """
+    try:
+        server = TracRemoteServer(options.socket)
+    except ValueError as e:
+        print(e)
+        return 1
+
+    def stop(signum, frame):
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        server.connection(options)
+        print('Listening on {0}.'.format(server.path), flush=True)
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
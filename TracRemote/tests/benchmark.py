@@ -0,0 +1,279 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+# -*- coding: utf-8 -*-
+"""
+==========================
+TracRemote.tests.benchmark
+==========================
+
+Measure request throughput and latency against the mock Trac server.
+
+Run with ``python -m TracRemote.tests.benchmark``.  Results are written
+as JSON, so that different versions of TracRemote can be compared.
+"""
+import json
+import platform
+import threading
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from pkg_resources import resource_filename
+import requests as r
+from .. import __version__ as tr_version
+from ..connection import Connection
+from ..metrics import percentile
+from .mock_trac_server import MockTracServer
+from .synthetic import SyntheticTracHandler, SyntheticWiki
+
+
+class QuietMockTracHandler(SyntheticTracHandler):
+    """Mock Trac server that does not log every request.
+
+    Attributes
+    ----------
+    latency : :class:`float`
+        Delay in seconds before answering each request, simulating a
+        slow server or network.
+    payload : :class:`bytes`
+        If set, the body of wiki pages and attachments.
+    """
+    latency = 0.0
+    payload = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_response(self, code, message=None):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        super(QuietMockTracHandler, self).send_response(code, message)
+        return
+
+    def do_GET(self):
+        if self.payload is not None and (
+                self.path.startswith('/wiki/TestGet') or
+                self.path.startswith('/raw-attachment/wiki/TestDetach')):
+            if self.latency > 0:
+                time.sleep(self.latency)
+            self.send_response_only(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(self.payload)))
+            self.end_headers()
+            self.wfile.write(self.payload)
+            return
+        super(QuietMockTracHandler, self).do_GET()
+        return
+
+
+def start_server(port=0, latency=0.0, payload=None, wiki=None,
+                 old_index=False):
+    """Start a mock Trac server in a background thread.
+
+    Parameters
+    ----------
+    port : :class:`int`, optional
+        Port to listen on.  The default picks an unused port.
+    latency : :class:`float`, optional
+        Delay in seconds before answering each request.
+    payload : :class:`int`, optional
+        If set, the size in bytes of wiki pages and attachments.
+    wiki : :class:`~TracRemote.tests.synthetic.SyntheticWiki`, optional
+        Also serve this synthetic wiki.
+    old_index : :class:`bool`, optional
+        Serve the TitleIndex of `wiki` in the format of Trac versions
+        before 1.0.
+
+    Returns
+    -------
+    :class:`MockTracServer`
+        The running server.  Call its ``shutdown()`` method when done.
+    """
+    attributes = {'latency': latency, 'wiki': wiki, 'old_index': old_index}
+    if payload is not None:
+        attributes['payload'] = b'x' * payload
+    handler = type('BenchmarkHandler', (QuietMockTracHandler,), attributes)
+    httpd = MockTracServer(('localhost', port), handler)
+    t = threading.Thread(target=httpd.serve_forever, daemon=True)
+    t.start()
+    return httpd
+
+
+def measure(func, n, concurrency):
+    """Call `func` `n` times from `concurrency` threads.
+
+    Parameters
+    ----------
+    func : callable
+        Function to call with no arguments.
+    n : :class:`int`
+        Number of calls.
+    concurrency : :class:`int`
+        Number of threads.
+
+    Returns
+    -------
+    :class:`dict`
+        Calls per second, and the 50th and 99th percentile latency in
+        milliseconds.
+    """
+    def timed(i):
+        t0 = time.perf_counter()
+        func()
+        return time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = sorted(pool.map(timed, range(n)))
+    wall = time.perf_counter() - t0
+    return {'requests': n,
+            'rps': n / wall,
+            'p50_ms': 1000 * percentile(latencies, 50),
+            'p99_ms': 1000 * percentile(latencies, 99)}
+
+
+def operations(c, size, wiki=None):
+    """Define the operations to measure.
+
+    Parameters
+    ----------
+    c : :class:`~TracRemote.connection.Connection`
+        Connection to the mock server.
+    size : :class:`int`
+        Size in bytes of uploaded pages and attachments.
+    wiki : :class:`~TracRemote.tests.synthetic.SyntheticWiki`, optional
+        A synthetic wiki served by the mock server.  Its first page is
+        used to list attachments.
+
+    Returns
+    -------
+    :class:`dict`
+        Functions taking no arguments, keyed by name.
+    """
+    text = 'x' * size
+    data = b'x' * size
+    listed = 'TestDetach' if wiki is None else wiki.pages[0]
+    return {'index': lambda: c.index(),
+            'attachments': lambda: c.attachments(listed),
+            'get': lambda: c.get('TestGet'),
+            #
+            # One new connection per request, as with module-level
+            # requests.get(), for comparison with the pooled session.
+            #
+            'get-unpooled': lambda: r.get(c.url + '/wiki/TestGet?format=txt',
+                                          cookies=c._cookies),
+            'set': lambda: c.set('TestEdit', text),
+            'attach': lambda: c.attach('TestAttach', ('bench.dat', data)),
+            'detach': lambda: c.detach('TestDetach', 'password.txt',
+                                       save=False)}
+
+
+def run(n=200, concurrency=(1, 4, 16), latency=0.0, payload=None,
+        ops=None, wiki=None):
+    """Run the benchmark.
+
+    Parameters
+    ----------
+    n : :class:`int`, optional
+        Number of calls of each operation at each concurrency level.
+    concurrency : :class:`tuple`, optional
+        Numbers of threads.
+    latency : :class:`float`, optional
+        Delay in seconds added by the server to each request.
+    payload : :class:`int`, optional
+        Size in bytes of pages and attachments.  The default uses the
+        small mock pages.
+    ops : :class:`list`, optional
+        Names of the operations to measure, by default all of them.
+    wiki : :class:`~TracRemote.tests.synthetic.SyntheticWiki`, optional
+        Serve this synthetic wiki, so that its TitleIndex and attachment
+        lists are measured.
+
+    Returns
+    -------
+    :class:`dict`
+        The results, suitable for conversion to JSON.
+    """
+    httpd = start_server(latency=latency, payload=payload, wiki=wiki)
+    url = 'http://localhost:{0:d}'.format(httpd.server_address[1])
+    c = Connection(url, resource_filename('TracRemote.tests',
+                                          't/password.txt'),
+                   pool_size=max(10, max(concurrency)))
+    functions = operations(c, 16 if payload is None else payload, wiki)
+    if ops is None:
+        ops = sorted(functions)
+    results = list()
+    try:
+        for op in ops:
+            for j in concurrency:
+                result = {'op': op, 'concurrency': j}
+                result.update(measure(functions[op], n, j))
+                results.append(result)
+    finally:
+        c.close()
+        httpd.shutdown()
+        httpd.server_close()
+    return {'version': tr_version,
+            'python': platform.python_version(),
+            'requests': r.__version__,
+            'latency': latency,
+            'payload': payload,
+            'pages': None if wiki is None else len(wiki.pages),
+            'attachments': None if wiki is None else wiki.attachments,
+            'results': results}
+
+
+def main():
+    """Entry point for the benchmark.
+
+    Returns
+    -------
+    :class:`int`
+        An integer suitable for passing to :func:`sys.exit`.
+    """
+    parser = ArgumentParser(description='Benchmark TracRemote requests.')
+    parser.add_argument('-a', '--attachments', metavar='N', type=int,
+                        default=0,
+                        help=('Number of files attached to each page of ' +
+                              'the synthetic wiki (default %(default)s).'))
+    parser.add_argument('-c', '--concurrency', metavar='N,N,...',
+                        default='1,4,16',
+                        help=('Numbers of threads making requests ' +
+                              '(default %(default)s).'))
+    parser.add_argument('-l', '--latency', metavar='MS', type=float,
+                        default=0.0,
+                        help=('Latency added by the server to each ' +
+                              'request, in milliseconds.'))
+    parser.add_argument('-n', '--requests', type=int, default=200,
+                        dest='n', help=('Number of requests for each ' +
+                                        'measurement (%(default)s).'))
+    parser.add_argument('-o', '--output', metavar='FILE', default=None,
+                        help='Write JSON results to FILE instead of stdout.')
+    parser.add_argument('-O', '--ops', metavar='OP,OP,...', default=None,
+                        help='Only measure these operations.')
+    parser.add_argument('-p', '--pages', metavar='N', type=int,
+                        default=None,
+                        help='Serve a synthetic wiki with N pages.')
+    parser.add_argument('-s', '--payload', metavar='BYTES', type=int,
+                        default=None,
+                        help='Size of pages and attachments.')
+    options = parser.parse_args()
+    concurrency = tuple([int(j) for j in options.concurrency.split(',')])
+    ops = None
+    if options.ops is not None:
+        ops = options.ops.split(',')
+    wiki = None
+    if options.pages is not None:
+        wiki = SyntheticWiki(options.pages, attachments=options.attachments)
+    results = run(options.n, concurrency, options.latency/1000.0,
+                  options.payload, ops, wiki)
+    text = json.dumps(results, indent=1)
+    if options.output is None:
+        print(text)
+    else:
+        with open(options.output, 'w') as f:
+            f.write(text + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
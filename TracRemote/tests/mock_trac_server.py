@@ -7,26 +7,127 @@ TracRemote.tests.mock_trac_server
 
 Simulate a Trac server.
 """
+import threading
 from collections import OrderedDict
+from email.parser import BytesParser
 from pkg_resources import resource_filename
+from socketserver import ThreadingMixIn
 from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+from xmlrpc.client import Fault
+from xmlrpc.server import SimpleXMLRPCDispatcher
+
+
+def rpc_dispatcher(pages):
+    """Simulate the wiki methods of the Trac XmlRpcPlugin.
+
+    Parameters
+    ----------
+    pages : :class:`dict`
+        The text of each wiki page.  Modified by ``wiki.putPage``.
+
+    Returns
+    -------
+    :class:`xmlrpc.server.SimpleXMLRPCDispatcher`
+        A dispatcher, including ``system.multicall``.
+    """
+    lock = threading.Lock()
+
+    def get_page(name, version=0):
+        with lock:
+            if name not in pages:
+                raise Fault(404, 'Wiki page "{0}" does not exist'.format(
+                    name))
+            return pages[name]
+
+    def put_page(name, text, attributes):
+        with lock:
+            pages[name] = text
+        return True
+
+    def get_all_pages():
+        with lock:
+            return list(pages)
+
+    dispatcher = SimpleXMLRPCDispatcher(allow_none=True, encoding='utf-8')
+    dispatcher.register_function(lambda: [1, 1, 8], 'system.getAPIVersion')
+    dispatcher.register_function(get_all_pages, 'wiki.getAllPages')
+    dispatcher.register_function(get_page, 'wiki.getPage')
+    dispatcher.register_function(put_page, 'wiki.putPage')
+    dispatcher.register_multicall_functions()
+    return dispatcher
+
+
+class MockTracServer(ThreadingMixIn, HTTPServer):
+    """Handle each client connection in its own thread, so that idle
+    keep-alive connections do not block other clients.
+    """
+    daemon_threads = True
 
 
 class MockTracHandler(BaseHTTPRequestHandler):
     """Simulate a Trac server.
     """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
     CRLF = '\r\n'
     login = resource_filename('TracRemote.tests', 't/login.html')
     index = resource_filename('TracRemote.tests', 't/TitleIndex.html')
     edit = resource_filename('TracRemote.tests', 't/edit.html')
     attach = resource_filename('TracRemote.tests', 't/attach.html')
+    detach = resource_filename('TracRemote.tests', 't/detach.html')
     passwd = resource_filename('TracRemote.tests', 't/password.txt')
+    timeline = resource_filename('TracRemote.tests', 't/timeline.rss')
+    recent = resource_filename('TracRemote.tests', 't/RecentChanges.html')
+    retry_count = 0
+    rpc = rpc_dispatcher({'WikiStart': 'Welcome to Trac.\r\n',
+                          'TestGet': 'This is a test.\r\n'})
+
+    def multipart(self, body):
+        """Parse a multipart/form-data request body.
+
+        Parameters
+        ----------
+        body : :class:`bytes`
+            The request body.
+
+        Returns
+        -------
+        :class:`dict`
+            The form fields, as :class:`bytes`.
+        """
+        header = ('Content-Type: ' +
+                  self.headers.get('Content-Type', '') + '\r\n\r\n')
+        message = BytesParser().parsebytes(header.encode('utf-8') + body)
+        form = dict()
+        if message.is_multipart():
+            for part in message.get_payload():
+                form[part.get_param('name',
+                                    header='content-disposition')] = \
+                    part.get_payload(decode=True)
+        return form
 
     def do_GET(self):
         http_code = 200
         mime = 'text/html;charset=utf-8'
         extra_headers = list()
-        if self.path == '/login':
+        if (self.path != '/login' and
+                'trac_auth=expired' in self.headers.get('Cookie', '')):
+            http_code = 403
+            data = ('Forbidden!'+self.CRLF).encode('utf-8')
+            mime = 'text/plain;charset=utf-8'
+        elif (self.path != '/login' and
+                'trac_auth=stale' in self.headers.get('Cookie', '')):
+            #
+            # Trac expires an unknown session cookie, and serves the
+            # page to an anonymous user.
+            #
+            extra_headers.append(('Set-Cookie',
+                                  ('trac_auth=; Expires=Thu, 01 Jan 1970 ' +
+                                   '00:00:00 GMT; Path=/')))
+            data = ('Anonymous view.'+self.CRLF).encode('utf-8')
+            mime = 'text/plain;charset=utf-8'
+        elif self.path == '/login':
             with open(self.login, 'rb') as l0:
                 data = l0.read()
             extra_headers.append(('Set-Cookie', ('trac_form_token=' +
@@ -35,22 +136,75 @@ class MockTracHandler(BaseHTTPRequestHandler):
             extra_headers.append(('Set-Cookie', ('trac_session=' +
                                                  'ThisIsATestSession; ' +
                                                  'httponly; Path=/')))
-        elif self.path == '/wiki/TitleIndex':
+        elif self.path.partition('?')[0] == '/wiki/TitleIndex':
             with open(self.index, 'rb') as l1:
                 data = l1.read()
         elif self.path.startswith('/wiki/TestEdit'):
             with open(self.edit, 'rb') as l2:
                 data = l2.read()
+            if self.path.startswith('/wiki/TestEditLarge'):
+                #
+                # Pad the page, so that it is not read in one chunk.
+                #
+                data += b'<!-- ' + b'x' * 2**15 + b' -->\n'
         elif self.path.startswith('/attachment/wiki/TestAttach'):
             with open(self.attach, 'rb') as l3:
                 data = l3.read()
+        elif self.path.startswith('/attachment/wiki/TestDetach'):
+            with open(self.detach, 'rb') as l7:
+                data = l7.read()
         elif self.path.startswith('/raw-attachment/wiki/TestDetach'):
             with open(self.passwd, 'rb') as l4:
                 data = l4.read()
             mime = 'application/octet-stream'
+            modified = 'Wed, 06 Jul 2022 17:21:37 GMT'
+            extra_headers.append(('Last-Modified', modified))
+            #
+            # Support simple Range requests, except on TestDetachNoRange,
+            # or if the file has changed since If-Range.
+            #
+            r = self.headers.get('Range', '')
+            if (r.startswith('bytes=') and r.endswith('-') and
+                    'NoRange' not in self.path and
+                    self.headers.get('If-Range', modified) == modified):
+                start = int(r[6:-1])
+                if start >= len(data):
+                    http_code = 416
+                    data = b''
+                else:
+                    http_code = 206
+                    extra_headers.append(('Content-Range',
+                                          'bytes {0:d}-{1:d}/{2:d}'.format(
+                                              start, len(data) - 1,
+                                              len(data))))
+                    data = data[start:]
+        elif self.path.startswith('/timeline'):
+            with open(self.timeline, 'rb') as l5:
+                data = l5.read()
+            mime = 'application/rss+xml'
+        elif self.path == '/wiki/RecentChanges':
+            with open(self.recent, 'rb') as l6:
+                data = l6.read()
+        elif self.path.startswith('/wiki/TestRetry'):
+            #
+            # Fail every other request with a transient error.
+            #
+            MockTracHandler.retry_count += 1
+            mime = 'text/plain;charset=utf-8'
+            if MockTracHandler.retry_count % 2:
+                http_code = 503
+                extra_headers.append(('Retry-After', '0'))
+                data = ('Service unavailable!'+self.CRLF).encode('utf-8')
+            else:
+                data = ('This is a test.'+self.CRLF).encode('utf-8')
         elif self.path.startswith('/wiki/TestGet'):
             data = ('This is a test.'+self.CRLF).encode('utf-8')
             mime = 'text/plain;charset=utf-8'
+            extra_headers.append(('ETag', '"TestGet-1"'))
+            extra_headers.append(('Last-Modified',
+                                  'Tue, 05 Jul 2022 17:23:45 GMT'))
+            if self.headers.get('If-None-Match') == '"TestGet-1"':
+                http_code = 304
         else:
             http_code = 404
             data = ('Not found!'+self.CRLF).encode('utf-8')
@@ -59,12 +213,20 @@ class MockTracHandler(BaseHTTPRequestHandler):
         if extra_headers:
             for h in extra_headers:
                 self.send_header(*h)
+        if http_code == 304:
+            self.end_headers()
+            return
         self.send_header('Content-Type', mime)
         self.send_header('Content-Length', str(len(data)))
         self.end_headers()
         self.wfile.write(data)
 
     def do_POST(self):
+        #
+        # Consume the request body, otherwise it would be read as the
+        # start of the next request on a keep-alive connection.
+        #
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
         http_code = 200
         mime = 'text/plain;charset=utf-8'
         extra_headers = list()
@@ -74,10 +236,49 @@ class MockTracHandler(BaseHTTPRequestHandler):
                                                  'f5190f99a4efb5b1677f8230; ' +
                                                  'httponly; Path=/')))
             extra_headers.append(('Location',
-                                  'http://localhost:8888/wiki/TestEdit'))
+                                  ('http://' + self.headers['Host'] +
+                                   '/wiki/TestEdit')))
             data = ('This is a test.'+self.CRLF).encode('utf-8')
         elif self.path.startswith('/wiki/TestEdit'):
-            data = ('This is a test.'+self.CRLF).encode('utf-8')
+            #
+            # Trac redirects to the page after a successful edit, but
+            # returns the edit form again if the page has changed since
+            # the version submitted.
+            #
+            form = parse_qs(body.decode('utf-8'))
+            if form.get('version', [''])[0] == '5':
+                http_code = 303
+                extra_headers.append(('Location',
+                                      ('http://' + self.headers['Host'] +
+                                       '/wiki/TestEdit')))
+                data = ('This is a test.'+self.CRLF).encode('utf-8')
+            else:
+                mime = 'text/html;charset=utf-8'
+                with open(self.edit, 'rb') as l2:
+                    data = l2.read()
+        elif self.path == '/rpc' and self.rpc is not None:
+            mime = 'text/xml'
+            data = self.rpc._marshaled_dispatch(body)
+        elif self.path.startswith('/wiki/TestRetry'):
+            http_code = 503
+            data = ('Service unavailable!'+self.CRLF).encode('utf-8')
+        elif self.path.startswith('/attachment/wiki/NoSuchPage'):
+            http_code = 404
+            data = ('Not found!'+self.CRLF).encode('utf-8')
+        elif self.path.startswith('/attachment/wiki/'):
+            #
+            # Check for a complete multipart/form-data upload.
+            #
+            form = self.multipart(body)
+            if 'attachment' in form and '__FORM_TOKEN' in form:
+                http_code = 303
+                extra_headers.append(('Location',
+                                      ('http://' + self.headers['Host'] +
+                                       self.path.split('?')[0])))
+                data = ('This is a test.'+self.CRLF).encode('utf-8')
+            else:
+                http_code = 400
+                data = ('Bad request!'+self.CRLF).encode('utf-8')
         else:
             http_code = 404
             data = ('Not found!'+self.CRLF).encode('utf-8')
@@ -92,5 +293,5 @@ class MockTracHandler(BaseHTTPRequestHandler):
 
 
 if __name__ == '__main__':
-    httpd = HTTPServer(('', 8888), MockTracHandler)
+    httpd = MockTracServer(('', 8888), MockTracHandler)
     httpd.serve_forever()
@@ -9,6 +9,7 @@ Contains a superclass for test cases that need a mock Trac server running.
 """
 import unittest
 import os
+import socket
 import stat
 import subprocess
 import time
@@ -19,6 +20,7 @@ from ..connection import Connection
 class NeedsMock(unittest.TestCase):
     """Superclass for test cases that need a mock Trac server running.
     """
+    timeout = 10
 
     @classmethod
     def setUpClass(cls):
@@ -39,11 +41,25 @@ password bar
                                      'TracRemote.tests.mock_trac_server'],
                                     stdout=subprocess.PIPE,
                                     stderr=subprocess.PIPE)
-        time.sleep(5)
+        #
+        # Wait until the server accepts connections.
+        #
+        t0 = time.time()
+        while True:
+            try:
+                socket.create_connection(('localhost', 8888), 1).close()
+                break
+            except OSError:
+                if (cls.trac.poll() is not None or
+                        time.time() - t0 > cls.timeout):
+                    cls.trac.kill()
+                    raise RuntimeError("Mock Trac server did not start!")
+                time.sleep(0.05)
 
     @classmethod
     def tearDownClass(cls):
         cls.trac.kill()
+        cls.trac.wait()
         if not cls.existing_netrc:
             if os.path.exists(cls.netrc_file):
                 os.remove(cls.netrc_file)
@@ -0,0 +1,278 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+# -*- coding: utf-8 -*-
+"""
+==========================
+TracRemote.tests.synthetic
+==========================
+
+Generate synthetic Trac wikis of any size for the mock Trac server.
+
+The pages and lists are generated on demand, so a wiki with tens of
+thousands of pages costs almost nothing until it is requested.
+"""
+from datetime import datetime, timedelta, timezone
+from html import escape
+from urllib.parse import parse_qs, quote, unquote
+from .mock_trac_server import MockTracHandler
+
+
+class SyntheticWiki(object):
+    """A synthetic Trac wiki.
+
+    Page names form a tree: every page with a ``/`` in its name has a
+    parent page, and the tree is filled breadth first, so the top levels
+    are complete.
+
+    Parameters
+    ----------
+    pages : :class:`int`, optional
+        Number of pages.
+    fanout : :class:`int`, optional
+        Number of children of each page.
+    depth : :class:`int`, optional
+        Maximum number of levels.
+    page_size : :class:`int`, optional
+        Size of each page in bytes.
+    attachments : :class:`int`, optional
+        Number of files attached to each page.
+    attachment_size : :class:`int`, optional
+        Size of each attached file in bytes.
+
+    Raises
+    ------
+    ValueError
+        If `pages` do not fit in a tree of the given `fanout` and `depth`.
+    """
+
+    def __init__(self, pages=1000, fanout=10, depth=4, page_size=1024,
+                 attachments=0, attachment_size=1024):
+        capacity = sum([fanout**k for k in range(1, depth + 1)])
+        if pages > capacity:
+            raise ValueError(("{0:d} pages do not fit in {1:d} levels of " +
+                              "{2:d} pages!").format(pages, depth, fanout))
+        self.page_size = page_size
+        self.attachments = attachments
+        self.attachment_size = attachment_size
+        self.pages = list()
+        width = len(str(fanout - 1))
+        level = ['']
+        while len(self.pages) < pages:
+            children = list()
+            for parent in level:
+                for k in range(fanout):
+                    children.append('{0}Page{1:0{2:d}d}'.format(parent, k,
+                                                                width))
+                    if len(self.pages) + len(children) >= pages:
+                        break
+                if len(self.pages) + len(children) >= pages:
+                    break
+            self.pages += children
+            level = [c + '/' for c in children]
+        self.pages.sort()
+        self._page_set = frozenset(self.pages)
+        self.epoch = datetime(2022, 7, 1,
+                              tzinfo=timezone(timedelta(hours=-6)))
+        return
+
+    def __contains__(self, pagepath):
+        return pagepath in self._page_set
+
+    def text(self, pagepath):
+        """Return the text of a page.
+
+        Parameters
+        ----------
+        pagepath : :class:`str`
+            Name of the page.
+
+        Returns
+        -------
+        :class:`bytes`
+            The text, exactly ``page_size`` bytes long.
+        """
+        header = '= {0} =\r\n'.format(pagepath).encode('utf-8')
+        line = b'This is a synthetic page.\r\n'
+        body = header + line * (self.page_size // len(line) + 1)
+        return body[:self.page_size]
+
+    def filenames(self, pagepath):
+        """Return the names of the files attached to a page.
+
+        Parameters
+        ----------
+        pagepath : :class:`str`
+            Name of the page.
+
+        Returns
+        -------
+        :class:`list`
+            The file names.
+        """
+        return ['file {0:05d}.dat'.format(k)
+                for k in range(self.attachments)]
+
+    def data(self, pagepath, filename):
+        """Return the contents of an attached file.
+
+        Parameters
+        ----------
+        pagepath : :class:`str`
+            Name of the page.
+        filename : :class:`str`
+            Name of the file.
+
+        Returns
+        -------
+        :class:`bytes`
+            The contents, exactly ``attachment_size`` bytes long.
+        """
+        return (filename.encode('utf-8') * (self.attachment_size //
+                                            len(filename) + 1)
+                )[:self.attachment_size]
+
+    def title_index(self, old=False, prefix=None):
+        """Render the TitleIndex page.
+
+        Parameters
+        ----------
+        old : :class:`bool`, optional
+            If set, use the flat list of Trac versions before 1.0, rather
+            than the nested lists of Trac 1.0.
+        prefix : :class:`str`, optional
+            Only list pages whose names start with `prefix`.
+
+        Returns
+        -------
+        :class:`bytes`
+            The HTML page.
+        """
+        pages = self.pages
+        if prefix is not None:
+            pages = [p for p in pages if p.startswith(prefix)]
+        html = ['<html>\n<head><title>TitleIndex</title></head>\n<body>\n',
+                '<div id="main">\n<div class="wikipage searchable">\n']
+        if old:
+            html.append('<h1 id="TitleIndex">Title Index</h1>\n<ul>')
+            for p in pages:
+                html.append('<li><a href="/wiki/{0}">{1}</a></li>'.format(
+                    quote(p), escape(p)))
+            html.append('</ul>\n')
+        else:
+            #
+            # Pages are sorted, so each page follows its parent, unless
+            # the parent does not match the prefix.
+            #
+            html.append('<p>\n</p><div class="titleindex">')
+            previous = 0
+            for p in pages:
+                parts = p.split('/')
+                if len(parts) > previous:
+                    html.append('<ul><li>' * (len(parts) - previous - 1) +
+                                '<ul>')
+                else:
+                    html.append('</li>' +
+                                '</ul></li>' * (previous - len(parts)))
+                html.append('<li><a href="/wiki/{0}">{1}</a>'.format(
+                    quote(p), escape(parts[-1])))
+                previous = len(parts)
+            if pages:
+                html.append('</li>' + '</ul></li>' * (previous - 1) +
+                            '</ul>')
+            html.append('</div><p>\n</p>\n')
+        html.append('</div>\n</div>\n</body>\n</html>\n')
+        return ''.join(html).encode('utf-8')
+
+    def attachment_list(self, pagepath):
+        """Render the list of files attached to a page.
+
+        Parameters
+        ----------
+        pagepath : :class:`str`
+            Name of the page.
+
+        Returns
+        -------
+        :class:`bytes`
+            The HTML page, in the format of Trac 1.0.
+        """
+        filenames = self.filenames(pagepath)
+        html = ['<html>\n<head><title>{0}</title></head>\n'.format(
+                escape(pagepath)),
+                '<body>\n<div id="main">\n<div id="attachments">\n',
+                ('<h3>Attachments <span class="trac-count">({0:d})' +
+                 '</span></h3>\n').format(len(filenames)),
+                '<div class="attachments">\n<dl class="attachments">\n']
+        for k, f in enumerate(filenames):
+            mtime = (self.epoch + timedelta(minutes=k)).isoformat()
+            url = quote(pagepath) + '/' + quote(f)
+            html.append(
+                ('<dt>\n<a href="/attachment/wiki/{0}" ' +
+                 'title="View attachment">{1}</a>' +
+                 '<a href="/raw-attachment/wiki/{0}" class="trac-rawlink" ' +
+                 'title="Download">&#8203;</a>\n' +
+                 '(<span title="{2:d} bytes">{2:d} bytes</span>) -\n' +
+                 'added by <span class="trac-author">synthetic</span> ' +
+                 '<a class="timeline" href="/timeline?from={3}&amp;' +
+                 'precision=second" title="See timeline">a while ago</a>.\n' +
+                 '</dt>\n<dd>\nSynthetic file {4:d}\n</dd>\n').format(
+                    url, escape(f), self.attachment_size, quote(mtime), k))
+        html.append('</dl>\n</div>\n</div>\n</div>\n</body>\n</html>\n')
+        return ''.join(html).encode('utf-8')
+
+
+class SyntheticTracHandler(MockTracHandler):
+    """Serve a :class:`SyntheticWiki` in addition to the mock pages.
+
+    Create a subclass with the `wiki` attribute set to use it.
+
+    Attributes
+    ----------
+    wiki : :class:`SyntheticWiki`
+        The synthetic wiki.
+    old_index : :class:`bool`
+        If set, serve the TitleIndex in the format of Trac versions
+        before 1.0.
+    """
+    wiki = None
+    old_index = False
+
+    def send_data(self, data, mime):
+        """Send a complete 200 response.
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', mime)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        return
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        path = unquote(path)
+        if self.wiki is not None:
+            if path == '/wiki/TitleIndex':
+                prefix = parse_qs(query).get('prefix', [None])[0]
+                self.send_data(self.wiki.title_index(self.old_index,
+                                                     prefix),
+                               'text/html;charset=utf-8')
+                return
+            if (path.startswith('/wiki/') and query == 'format=txt' and
+                    path[6:] in self.wiki):
+                self.send_data(self.wiki.text(path[6:]),
+                               'text/plain;charset=utf-8')
+                return
+            if path.startswith('/attachment/wiki/'):
+                pagepath = path[17:].rstrip('/')
+                if pagepath in self.wiki:
+                    self.send_data(self.wiki.attachment_list(pagepath),
+                                   'text/html;charset=utf-8')
+                    return
+            if path.startswith('/raw-attachment/wiki/'):
+                pagepath, _, filename = path[21:].rpartition('/')
+                if (pagepath in self.wiki and
+                        filename in self.wiki.filenames(pagepath)):
+                    self.send_data(self.wiki.data(pagepath, filename),
+                                   'application/octet-stream')
+                    return
+        super(SyntheticTracHandler, self).do_GET()
+        return
@@ -0,0 +1,29 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+# -*- coding: utf-8 -*-
+"""
+===============================
+TracRemote.tests.test_benchmark
+===============================
+
+Check that the benchmark runs.
+"""
+import unittest
+from .benchmark import run
+
+
+class TestBenchmark(unittest.TestCase):
+    """Check that the benchmark runs.
+    """
+
+    def test_run(self):
+        """Run a very short benchmark.
+        """
+        results = run(n=4, concurrency=(1, 2), latency=0.001, payload=1000)
+        self.assertEqual(results['payload'], 1000)
+        ops = set([x['op'] for x in results['results']])
+        self.assertEqual(ops, set(['attach', 'attachments', 'detach', 'get',
+                                   'get-unpooled', 'index', 'set']))
+        for x in results['results']:
+            self.assertEqual(x['requests'], 4)
+            self.assertGreater(x['rps'], 0)
+            self.assertLessEqual(x['p50_ms'], x['p99_ms'])
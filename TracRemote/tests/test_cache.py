@@ -0,0 +1,112 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+# -*- coding: utf-8 -*-
+"""
+===========================
+TracRemote.tests.test_cache
+===========================
+
+Test functions and classes in the cache module.
+"""
+import unittest
+import os
+import threading
+from datetime import datetime, timezone
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest.mock import patch
+from ..cache import (Manifest, PageCache, cache_dir, content_hash, file_hash,
+                     read_mark, write_mark)
+
+
+class TestCache(unittest.TestCase):
+    """Test functions and classes in the cache module.
+    """
+
+    def setUp(self):
+        self.d = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.d)
+
+    def test_cache_dir(self):
+        """Test the location of the cache directory.
+        """
+        self.assertTrue(cache_dir().endswith('trac-remote'))
+
+    def test_content_hash(self):
+        """Test hashes of strings and bytes.
+        """
+        self.assertEqual(content_hash('foo'), content_hash(b'foo'))
+        self.assertNotEqual(content_hash('foo'), content_hash('bar'))
+        f = os.path.join(self.d, 'foo.bin')
+        with open(f, 'wb') as b:
+            b.write(b'foo'*100000)
+        self.assertEqual(file_hash(f, chunk_size=1000),
+                         content_hash(b'foo'*100000))
+
+    def test_mark(self):
+        """Test high-water marks.
+        """
+        f = os.path.join(self.d, 'mark')
+        self.assertIsNone(read_mark(f))
+        mark = datetime(2022, 7, 5, 17, 23, 45, tzinfo=timezone.utc)
+        write_mark(f, mark)
+        self.assertEqual(read_mark(f), mark)
+
+    def test_manifest(self):
+        """Test manifest files.
+        """
+        f = os.path.join(self.d, 'manifest.json')
+        m = Manifest(f)
+        self.assertEqual(len(m), 0)
+        m['WikiStart'] = content_hash('foo')
+        m.save()
+        m = Manifest(f)
+        self.assertEqual(m['WikiStart'], content_hash('foo'))
+        #
+        # Threads saving at the same time use separate temporary files.
+        #
+        errors = list()
+
+        def save():
+            try:
+                for i in range(20):
+                    m.save()
+            except OSError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=save) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(os.listdir(self.d), ['manifest.json'])
+
+    def test_page_cache(self):
+        """Test the least-recently-used page cache.
+        """
+        c = PageCache(self.d, max_size=400)
+        for i in range(3):
+            c.put('page{0:d}'.format(i), 'x'*50, '"{0:d}"'.format(i))
+            os.utime(c._filename('page{0:d}'.format(i)), (i, i))
+        self.assertEqual(c.get('page0')['etag'], '"0"')
+        #
+        # page0 was just used, so page1 is evicted.
+        #
+        c.put('page3', 'x'*50)
+        self.assertIsNone(c.get('page1'))
+        self.assertIsNotNone(c.get('page0'))
+        self.assertIsNotNone(c.get('page3'))
+        #
+        # Pages larger than the cache are not stored.
+        #
+        c.put('page4', 'x'*500)
+        self.assertIsNone(c.get('page4'))
+        #
+        # Files removed by another process are ignored.
+        #
+        with patch('os.remove', side_effect=FileNotFoundError):
+            c.put('page5', 'x'*300)
+        with patch('os.stat', side_effect=FileNotFoundError):
+            c._evict()
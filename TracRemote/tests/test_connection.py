@@ -7,11 +7,27 @@ TracRemote.tests.test_connection
 
 Test the Trac Connection object.
 """
-# import unittest
+import unittest
+import asyncio
 import os
-from ..connection import Connection
+import stat
+from datetime import datetime, timezone
+from io import BytesIO
+from shutil import rmtree
+from tempfile import mkdtemp
+from requests import Response
+from requests.cookies import RequestsCookieJar
+from ..cache import Manifest, SessionCache, content_hash, read_mark
+from ..connection import Connection, AsyncConnection
+from ..util import CRLF
 from .needs_mock import NeedsMock
 
+try:
+    import aiohttp
+    skip_async = False
+except ImportError:
+    skip_async = True
+
 
 class TestConnection(NeedsMock):
     """Test the Trac Connection object.
@@ -25,6 +41,93 @@ class TestConnection(NeedsMock):
         c = Connection(self.url)
         self.assertEqual(c._form_token, 'f5190f99a4efb5b1677f8230')
 
+    def test_session(self):
+        """Test the shared, pooled session.
+        """
+        c = Connection(self.url, pool_size=4)
+        adapter = c._session.get_adapter(self.url)
+        self.assertEqual(adapter._pool_maxsize, 4)
+        self.assertIn('trac_auth', c._session.cookies)
+        self.assertEqual(c.get('TestGet'), 'This is a test.\r\n')
+        self.assertEqual(c.get('TestGet'), 'This is a test.\r\n')
+
+    def test_session_cache(self):
+        """Test reuse of a cached session.
+        """
+        d = mkdtemp()
+        try:
+            c = Connection(self.url, session_cache=d)
+            self.assertFalse(c._cached_session)
+            cache = SessionCache(d)
+            f = cache._filename(self.url, 'foo')
+            self.assertEqual(stat.S_IMODE(os.stat(f).st_mode), 0o600)
+            c = Connection(self.url, session_cache=d)
+            self.assertTrue(c._cached_session)
+            self.assertEqual(c.get('TestGet'), 'This is a test.\r\n')
+            #
+            # An expired session should trigger a new login.
+            #
+            jar = RequestsCookieJar()
+            jar.set('trac_form_token', 'f5190f99a4efb5b1677f8230')
+            jar.set('trac_auth', 'expired')
+            cache.save(self.url, 'foo', jar)
+            c = Connection(self.url, session_cache=d)
+            self.assertTrue(c._cached_session)
+            self.assertEqual(c.get('TestGet'), 'This is a test.\r\n')
+            self.assertFalse(c._cached_session)
+            cookies = dict([(k['name'], k['value'])
+                            for k in cache.load(self.url, 'foo')])
+            self.assertEqual(cookies['trac_auth'], 'f5190f99a4efb5b1677f8230')
+            #
+            # Trac may instead expire the session cookie and serve an
+            # anonymous view of the page.
+            #
+            jar = RequestsCookieJar()
+            jar.set('trac_form_token', 'f5190f99a4efb5b1677f8230',
+                    domain='localhost.local')
+            jar.set('trac_auth', 'stale', domain='localhost.local')
+            cache.save(self.url, 'foo', jar)
+            c = Connection(self.url, session_cache=d)
+            self.assertTrue(c._cached_session)
+            self.assertEqual(c.get('TestGet'), 'This is a test.\r\n')
+            self.assertFalse(c._cached_session)
+            cookies = dict([(k['name'], k['value'])
+                            for k in cache.load(self.url, 'foo')])
+            self.assertEqual(cookies['trac_auth'], 'f5190f99a4efb5b1677f8230')
+            c.close()
+            self.assertIsNone(cache.load(self.url, 'foo'))
+        finally:
+            rmtree(d)
+
+    def test_session_cache_parallel(self):
+        """Test an expired cached session used by many threads at once.
+        """
+        d = mkdtemp()
+        try:
+            cache = SessionCache(os.path.join(d, 'sessions'))
+            jar = RequestsCookieJar()
+            jar.set('trac_form_token', 'f5190f99a4efb5b1677f8230')
+            jar.set('trac_auth', 'expired')
+            cache.save(self.url, 'foo', jar)
+            c = Connection(self.url, session_cache=cache.directory,
+                           metrics=True)
+            self.assertTrue(c._cached_session)
+            pages = ['TestGet/Page{0:02d}'.format(k) for k in range(32)]
+            filenames = c.export_all(os.path.join(d, 'wiki'), pages=pages,
+                                     jobs=8)
+            for f in filenames:
+                with open(f, newline='') as t:
+                    self.assertEqual(t.read(), 'This is a test.\r\n')
+            ops = [r.op for r in c.metrics.records]
+            self.assertEqual(ops.count('login'), 2)
+            self.assertEqual(c._generation, 1)
+            cookies = dict([(k['name'], k['value'])
+                            for k in cache.load(self.url, 'foo')])
+            self.assertEqual(cookies['trac_auth'], 'f5190f99a4efb5b1677f8230')
+            self.assertEqual(c.get('TestGet'), 'This is a test.\r\n')
+        finally:
+            rmtree(d)
+
     def test_password_file(self):
         """Test reading from an arbitrary password file.
         """
@@ -38,6 +141,55 @@ class TestConnection(NeedsMock):
         ti = self.conn.index()
         self.assertEqual(ti[1], 'AAAS2016')
         self.assertEqual(ti[-1], 'testRST')
+        ti = list(self.conn.iter_index(prefix='AAAS'))
+        self.assertEqual(ti[0], 'AAAS2016')
+        self.assertTrue(all([p.startswith('AAAS') for p in ti]))
+
+    def test_index_cache(self):
+        """Test caching the list of wiki pages.
+        """
+        d = mkdtemp()
+        try:
+            c = Connection(self.url, metrics=True, index_ttl=60,
+                           index_cache=d)
+            ti = c.index()
+            self.assertEqual(c.index(), ti)
+            self.assertEqual(c.index(prefix='AAAS')[0], 'AAAS2016')
+            self.assertEqual([r.op for r in c.metrics.records].count(
+                'index'), 1)
+            self.assertEqual(len(os.listdir(d)), 1)
+            c2 = Connection(self.url, metrics=True, index_ttl=60,
+                            index_cache=d)
+            self.assertEqual(c2.index(), ti)
+            self.assertEqual([r.op for r in c2.metrics.records].count(
+                'index'), 0)
+            #
+            # Creating a page drops the cached list.
+            #
+            c2.set('TestEdit', 'This is a test.')
+            self.assertIsNone(c2._index)
+            self.assertEqual(os.listdir(d), [])
+            c2._index = (0.0, ti)
+            self.assertIsNone(c2._cached_index())
+            #
+            # Error pages, and pages that are not a complete index, are
+            # not cached.
+            #
+            request = c2._request
+
+            def broken(method, url, **kwargs):
+                if url.endswith('/wiki/TitleIndex'):
+                    url = self.url + next(paths)
+                return request(method, url, **kwargs)
+
+            paths = iter(['/wiki/NoSuchPage', '/wiki/TestEdit'])
+            c2._request = broken
+            for k in range(2):
+                self.assertEqual(c2.index(), [])
+                self.assertEqual(c2._index[0], 0.0)
+                self.assertEqual(os.listdir(d), [])
+        finally:
+            rmtree(d)
 
     def test_get(self):
         """Test the get() method.
@@ -45,12 +197,392 @@ class TestConnection(NeedsMock):
         text = self.conn.get('TestGet')
         self.assertEqual(text, 'This is a test.\r\n')
 
+    def test_page_cache(self):
+        """Test revalidation of cached pages.
+        """
+        d = mkdtemp()
+        try:
+            c = Connection(self.url, page_cache=d)
+            self.assertEqual(c.get('TestGet'), 'This is a test.\r\n')
+            url = self.url + '/wiki/TestGet?format=txt'
+            entry = c._page_cache.get(url)
+            self.assertEqual(entry['etag'], '"TestGet-1"')
+            #
+            # Change the cached text to show that it is used after a
+            # 304 response.
+            #
+            c._page_cache.put(url, 'Cached text.', entry['etag'],
+                              entry['last_modified'])
+            self.assertEqual(c.get('TestGet'), 'Cached text.')
+        finally:
+            rmtree(d)
+
     def test_set(self):
         """Test the set() method.
         """
         self.conn.set('TestEdit', 'This is a test.')
         # self.assertEqual(text, 'This is a test.\r\n')
 
+    def test_set_keepalive(self):
+        """Test that parsing the edit form does not drop the connection.
+        """
+        c = Connection(self.url, metrics=True)
+        c.metrics.clear()
+        for k in range(5):
+            c.set('TestEditLarge', 'This is a test.')
+        c.get('TestGet')
+        records = c.metrics.records
+        self.assertEqual([r.op for r in records], ['set', 'set'] * 5 +
+                         ['get'])
+        self.assertEqual([r.connect for r in records if r.connect > 0], [])
+
+    def test_set_optimistic(self):
+        """Test set() with remembered version numbers.
+        """
+        c = Connection(self.url, optimistic=True)
+        calls = list()
+        request = c._request
+
+        def spy(method, url, **kwargs):
+            calls.append((method, url))
+            return request(method, url, **kwargs)
+
+        c._request = spy
+        #
+        # The first edit has to fetch the edit form.
+        #
+        c.set('TestEdit', 'This is a test.')
+        self.assertEqual([m for m, u in calls], ['GET', 'POST'])
+        self.assertEqual(c._versions['TestEdit'], '6')
+        #
+        # With the current version known, only the POST is needed.
+        #
+        calls.clear()
+        c._versions['TestEdit'] = '5'
+        c.set('TestEdit', 'This is a test.')
+        self.assertEqual([m for m, u in calls], ['POST'])
+        #
+        # A stale version is rejected, and the edit is retried with the
+        # version from a fresh edit form.
+        #
+        calls.clear()
+        c._versions['TestEdit'] = '3'
+        c.set('TestEdit', 'This is a test.')
+        self.assertEqual([m for m, u in calls], ['POST', 'GET', 'POST'])
+        self.assertEqual(c._versions['TestEdit'], '6')
+        #
+        # Other failures are not retried.
+        #
+        for version in ('5', None):
+            calls.clear()
+            if version is not None:
+                c._versions['NoSuchPage'] = version
+            with self.assertRaises(ValueError):
+                c.set('NoSuchPage', 'This is a test.')
+            self.assertEqual([m for m, u in calls].count('POST'), 1)
+
+    def test_retry(self):
+        """Test retrying requests after transient errors.
+        """
+        c = Connection(self.url, retry=2, rate=100)
+        calls = list()
+        request = c._session.request
+
+        def spy(method, url, **kwargs):
+            calls.append(method)
+            return request(method, url, **kwargs)
+
+        c._session.request = spy
+        self.assertEqual(c.get('TestRetry'), 'This is a test.\r\n')
+        self.assertEqual(calls, ['GET', 'GET'])
+        #
+        # Without retries, the error is returned.
+        #
+        c = Connection(self.url)
+        response = c._request('GET', self.url + '/wiki/TestRetry')
+        if response.status_code == 200:
+            response = c._request('GET', self.url + '/wiki/TestRetry')
+        self.assertEqual(response.status_code, 503)
+        #
+        # POST is not retried.
+        #
+        c = Connection(self.url, retry=2)
+        calls.clear()
+        request = c._session.request
+        c._session.request = spy
+        response = c._request('POST', self.url + '/wiki/TestRetry')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(calls, ['POST'])
+
+    def test_rpc(self):
+        """Test the XML-RPC interface.
+        """
+        c = Connection(self.url, rpc=True, metrics=True)
+        c.metrics.clear()
+        self.assertIn('TestGet', c.index())
+        #
+        # XML parsers convert CRLF line endings to LF, which are restored
+        # to match the web interface.
+        #
+        self.assertEqual(c.get('TestGet'), 'This is a test.\r\n')
+        with self.assertRaises(ValueError):
+            c.get('TestMissing')
+        pages = dict([('TestRPC/Page{0:03d}'.format(k),
+                       'Page {0:d}\n'.format(k)) for k in range(150)])
+        c.set_many(pages, comment='Testing multicall.')
+        c.set('TestRPC', 'Top page\n')
+        texts = c.get_many(sorted(pages) + ['TestRPC'])
+        self.assertEqual(texts[:-1], [CRLF(pages[p]) for p in sorted(pages)])
+        self.assertEqual(texts[-1], 'Top page\r\n')
+        ops = [r.op for r in c.metrics.records]
+        self.assertEqual(ops, ['rpc', 'index', 'get', 'get', 'set', 'set',
+                               'set', 'get', 'get'])
+        self.assertNotIn('/wiki/', ' '.join([r.url
+                                             for r in c.metrics.records]))
+        d = mkdtemp()
+        try:
+            filenames = c.export_all(d, pages=sorted(pages)[:5])
+            self.assertEqual(len(filenames), 5)
+            with open(filenames[0]) as f:
+                self.assertEqual(f.read(), 'Page 0\n')
+            with open(filenames[1], 'w') as f:
+                f.write('Changed\n')
+            with open(os.path.join(d, 'TestRPC', 'New.txt'), 'w') as f:
+                f.write('New\n')
+            pushed = c.push(d)
+            self.assertEqual(sorted([p for p in pushed if pushed[p]]),
+                             ['TestRPC/New', 'TestRPC/Page001'])
+            self.assertEqual(len(pushed), 6)
+            self.assertEqual(c.get('TestRPC/New'), 'New\r\n')
+        finally:
+            rmtree(d)
+
+    def test_rpc_fallback(self):
+        """Test the web interface is used while the XML-RPC interface
+        fails.
+        """
+        c = Connection(self.url, rpc=True)
+        request = c._request
+        statuses = [403, 503]
+
+        def probe(method, url, **kwargs):
+            if url.endswith('/rpc') and statuses:
+                response = Response()
+                response.status_code = statuses.pop(0)
+                response.headers['Content-Type'] = 'text/plain'
+                response._content = b'Failed!'
+                return response
+            return request(method, url, **kwargs)
+
+        c._request = probe
+        for k in range(2):
+            self.assertEqual(c.get('TestGet'), 'This is a test.\r\n')
+            self.assertIsNone(c._rpc_url)
+        self.assertEqual(c.get('TestGet'), 'This is a test.\r\n')
+        self.assertEqual(c._rpc_url, self.url + '/rpc')
+
+    def test_metrics(self):
+        """Test measuring requests.
+        """
+        c = Connection(self.url, metrics=True)
+        login = c.metrics.records
+        self.assertEqual([r.op for r in login], ['login', 'login'])
+        self.assertGreater(login[0].connect, 0)
+        self.assertEqual(login[1].connect, 0)
+        c.metrics.clear()
+        c.index()
+        c.get('TestGet')
+        c.attach('TestAttach', ('test.txt', b'This is a test.'))
+        data = b''.join(c.iter_detach('TestDetach', 'password.txt'))
+        records = c.metrics.records
+        self.assertEqual([r.op for r in records],
+                         ['index', 'get', 'attach', 'detach'])
+        self.assertEqual([r.status for r in records], [200, 200, 200, 200])
+        self.assertGreater(records[0].parse, 0)
+        self.assertGreater(records[0].received, 0)
+        self.assertEqual(records[1].received, 17)
+        self.assertGreater(records[2].sent, 15)
+        self.assertEqual(records[3].received, len(data))
+        for r in records:
+            self.assertGreaterEqual(r.ttfb, 0)
+            self.assertGreaterEqual(r.transfer, 0)
+        self.assertEqual(c.metrics.summary()['get']['count'], 1)
+
+    def test_hooks(self):
+        """Test request hooks.
+        """
+        events = list()
+
+        def hook(event):
+            def callback(record):
+                events.append((event, record.op, record.status))
+            return callback
+
+        hooks = dict([(e, hook(e)) for e in Connection.hook_events])
+        c = Connection(self.url, hooks=hooks)
+        self.assertIsNone(c.metrics)
+        self.assertEqual(events, [('on_request_start', 'login', None),
+                                  ('on_request_end', 'login', 200),
+                                  ('on_request_start', 'login', None),
+                                  ('on_request_end', 'login', 200)])
+        del events[:]
+        c.index()
+        self.assertEqual(events, [('on_request_start', 'index', None),
+                                  ('on_request_end', 'index', 200),
+                                  ('on_parse_end', 'index', 200)])
+        #
+        # Pages that are read completely before they are parsed.
+        #
+        del events[:]
+        list(c.changes())
+        self.assertEqual(events[-1], ('on_parse_end', 'changes', 200))
+        c._optimistic = True
+        c._versions['TestEdit'] = '3'
+        del events[:]
+        c.set('TestEdit', 'This is a test.')
+        self.assertEqual(events[:3], [('on_request_start', 'set', None),
+                                      ('on_request_end', 'set', 200),
+                                      ('on_parse_end', 'set', 200)])
+        del events[:]
+        for e in Connection.hook_events:
+            c.remove_hook(e, hooks[e])
+        self.assertEqual(c._hooks, dict())
+        c.get('TestGet')
+        self.assertEqual(events, [])
+        with self.assertRaises(ValueError):
+            c.add_hook('on_nothing', hooks['on_parse_end'])
+        #
+        # Streamed downloads end when the response is closed.
+        #
+        c.add_hook('on_request_end', hooks['on_request_end'])
+        chunks = c.iter_detach('TestDetach', 'password.txt')
+        next(chunks)
+        self.assertEqual(events, [])
+        chunks.close()
+        self.assertEqual(events, [('on_request_end', 'detach', 200)])
+
+    def test_changes(self):
+        """Test the changes() method.
+        """
+        changes = list(self.conn.changes())
+        self.assertEqual([c[0] for c in changes],
+                         ['WikiStart', 'Projects/Foo', 'WikiStart'])
+        self.assertEqual(changes[1][2], 'carigi')
+        d = mkdtemp()
+        try:
+            statefile = os.path.join(d, 'mark')
+            changes = list(self.conn.changes(datetime(2022, 7, 2),
+                                             statefile=statefile))
+            self.assertEqual(len(changes), 2)
+            changes = list(self.conn.changes(statefile=statefile))
+            self.assertEqual(len(changes), 0)
+        finally:
+            rmtree(d)
+
+    def test_changes_recent(self):
+        """Test the changes() method without a timeline.
+        """
+        c = Connection(self.url)
+        request = c._request
+
+        def no_timeline(method, url, **kwargs):
+            if url.endswith('/timeline'):
+                url = self.url + '/notimeline'
+            return request(method, url, **kwargs)
+
+        c._request = no_timeline
+        parsed = []
+        c.add_hook('on_parse_end', parsed.append)
+        since = datetime(2022, 7, 4, 15, 30, tzinfo=timezone.utc)
+        changes = list(c.changes(since))
+        self.assertEqual([x[0] for x in changes],
+                         ['Projects/Foo', 'WikiStart'])
+        self.assertIsNone(changes[0][2])
+        self.assertEqual([(r.op, r.status) for r in parsed],
+                         [('changes', 200)])
+
+    def test_export_all(self):
+        """Test the export_all() method.
+        """
+        d = mkdtemp()
+        try:
+            filenames = self.conn.export_all(d, ['TestGet', 'TestGet/Child'],
+                                             jobs=2)
+            self.assertEqual(filenames, [os.path.join(d, 'TestGet.txt'),
+                                         os.path.join(d, 'TestGet',
+                                                      'Child.txt')])
+            for f in filenames:
+                with open(f, newline='') as t:
+                    self.assertEqual(t.read(), 'This is a test.\r\n')
+            #
+            # Error pages are not saved.
+            #
+            with self.assertRaises(ValueError):
+                self.conn.export_all(d, pages=['NoSuchPage'])
+            self.assertFalse(os.path.exists(os.path.join(d,
+                                                         'NoSuchPage.txt')))
+            #
+            # The first incremental export saves all requested pages, the
+            # second only pages changed since then.
+            #
+            filenames = self.conn.export_all(d, ['TestGet'], incremental=True)
+            self.assertEqual(len(filenames), 1)
+            #
+            # The mark is the latest change on the server.
+            #
+            statefile = os.path.join(d, '.trac-remote-timeline')
+            self.assertEqual(read_mark(statefile),
+                             datetime(2022, 7, 5, 17, 23, 45,
+                                      tzinfo=timezone.utc))
+            #
+            # The mark is older than the timeline reaches back, so all
+            # pages are saved again.
+            #
+            filenames = self.conn.export_all(d, ['TestGet'], incremental=True)
+            self.assertEqual(len(filenames), 1)
+            self.conn.max_daysback = 36500
+            filenames = self.conn.export_all(d, ['TestGet'], incremental=True)
+            self.assertEqual(len(filenames), 0)
+        finally:
+            rmtree(d)
+
+    def test_push(self):
+        """Test the push() method.
+        """
+        d = mkdtemp()
+        try:
+            os.mkdir(os.path.join(d, 'src'))
+            with open(os.path.join(d, 'src', 'TestGet.txt'), 'w') as t:
+                t.write('This is a test.\n')
+            with open(os.path.join(d, 'src', 'TestEdit.txt'), 'w') as t:
+                t.write('This is a change.\n')
+            manifest = os.path.join(d, 'manifest.json')
+            pushed = self.conn.push(os.path.join(d, 'src'),
+                                    manifest=manifest, jobs=2)
+            self.assertEqual(pushed, {'TestGet': False, 'TestEdit': True})
+            self.assertTrue(os.path.exists(manifest))
+            pushed = self.conn.push(os.path.join(d, 'src'),
+                                    manifest=manifest, jobs=2)
+            self.assertEqual(pushed, {'TestGet': False, 'TestEdit': False})
+            #
+            # A failed edit is not recorded in the manifest.
+            #
+            with open(os.path.join(d, 'src', 'NoSuchPage.txt'), 'w') as t:
+                t.write('This is a test.\n')
+            with open(os.path.join(d, 'src', 'TestEdit.txt'), 'w') as t:
+                t.write('This is another change.\n')
+            with self.assertRaises(ValueError):
+                self.conn.push(os.path.join(d, 'src'), manifest=manifest,
+                               jobs=2)
+            hashes = Manifest(manifest)
+            self.assertNotIn('NoSuchPage', hashes)
+            self.assertEqual(hashes['TestEdit'],
+                             content_hash('This is another change.\r\n'))
+            with self.assertRaises(ValueError):
+                self.conn.set('NoSuchPage', 'This is a test.')
+        finally:
+            rmtree(d)
+
     def test_attachments(self):
         """Test the attachments() method.
         """
@@ -62,6 +594,20 @@ class TestConnection(NeedsMock):
         self.assertEqual(f['comment'], 'carigi talk')
         self.assertEqual(f['author'], 'carigi')
 
+    def test_attach(self):
+        """Test the attach() method.
+        """
+        sent = list()
+        self.conn.attach('TestAttach', ('foo.txt', b'foo\n'*1000),
+                         progress=lambda n, total: sent.append((n, total)))
+        self.assertEqual(sent[-1][0], sent[-1][1])
+        with open(self.password_file, 'rb') as f:
+            self.conn.attach('TestAttach', f, description='Password',
+                             replace=True)
+        self.conn.attach('TestAttach', ('foo.txt', BytesIO(b'foo\n')))
+        with self.assertRaises(ValueError):
+            self.conn.attach('TestAttach', BytesIO(b'foo\n'))
+
     def test_detach(self):
         """Test the detach() method.
         """
@@ -76,3 +622,189 @@ class TestConnection(NeedsMock):
         data = self.conn.detach('TestDetach', 'password.txt', save=False)
         self.assertEqual(data, 'foo\nbar\n'.encode('utf-8'))
         self.assertFalse(os.path.exists(data_file))
+
+    @unittest.skipIf(skip_async, "Skipping test that requires aiohttp.")
+    def test_async(self):
+        """Test the AsyncConnection object.
+        """
+        async def run():
+            async with AsyncConnection(self.url, concurrency=2) as c:
+                self.assertEqual(c._form_token, 'f5190f99a4efb5b1677f8230')
+                ti = await c.index()
+                texts = await asyncio.gather(*[c.get('TestGet')
+                                               for i in range(5)])
+                at = await c.attachments('TestAttach')
+                data = await c.detach('TestDetach', 'password.txt',
+                                      save=False)
+                saved = await c.detach('TestDetach', 'password.txt',
+                                       destination=dest)
+                self.assertEqual(saved, data)
+                await c.attach('TestAttach', dest)
+                await c.attach('TestAttach', ('foo.txt', b'foo\n'))
+                await c.set('TestEdit', 'This is a test.')
+            return (ti, texts, at, data)
+        d = mkdtemp()
+        dest = os.path.join(d, 'password.txt')
+        loop = asyncio.new_event_loop()
+        try:
+            ti, texts, at, data = loop.run_until_complete(run())
+            with open(dest, 'rb') as df:
+                self.assertEqual(df.read(), data)
+        finally:
+            loop.close()
+            rmtree(d)
+        self.assertEqual(ti[-1], 'testRST')
+        self.assertEqual(texts, ['This is a test.\r\n']*5)
+        self.assertEqual(at['carigi.apogge2.lr.utah.pdf']['size'], 4246601)
+        self.assertEqual(data, 'foo\nbar\n'.encode('utf-8'))
+
+    def test_detach_stream(self):
+        """Test streaming downloads of attachments.
+        """
+        data = b''.join(self.conn.iter_detach('TestDetach', 'password.txt',
+                                              chunk_size=3))
+        self.assertEqual(data, 'foo\nbar\n'.encode('utf-8'))
+        d = mkdtemp()
+        try:
+            dest = os.path.join(d, 'foo.txt')
+            f = self.conn.detach('TestDetach', 'password.txt',
+                                 destination=dest, stream=True, chunk_size=3)
+            self.assertEqual(f, dest)
+            self.assertEqual(os.listdir(d), ['foo.txt'])
+            with open(dest, 'rb') as df:
+                self.assertEqual(df.read(), data)
+            with self.assertRaises(ValueError):
+                self.conn.detach('TestDetach', 'password.txt', save=False,
+                                 stream=True)
+        finally:
+            rmtree(d)
+
+    def test_detach_all(self):
+        """Test the detach_all() method.
+        """
+        d = mkdtemp()
+        try:
+            filenames = self.conn.detach_all('TestDetach', d, jobs=2)
+            self.assertEqual(filenames,
+                             [os.path.join(d, 'password.txt'),
+                              os.path.join(d, 'copy of password.txt')])
+            for f in filenames:
+                with open(f, 'rb') as df:
+                    self.assertEqual(df.read(), 'foo\nbar\n'.encode('utf-8'))
+        finally:
+            rmtree(d)
+
+    def test_detach_resume(self):
+        """Test resumable downloads of attachments.
+        """
+        d = mkdtemp()
+        try:
+            dest = os.path.join(d, 'password.txt')
+            modified = 'Wed, 06 Jul 2022 17:21:37 GMT'
+            #
+            # The first three bytes are not downloaded again.
+            #
+            with open(dest + '.part', 'wb') as p:
+                p.write(b'XXX')
+            with open(dest + '.part.validator', 'w') as v:
+                v.write(modified + '\n')
+            f = self.conn.detach('TestDetach', 'password.txt',
+                                 destination=dest, resume=True)
+            self.assertEqual(f, dest)
+            self.assertFalse(os.path.exists(dest + '.part'))
+            self.assertFalse(os.path.exists(dest + '.part.validator'))
+            with open(dest, 'rb') as df:
+                self.assertEqual(df.read(), b'XXX\nbar\n')
+            #
+            # The file has changed since the partial file was written, or
+            # the partial file has no validator.
+            #
+            for validator in ('Tue, 05 Jul 2022 17:23:45 GMT', None):
+                with open(dest + '.part', 'wb') as p:
+                    p.write(b'XXX')
+                if validator is not None:
+                    with open(dest + '.part.validator', 'w') as v:
+                        v.write(validator + '\n')
+                f = self.conn.detach('TestDetach', 'password.txt',
+                                     destination=dest, resume=True)
+                with open(dest, 'rb') as df:
+                    self.assertEqual(df.read(), b'foo\nbar\n')
+            #
+            # The server ignores the Range header.
+            #
+            with open(dest + '.part', 'wb') as p:
+                p.write(b'XXX')
+            with open(dest + '.part.validator', 'w') as v:
+                v.write(modified + '\n')
+            f = self.conn.detach('TestDetachNoRange', 'password.txt',
+                                 destination=dest, resume=True)
+            with open(dest, 'rb') as df:
+                self.assertEqual(df.read(), b'foo\nbar\n')
+            #
+            # The partial file is already complete.
+            #
+            with open(dest + '.part', 'wb') as p:
+                p.write(b'foo\nbar\n')
+            with open(dest + '.part.validator', 'w') as v:
+                v.write(modified + '\n')
+            f = self.conn.detach('TestDetach', 'password.txt',
+                                 destination=dest, resume=True)
+            with open(dest, 'rb') as df:
+                self.assertEqual(df.read(), b'foo\nbar\n')
+            #
+            # The file is not in the list of attachments.
+            #
+            with self.assertRaises(ValueError):
+                self.conn.detach('TestDetach', 'missing.txt',
+                                 destination=dest, resume=True)
+        finally:
+            rmtree(d)
+
+    def test_sync_attachments(self):
+        """Test the sync_attachments() method.
+        """
+        d = mkdtemp()
+        try:
+            src = os.path.join(d, 'src')
+            os.mkdir(src)
+            with open(os.path.join(src, 'password.txt'), 'wb') as f:
+                f.write(b'foo\nbar\n')
+            os.utime(os.path.join(src, 'password.txt'), (0, 0))
+            with open(os.path.join(src, 'new.txt'), 'wb') as f:
+                f.write(b'new\n')
+            synced = self.conn.sync_attachments('TestDetach', src, jobs=2)
+            self.assertEqual(synced, {'password.txt': False, 'new.txt': True})
+            #
+            # A file of the same size, modified after the attachment was
+            # uploaded by a server east of UTC.
+            #
+            with open(os.path.join(src, 'copy of password.txt'), 'wb') as f:
+                f.write(b'foo\nbaz\n')
+            synced = self.conn.sync_attachments('TestDetach', src, jobs=2)
+            self.assertTrue(synced['copy of password.txt'])
+            os.remove(os.path.join(src, 'copy of password.txt'))
+            #
+            # With a manifest, the first sync uploads everything, and later
+            # syncs only upload files whose contents have changed.
+            #
+            manifest = os.path.join(d, 'manifest.json')
+            synced = self.conn.sync_attachments('TestDetach', src,
+                                                manifest=manifest)
+            self.assertEqual(synced, {'password.txt': True, 'new.txt': True})
+            synced = self.conn.sync_attachments('TestDetach', src,
+                                                manifest=manifest)
+            self.assertEqual(synced, {'password.txt': False, 'new.txt': True})
+            with open(os.path.join(src, 'password.txt'), 'wb') as f:
+                f.write(b'baz\nbar\n')
+            synced = self.conn.sync_attachments('TestDetach', src,
+                                                manifest=manifest)
+            self.assertEqual(synced, {'password.txt': True, 'new.txt': True})
+            #
+            # A failed upload is not recorded in the manifest.
+            #
+            with self.assertRaises(ValueError):
+                self.conn.sync_attachments('NoSuchPage', src,
+                                           manifest=manifest)
+            self.assertNotIn('NoSuchPage/new.txt', Manifest(manifest))
+        finally:
+            rmtree(d)
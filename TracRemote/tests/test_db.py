@@ -0,0 +1,118 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+# -*- coding: utf-8 -*-
+"""
+========================
+TracRemote.tests.test_db
+========================
+
+Test reading a Trac environment directly.
+"""
+import unittest
+import os
+import sqlite3
+from shutil import rmtree
+from tempfile import mkdtemp
+from ..db import DatabaseConnection, attachment_path
+
+
+class TestDatabase(unittest.TestCase):
+    """Test reading a Trac environment directly.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        #
+        # Create a minimal Trac environment, with the wiki and attachment
+        # tables of the Trac 1.x schema.
+        #
+        cls.env = mkdtemp()
+        os.makedirs(os.path.join(cls.env, 'db'))
+        db = sqlite3.connect(os.path.join(cls.env, 'db', 'trac.db'))
+        db.execute("CREATE TABLE wiki (name text, version integer, " +
+                   "time integer, author text, text text, comment text, " +
+                   "readonly integer, UNIQUE (name, version))")
+        db.execute("CREATE TABLE attachment (type text, id text, " +
+                   "filename text, size integer, time integer, " +
+                   "description text, author text, " +
+                   "UNIQUE (type, id, filename))")
+        t = 1405000000000000
+        db.executemany("INSERT INTO wiki VALUES (?, ?, ?, ?, ?, ?, 0)",
+                       [('WikiStart', 1, t, 'trac', 'Welcome.\r\n', ''),
+                        ('Projects/Foo', 1, t, 'foo', 'Old.\r\n', ''),
+                        ('Projects/Foo', 2, t + 1, 'foo', 'New.\r\n', ''),
+                        ('Projects/Foo Bar', 1, t, 'foo', 'Bar.\r\n', '')])
+        cls.data = b'This is a test.\n'
+        db.execute("INSERT INTO attachment VALUES (?, ?, ?, ?, ?, ?, ?)",
+                   ('wiki', 'Projects/Foo', 'test file.txt', len(cls.data),
+                    t, 'A test.', 'foo'))
+        db.commit()
+        db.close()
+        path = attachment_path(cls.env, 'Projects/Foo', 'test file.txt')
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(cls.data)
+
+    @classmethod
+    def tearDownClass(cls):
+        rmtree(cls.env)
+
+    def setUp(self):
+        self.conn = DatabaseConnection(self.env)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_attachment_path(self):
+        """Test the location of attached files.
+        """
+        path = attachment_path('/trac', 'WikiStart', 'foo.txt')
+        self.assertEqual(path, os.path.join(
+            '/trac', 'files', 'attachments', 'wiki', 'f09',
+            'f0955265d583361233790e2a4da795373c345a9f',
+            '9206ac42b532ef8e983470c251f4e1a365fd636c.txt'))
+
+    def test_index(self):
+        """Test listing pages.
+        """
+        self.assertEqual(self.conn.index(),
+                         ['Projects/Foo', 'Projects/Foo%20Bar', 'WikiStart'])
+        self.assertEqual(self.conn.index(prefix='Projects/Foo '),
+                         ['Projects/Foo%20Bar'])
+        with self.assertRaises(ValueError):
+            DatabaseConnection(os.path.join(self.env, 'missing'))
+
+    def test_get(self):
+        """Test reading pages.
+        """
+        self.assertEqual(self.conn.get('Projects/Foo'), 'New.\r\n')
+        self.assertEqual(self.conn.get('Projects/Foo%20Bar'), 'Bar.\r\n')
+        with self.assertRaises(ValueError):
+            self.conn.get('Missing')
+        d = mkdtemp()
+        try:
+            filenames = self.conn.export_all(d)
+            self.assertEqual(filenames[1], os.path.join(d, 'Projects',
+                                                        'Foo Bar.txt'))
+        finally:
+            rmtree(d)
+
+    def test_attachments(self):
+        """Test reading attachments.
+        """
+        a = self.conn.attachments('Projects/Foo')
+        self.assertEqual(list(a), ['test%20file.txt'])
+        f = a['test%20file.txt']
+        self.assertEqual(f['size'], len(self.data))
+        self.assertEqual(f['mtime'], '2014-07-10T13:46:40+00:00')
+        self.assertEqual(f['author'], 'foo')
+        self.assertEqual(f['comment'], 'A test.')
+        self.assertEqual(self.conn.attachments('WikiStart'), dict())
+        data = self.conn.detach('Projects/Foo', 'test%20file.txt',
+                                save=False)
+        self.assertEqual(data, self.data)
+        self.assertEqual(b''.join(self.conn.iter_detach('Projects/Foo',
+                                                        'test file.txt',
+                                                        chunk_size=4)),
+                         self.data)
+        with self.assertRaises(ValueError):
+            self.conn.detach('WikiStart', 'test file.txt', save=False)
@@ -9,8 +9,16 @@ Test functions and classes in the main module.
 """
 # import unittest
 # from pkg_resources import resource_filename
+import json
+import os
 from argparse import Namespace
-from ..main import main_args, validate_args, dispatch
+from io import StringIO
+from shutil import rmtree
+from tempfile import mkdtemp, mkstemp
+from unittest.mock import patch
+from ..cache import SessionCache
+from ..connection import Connection
+from ..main import main_args, validate_args, dispatch, batch
 from .needs_mock import NeedsMock
 
 
@@ -46,8 +54,77 @@ class TestMain(NeedsMock):
         base_options = {'URL': 'http://localhost:8888',
                         'password': None,
                         'realm': None,
-                        'debug': False}
+                        'debug': False,
+                        'index_ttl': 0,
+                        'jobs': 4,
+                        'manifest': None,
+                        'optimistic': False, 'page_cache': False,
+                        'rate': None, 'retries': 3, 'rpc': False,
+                        'session_cache': False, 'stats': None}
         base_options['cmd_name'] = 'wiki'
         base_options['command'] = 'list'
+        base_options['arguments'] = []
         output = dispatch(Namespace(**base_options))
         self.assertTrue(output.endswith('testRST\n'))
+        base_options['arguments'] = ['AAAS']
+        output = dispatch(Namespace(**base_options))
+        self.assertTrue(output.startswith('AAAS2016\n'))
+
+    def test_batch(self):
+        """Test running several commands over one connection.
+        """
+        fd, f = mkstemp(suffix='.txt')
+        with os.fdopen(fd, 'w') as t:
+            t.write("""# A comment.
+wiki list
+
+["wiki", "export", "TestGet"]
+{"id": "a", "args": ["attachment", "list", "TestDetach"]}
+wiki import TestEdit
+wiki frobnicate
+{"args": "wiki list"}
+wiki -h
+""")
+        try:
+            for parallel in ('1', '2'):
+                options = main_args(['http://localhost:8888', 'batch',
+                                     '--parallel', parallel, f])
+                output = StringIO()
+                c = Connection(options.URL)
+                calls = list()
+                request = c._request
+
+                def spy(method, url, **kwargs):
+                    calls.append(url)
+                    return request(method, url, **kwargs)
+
+                c._request = spy
+                failed = batch(options, connection=c, output=output)
+                self.assertEqual(failed, 3)
+                results = [json.loads(r) for r in
+                           output.getvalue().splitlines()]
+                self.assertEqual([r['line'] for r in results],
+                                 [2, 4, 5, 6, 7, 8, 9])
+                self.assertTrue(results[0]['output'].endswith('testRST\n'))
+                self.assertEqual(results[1]['output'], 'This is a test.\r\n')
+                self.assertEqual(results[2]['id'], 'a')
+                self.assertTrue(results[2]['output'].startswith('password'))
+                self.assertFalse(any([r['ok'] for r in results[3:6]]))
+                self.assertTrue(results[6]['ok'])
+                self.assertIn('usage:', results[6]['output'])
+                self.assertNotIn(self.url + '/login', calls)
+            #
+            # A cached session is kept for the next run.
+            #
+            d = mkdtemp()
+            try:
+                with patch.dict(os.environ, {'XDG_CACHE_HOME': d}):
+                    options = main_args(['http://localhost:8888', '-s',
+                                         'batch', f])
+                    batch(options, output=StringIO())
+                    self.assertIsNotNone(SessionCache().load(options.URL,
+                                                             'foo'))
+            finally:
+                rmtree(d)
+        finally:
+            os.remove(f)
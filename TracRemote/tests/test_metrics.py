@@ -0,0 +1,60 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+# -*- coding: utf-8 -*-
+"""
+=============================
+TracRemote.tests.test_metrics
+=============================
+
+Test the request metrics.
+"""
+import unittest
+import json
+from ..metrics import Metrics, RequestMetrics, percentile
+
+
+class TestMetrics(unittest.TestCase):
+    """Test the request metrics.
+    """
+
+    def test_percentile(self):
+        """Test the percentile function.
+        """
+        values = list(range(101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([1, 2], 50), 1.5)
+        self.assertEqual(percentile([3], 99), 3)
+
+    def test_summary(self):
+        """Test summarizing and reporting measurements.
+        """
+        m = Metrics()
+        for k in range(10):
+            r = RequestMetrics('get', 'GET', 'http://localhost/wiki/Foo')
+            r.status = 200 if k else 503
+            r.received = 100
+            r.connect = 0.010 if k == 0 else 0.0
+            r.ttfb = 0.001 * (k + 1)
+            r.transfer = 0.001
+            m.add(r)
+        r = RequestMetrics('set', 'POST', 'http://localhost/wiki/Foo')
+        r.sent = 50
+        m.add(r)
+        self.assertEqual(len(m.records), 11)
+        self.assertAlmostEqual(m.records[0].total, 0.012)
+        s = m.summary()
+        self.assertEqual(sorted(s), ['get', 'set'])
+        self.assertEqual(s['get']['count'], 10)
+        self.assertEqual(s['get']['errors'], 1)
+        self.assertEqual(s['get']['received'], 1000)
+        self.assertAlmostEqual(s['get']['connect'], 1.0)
+        self.assertAlmostEqual(s['get']['p50'], 7.5)
+        self.assertEqual(s['set']['errors'], 1)
+        self.assertEqual(s['set']['sent'], 50)
+        self.assertEqual(json.loads(m.report('json'))['get']['count'], 10)
+        table = m.report().split('\n')
+        self.assertTrue(table[0].startswith('operation'))
+        self.assertTrue(table[1].startswith('get'))
+        self.assertEqual(len(table), 4)
+        m.clear()
+        self.assertEqual(m.records, [])
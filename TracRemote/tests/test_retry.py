@@ -0,0 +1,89 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+# -*- coding: utf-8 -*-
+"""
+===========================
+TracRemote.tests.test_retry
+===========================
+
+Test the retry policy and rate limiter.
+"""
+import unittest
+import threading
+from ..retry import RetryPolicy, TokenBucket
+
+
+class TestRetry(unittest.TestCase):
+    """Test the retry policy and rate limiter.
+    """
+
+    def test_retryable(self):
+        """Test which requests are retried.
+        """
+        p = RetryPolicy(retries=2)
+        self.assertTrue(p.retryable('GET', 0, 503))
+        self.assertTrue(p.retryable('get', 1))
+        self.assertFalse(p.retryable('GET', 2, 503))
+        self.assertFalse(p.retryable('GET', 0, 404))
+        self.assertFalse(p.retryable('POST', 0, 503))
+        self.assertFalse(p.retryable('POST', 0))
+        p = RetryPolicy(methods=('GET', 'POST'))
+        self.assertTrue(p.retryable('POST', 0, 502))
+
+    def test_delay(self):
+        """Test exponential backoff and Retry-After.
+        """
+        p = RetryPolicy(backoff=1.0, max_backoff=5.0)
+        for attempt in range(6):
+            d = p.delay(attempt)
+            self.assertGreaterEqual(d, 0)
+            self.assertLessEqual(d, min(5.0, 2**attempt))
+        self.assertEqual(p.delay(0, '3'), 3.0)
+        self.assertEqual(p.delay(0, '120'), 5.0)
+        self.assertEqual(p.delay(0, 'Tue, 05 Jul 2022 17:23:45 GMT'), 0.0)
+        d = p.delay(0, 'garbage')
+        self.assertLessEqual(d, 1.0)
+
+    def test_token_bucket(self):
+        """Test the rate limiter with a simulated clock.
+        """
+        now = [0.0]
+
+        def sleep(t):
+            now[0] += t
+
+        with self.assertRaises(ValueError):
+            TokenBucket(0)
+        b = TokenBucket(10, burst=2, clock=lambda: now[0], sleep=sleep)
+        self.assertEqual(b.acquire(), 0.0)
+        self.assertEqual(b.acquire(), 0.0)
+        for i in range(10):
+            b.acquire()
+        self.assertAlmostEqual(now[0], 1.0)
+        #
+        # After a quiet period, only a burst of requests is allowed.
+        #
+        now[0] += 10.0
+        self.assertEqual(b.acquire(), 0.0)
+        self.assertEqual(b.acquire(), 0.0)
+        self.assertAlmostEqual(b.acquire(), 0.1)
+
+    def test_token_bucket_threads(self):
+        """Test the rate limiter shared between threads.
+        """
+        now = [0.0]
+        lock = threading.Lock()
+
+        def sleep(t):
+            with lock:
+                now[0] = max(now[0], t)
+
+        b = TokenBucket(100, burst=1, clock=lambda: 0.0, sleep=sleep)
+        threads = [threading.Thread(target=b.acquire) for i in range(20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        #
+        # Each thread waits for a different slot.
+        #
+        self.assertAlmostEqual(now[0], 0.19)
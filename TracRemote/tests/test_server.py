@@ -0,0 +1,132 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+# -*- coding: utf-8 -*-
+"""
+============================
+TracRemote.tests.test_server
+============================
+
+Test the command server.
+"""
+import os
+import socket
+import stat
+import threading
+from shutil import rmtree
+from tempfile import mkdtemp
+from ..main import main_args
+from ..server import TracRemoteServer, forward, listening, resolve_paths
+from .needs_mock import NeedsMock
+
+
+class TestServer(NeedsMock):
+    """Test the command server.
+    """
+
+    def setUp(self):
+        self.d = mkdtemp()
+        self.path = os.path.join(self.d, 's.sock')
+
+    def tearDown(self):
+        rmtree(self.d)
+
+    def test_forward(self):
+        """Test forwarding commands to a running server.
+        """
+        self.assertIsNone(forward([self.url, 'wiki', 'list'],
+                                  path=self.path))
+        server = TracRemoteServer(self.path)
+        t = threading.Thread(target=server.serve_forever, daemon=True)
+        t.start()
+        try:
+            self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+            self.assertTrue(listening(self.path))
+            with self.assertRaises(ValueError):
+                TracRemoteServer(self.path)
+            result = forward([self.url, 'wiki', 'export', 'TestGet'],
+                             path=self.path)
+            self.assertTrue(result['ok'])
+            self.assertEqual(result['output'], 'This is a test.\r\n')
+            #
+            # Relative file names are relative to the client.
+            #
+            result = forward([self.url, 'wiki', 'export', 'TestGet',
+                              'TestGet.txt'], cwd=self.d, path=self.path)
+            self.assertTrue(result['ok'])
+            self.assertTrue(os.path.exists(os.path.join(self.d,
+                                                        'TestGet.txt')))
+            self.assertEqual(len(server.connections), 1)
+            #
+            # Different connection options need a different connection,
+            # and a relative password file is relative to the client.
+            #
+            result = forward([self.url, '--retries', '1', 'wiki', 'export',
+                              'TestGet'], path=self.path)
+            self.assertTrue(result['ok'])
+            self.assertEqual(len(server.connections), 2)
+            with open(os.path.join(self.d, 'passwd'), 'w') as p:
+                p.write('foo\nbar\n')
+            result = forward([self.url, '-p', 'passwd', 'wiki', 'export',
+                              'TestGet'], cwd=self.d, path=self.path)
+            self.assertTrue(result['ok'])
+            self.assertEqual(len(server.connections), 3)
+            self.assertIn(os.path.join(self.d, 'passwd'),
+                          [k[1] for k in server.connections])
+            result = forward([self.url, 'wiki', 'frobnicate'],
+                             path=self.path)
+            self.assertFalse(result['ok'])
+            #
+            # Commands do not wait for each other, or change directory.
+            #
+            here = os.getcwd()
+            results = list()
+            with server._lock:
+                c = threading.Thread(target=lambda: results.append(
+                    forward([self.url, 'attachment', 'export', 'TestDetach',
+                             'password.txt'], cwd=self.d, path=self.path)))
+                c.start()
+                c.join(self.timeout)
+            self.assertTrue(results[0]['ok'])
+            self.assertTrue(os.path.exists(os.path.join(self.d,
+                                                        'password.txt')))
+            self.assertEqual(os.getcwd(), here)
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_forward_no_reply(self):
+        """Test a server that closes the connection without a reply.
+        """
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.bind(self.path)
+        s.listen(1)
+
+        def close():
+            conn, address = s.accept()
+            with conn.makefile('rb') as f:
+                f.readline()
+            conn.close()
+
+        t = threading.Thread(target=close, daemon=True)
+        t.start()
+        try:
+            result = forward([self.url, 'wiki', 'list'], path=self.path)
+        finally:
+            t.join(self.timeout)
+            s.close()
+        self.assertFalse(result['ok'])
+
+    def test_resolve_paths(self):
+        """Test making file names in commands absolute.
+        """
+        options = main_args([self.url, '-p', 'passwd', '-m', 'manifest',
+                             'attachment', 'export', 'WikiStart',
+                             'foo%20bar.txt'])
+        resolve_paths(options, '/client')
+        self.assertEqual(options.password, '/client/passwd')
+        self.assertEqual(options.manifest, '/client/manifest')
+        self.assertEqual(options.arguments, ['WikiStart', 'foo%20bar.txt',
+                                             '/client/foo bar.txt'])
+        options = main_args([self.url, 'wiki', 'export-all', '/tmp/wiki'])
+        resolve_paths(options, '/client')
+        self.assertEqual(options.arguments, ['/tmp/wiki'])
@@ -0,0 +1,89 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+# -*- coding: utf-8 -*-
+"""
+=============================
+TracRemote.tests.test_startup
+=============================
+
+Check that the command-line script starts quickly.
+"""
+import unittest
+import json
+import subprocess
+import sys
+import time
+
+
+class TestStartup(unittest.TestCase):
+    """Check that the command-line script starts quickly.
+    """
+    #
+    # Maximum cumulative import time of TracRemote.main, in microseconds,
+    # as reported by python -X importtime.  Importing requests takes
+    # several times longer than this.
+    #
+    import_threshold = 100000
+    #
+    # Maximum wall clock time of trac-remote --version, in seconds, in
+    # excess of the start-up time of the interpreter itself.
+    #
+    wall_threshold = 0.5
+
+    def run_python(self, code, *options):
+        """Run `code` in a new interpreter, returning stdout and stderr.
+        """
+        p = subprocess.run([sys.executable] + list(options) + ['-c', code],
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                           universal_newlines=True)
+        return p.stdout, p.stderr
+
+    def test_lazy_imports(self):
+        """Parsing and validating arguments does not load the HTTP client.
+        """
+        code = """import json
+import sys
+from TracRemote.main import main_args, validate_args
+validate_args(main_args(['http://localhost:8888', 'wiki', 'list']))
+from TracRemote.server import forward
+print(json.dumps(sorted(sys.modules)))
+"""
+        out, err = self.run_python(code)
+        modules = json.loads(out)
+        for m in ('requests', 'urllib3', 'asyncio', 'html.parser',
+                  'TracRemote.connection', 'TracRemote.util'):
+            self.assertNotIn(m, modules)
+
+    def test_import_time(self):
+        """Check the import time of the main module.
+        """
+        code = 'import TracRemote.main'
+        #
+        # The first run may have to compile the module.
+        #
+        self.run_python(code)
+        out, err = self.run_python(code, '-X', 'importtime')
+        cumulative = None
+        for line in err.splitlines():
+            if line.startswith('import time:') and 'requests' in line:
+                self.fail('requests was imported.')
+            if line.rstrip().endswith('| TracRemote.main'):
+                cumulative = int(line.split('|')[1])
+        self.assertIsNotNone(cumulative)
+        self.assertLess(cumulative, self.import_threshold)
+
+    def test_version_time(self):
+        """Check the wall clock time of trac-remote --version.
+        """
+        version = ("import sys; sys.argv = ['trac-remote', '--version']; " +
+                   "from TracRemote.main import main; main()")
+
+        def best(code, n=3):
+            t = list()
+            for i in range(n):
+                t0 = time.perf_counter()
+                self.run_python(code)
+                t.append(time.perf_counter() - t0)
+            return min(t)
+
+        baseline = best('pass')
+        self.assertLess(best(version) - baseline, self.wall_threshold)
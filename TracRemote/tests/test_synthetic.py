@@ -0,0 +1,104 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+# -*- coding: utf-8 -*-
+"""
+===============================
+TracRemote.tests.test_synthetic
+===============================
+
+Test the synthetic wiki generator, and use it to test the client at scale.
+"""
+import unittest
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from pkg_resources import resource_filename
+from ..connection import Connection
+from ..util import SimpleAttachmentHTMLParser, SimpleIndexHTMLParser
+from .benchmark import start_server
+from .synthetic import SyntheticWiki
+
+
+class TestSynthetic(unittest.TestCase):
+    """Test the synthetic wiki generator.
+    """
+
+    def test_pages(self):
+        """Test the tree of page names.
+        """
+        w = SyntheticWiki(13, fanout=3)
+        self.assertEqual(len(w.pages), 13)
+        self.assertEqual(w.pages[:3], ['Page0', 'Page0/Page0',
+                                       'Page0/Page0/Page0'])
+        for p in w.pages:
+            if '/' in p:
+                self.assertIn(p.rsplit('/', 1)[0], w)
+        self.assertEqual(len(w.text('Page0')), 1024)
+        with self.assertRaises(ValueError):
+            SyntheticWiki(100, fanout=3, depth=2)
+
+    def test_title_index(self):
+        """Parse large TitleIndex pages in both formats.
+        """
+        w = SyntheticWiki(10000)
+        for old in (False, True):
+            parser = SimpleIndexHTMLParser()
+            parser.feed(w.title_index(old).decode('utf-8'))
+            self.assertTrue(parser.done)
+            self.assertEqual(parser.TitleIndex, w.pages)
+            parser = SimpleIndexHTMLParser()
+            parser.feed(w.title_index(old, 'Page3/Page4').decode('utf-8'))
+            self.assertTrue(parser.done)
+            self.assertEqual(parser.TitleIndex,
+                             [p for p in w.pages
+                              if p.startswith('Page3/Page4')])
+
+    def test_attachment_list(self):
+        """Parse a long attachment list.
+        """
+        w = SyntheticWiki(10, attachments=3000, attachment_size=100)
+        parser = SimpleAttachmentHTMLParser()
+        parser.feed(w.attachment_list('Page0').decode('utf-8'))
+        self.assertTrue(parser.done)
+        self.assertEqual(len(parser.attachments), 3000)
+        a = parser.attachments['file%2002999.dat']
+        self.assertEqual(a['size'], 100)
+        self.assertEqual(a['author'], 'synthetic')
+
+    def test_serve(self):
+        """Use a served synthetic wiki.
+        """
+        w = SyntheticWiki(300, fanout=5, page_size=2000, attachments=50,
+                          attachment_size=300)
+        d = mkdtemp()
+        for old in (False, True):
+            httpd = start_server(wiki=w, old_index=old)
+            url = 'http://localhost:{0:d}'.format(httpd.server_address[1])
+            #
+            # Without an XML-RPC interface, rpc=True falls back to the
+            # web interface.
+            #
+            httpd.RequestHandlerClass.rpc = None
+            try:
+                c = Connection(url, resource_filename('TracRemote.tests',
+                                                      't/password.txt'),
+                               rpc=old)
+                self.assertEqual(c.index(), w.pages)
+                self.assertIsNone(c._rpc_endpoint())
+                self.assertEqual(list(c.iter_index('Page1/')),
+                                 [p for p in w.pages
+                                  if p.startswith('Page1/')])
+                self.assertEqual(len(c.get(w.pages[-1])), 2000)
+                if not old:
+                    filenames = c.export_all(os.path.join(d, 'wiki'),
+                                             jobs=8)
+                    self.assertEqual(len(filenames), 300)
+                    self.assertEqual(len(c.attachments(w.pages[7])), 50)
+                    filenames = c.detach_all(w.pages[7],
+                                             os.path.join(d, 'files'),
+                                             jobs=8)
+                    self.assertEqual(len(filenames), 50)
+                c.close()
+            finally:
+                httpd.shutdown()
+                httpd.server_close()
+        rmtree(d)
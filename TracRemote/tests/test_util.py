@@ -7,10 +7,16 @@ TracRemote.tests.test_util
 
 Test functions and classes in the util module.
 """
+import os
 import unittest
+from datetime import datetime, timezone
+from email.parser import BytesParser
+from io import BytesIO
 from pkg_resources import resource_filename
-from ..util import (CRLF, SimpleAttachmentHTMLParser, SimpleIndexHTMLParser,
-                    SimpleWikiHTMLParser)
+from ..util import (CRLF, MultipartEncoder, SimpleAttachmentHTMLParser,
+                    SimpleIndexHTMLParser, SimpleRecentChangesHTMLParser,
+                    SimpleWikiHTMLParser, attachment_filename, page_filename,
+                    parse_timeline, wiki_page)
 
 
 class TestUtil(unittest.TestCase):
@@ -20,9 +26,13 @@ class TestUtil(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         cls.attach = resource_filename('TracRemote.tests', 't/attach.html')
+        cls.detach = resource_filename('TracRemote.tests', 't/detach.html')
         cls.index = resource_filename('TracRemote.tests', 't/TitleIndex.html')
         cls.login = resource_filename('TracRemote.tests', 't/login.html')
         cls.edit = resource_filename('TracRemote.tests', 't/edit.html')
+        cls.timeline = resource_filename('TracRemote.tests', 't/timeline.rss')
+        cls.recent = resource_filename('TracRemote.tests',
+                                       't/RecentChanges.html')
 
     @classmethod
     def tearDownClass(cls):
@@ -37,6 +47,29 @@ class TestUtil(unittest.TestCase):
                          ("This text\r\nContains\r\n\r\n" +
                           "Unix line-endings\r\n\r\n"))
 
+    def test_page_filename(self):
+        """Test conversion of wiki page names to file names.
+        """
+        self.assertEqual(page_filename('d', 'WikiStart'),
+                         os.path.join('d', 'WikiStart.txt'))
+        self.assertEqual(page_filename('d', 'Projects/Foo/Bar'),
+                         os.path.join('d', 'Projects', 'Foo', 'Bar.txt'))
+        self.assertEqual(page_filename('d', '%20Small%20Scale'),
+                         os.path.join('d', ' Small Scale.txt'))
+        self.assertEqual(page_filename('d', '../../etc/passwd', ''),
+                         os.path.join('d', 'etc', 'passwd'))
+
+    def test_attachment_filename(self):
+        """Test conversion of attachment names to file names.
+        """
+        self.assertEqual(attachment_filename('d', 'foo%20bar.txt'),
+                         os.path.join('d', 'foo bar.txt'))
+        self.assertEqual(attachment_filename('d', '..%2F..%2Fetc%2Fpasswd'),
+                         os.path.join('d', 'passwd'))
+        for name in ('..', '%2E%2E', 'foo%2F..', ''):
+            with self.assertRaises(ValueError):
+                attachment_filename('d', name)
+
     def test_attachment_parser(self):
         """Test attachment list parsing.
         """
@@ -51,6 +84,18 @@ class TestUtil(unittest.TestCase):
         self.assertEqual(f['size'], 4246601)
         self.assertEqual(f['comment'], 'carigi talk')
         self.assertEqual(f['author'], 'carigi')
+        #
+        # Servers at or east of UTC.
+        #
+        with open(self.detach) as a:
+            detach_html = a.read()
+        parser = SimpleAttachmentHTMLParser()
+        parser.feed(detach_html)
+        f = parser.attachments['copy%20of%20password.txt']
+        self.assertEqual(f['mtime'], '2022-07-06T19:21:37+02:00')
+        m = SimpleAttachmentHTMLParser.mtimere.search(
+            '/timeline?from=2022-07-06T17:21:37Z&precision=second')
+        self.assertEqual(m.groups()[0], '2022-07-06T17:21:37Z')
 
     def test_index_parser(self):
         """Test TitleIndex parsing.
@@ -63,6 +108,22 @@ class TestUtil(unittest.TestCase):
         self.assertEqual(ti[1], 'AAAS2016')
         self.assertEqual(ti[-1], 'testRST')
 
+    def test_parser_done(self):
+        """Test that parsers signal when they have found what they need.
+        """
+        for parser, f in ((SimpleIndexHTMLParser(), self.index),
+                          (SimpleAttachmentHTMLParser(), self.attach),
+                          (SimpleWikiHTMLParser('version'), self.edit)):
+            with open(f) as h:
+                html = h.read()
+            n = 0
+            while not parser.done and n < len(html):
+                parser.feed(html[n:n+1024])
+                n += 1024
+            self.assertTrue(parser.done)
+            self.assertLess(n, len(html))
+        self.assertEqual(parser.search_value, '5')
+
     def test_wiki_parser(self):
         """Test wiki parsing.
         """
@@ -76,3 +137,75 @@ class TestUtil(unittest.TestCase):
         parser = SimpleWikiHTMLParser('version')
         parser.feed(edit_html)
         self.assertEqual(parser.search_value, '5')
+
+    def test_parse_timeline(self):
+        """Test timeline parsing.
+        """
+        with open(self.timeline) as t:
+            rss = t.read()
+        changes = parse_timeline(rss)
+        self.assertEqual(len(changes), 3)
+        self.assertEqual(changes[0],
+                         ('WikiStart',
+                          datetime(2022, 7, 5, 17, 23, 45,
+                                   tzinfo=timezone.utc),
+                          'weaver'))
+        self.assertEqual(changes[1][0], 'Projects/Foo')
+        with self.assertRaises(ValueError):
+            parse_timeline('<html><body>Not RSS</html>')
+        #
+        # Attachments are not wiki pages, and items without a time are
+        # skipped.
+        #
+        rss = ('<rss><channel><item><link>http://example.com/trac/wiki/' +
+               'WikiStart</link><pubDate>Tue, 05 Jul 2022 17:23:45 GMT' +
+               '</pubDate></item><item><link>http://example.com/trac/' +
+               'attachment/wiki/WikiStart/x.txt</link><pubDate>Tue, 05 ' +
+               'Jul 2022 17:23:45 GMT</pubDate></item><item><link>' +
+               'http://example.com/trac/wiki/Foo</link></item>' +
+               '</channel></rss>')
+        changes = parse_timeline(rss, 'http://example.com/trac')
+        self.assertEqual([c[0] for c in changes], ['WikiStart'])
+        self.assertIsNone(wiki_page('/attachment/wiki/Foo/x.txt'))
+        self.assertEqual(wiki_page('/trac/wiki/WikiStart',
+                                   'http://example.com/trac/'), 'WikiStart')
+        self.assertIsNone(wiki_page('/wiki/WikiStart',
+                                    'http://example.com/trac'))
+
+    def test_recent_changes_parser(self):
+        """Test RecentChanges parsing.
+        """
+        with open(self.recent) as r:
+            recent_html = r.read()
+        parser = SimpleRecentChangesHTMLParser()
+        parser.feed(recent_html)
+        self.assertEqual([c[0] for c in parser.changes],
+                         ['WikiStart', 'Projects/Foo', 'WikiStart'])
+        self.assertEqual(parser.changes[1][1],
+                         datetime(2022, 7, 4, tzinfo=timezone.utc))
+        parser = SimpleRecentChangesHTMLParser()
+        parser.feed('<h3>03/04/2024</h3><ul><li><a href="/wiki/Foo">Foo' +
+                    '</a></li></ul>')
+        self.assertEqual(parser.changes[0][1],
+                         datetime(2024, 3, 4, tzinfo=timezone.utc))
+
+    def test_multipart(self):
+        """Test streaming multipart/form-data encoding.
+        """
+        data = b'\x00\x01foo\r\n'*1000
+        sent = list()
+        m = MultipartEncoder([('id', 'WikiStart'),
+                              ('attachment', ('foo.bin', BytesIO(data),
+                                              'application/octet-stream'))],
+                             callback=lambda n, t: sent.append(n))
+        body = b''.join(m)
+        self.assertEqual(len(body), len(m))
+        self.assertEqual(sent[-1], len(m))
+        header = 'Content-Type: {0}\r\n\r\n'.format(m.content_type)
+        message = BytesParser().parsebytes(header.encode('utf-8') + body)
+        parts = message.get_payload()
+        self.assertEqual(parts[0].get_payload(), 'WikiStart')
+        self.assertEqual(parts[1].get_filename(), 'foo.bin')
+        self.assertEqual(parts[1].get_payload(decode=True), data)
+        m.replace('id', 'TestAttach')
+        self.assertEqual(len(m.read()), len(m))
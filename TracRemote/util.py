@@ -7,10 +7,16 @@ TracRemote.util
 
 Utility functions and classes for internal use by the TracRemote package.
 """
+import os
+from io import BytesIO
+from uuid import uuid4
 from html.parser import HTMLParser
-from urllib.parse import unquote
+from urllib.parse import unquote, urlparse
 import re
 from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from xml.etree import ElementTree
 
 
 def CRLF(text):
@@ -35,6 +41,281 @@ def CRLF(text):
     return crlf_text
 
 
+def page_filename(destdir, pagepath, extension='.txt'):
+    """Convert the name of a wiki page into a file name.
+
+    The hierarchy of the wiki is mirrored by directories, so that
+    ``Projects/Foo`` is stored in ``Projects/Foo.txt`` while
+    ``Projects/Foo/Bar`` is stored in ``Projects/Foo/Bar.txt``.
+
+    Parameters
+    ----------
+    destdir : :class:`str`
+        Top-level directory.
+    pagepath : :class:`str`
+        Wiki page name, possibly URL-encoded.
+    extension : :class:`str`, optional
+        Extension to add to the file name.
+
+    Returns
+    -------
+    :class:`str`
+        The file name.
+    """
+    parts = [p for p in unquote(pagepath).split('/')
+             if p not in ('', '.', '..')]
+    return os.path.join(destdir, *parts) + extension
+
+
+def attachment_filename(destdir, filename):
+    """Convert the name of an attached file, as sent by the server, into
+    the name of a file in `destdir`.
+
+    Parameters
+    ----------
+    destdir : :class:`str`
+        Top-level directory.
+    filename : :class:`str`
+        Name of the attached file, possibly URL-encoded.
+
+    Returns
+    -------
+    :class:`str`
+        The file name.
+
+    Raises
+    ------
+    ValueError
+        If `filename` does not name a file in `destdir`.
+    """
+    name = os.path.basename(unquote(filename).replace('\\', '/'))
+    if name in ('', '.', '..'):
+        raise ValueError("Invalid attachment name {0}!".format(filename))
+    return os.path.join(destdir, name)
+
+
+def filename_page(srcdir, filename, extension='.txt'):
+    """Convert a file name into the name of a wiki page.
+
+    This is the inverse of :func:`page_filename`.
+
+    Parameters
+    ----------
+    srcdir : :class:`str`
+        Top-level directory.
+    filename : :class:`str`
+        Name of a file in `srcdir` or one of its subdirectories.
+    extension : :class:`str`, optional
+        Extension to remove from the file name.
+
+    Returns
+    -------
+    :class:`str`
+        The wiki page name.
+    """
+    pagepath = os.path.relpath(filename, srcdir)
+    if extension and pagepath.endswith(extension):
+        pagepath = pagepath[:-len(extension)]
+    return '/'.join(pagepath.split(os.sep))
+
+
+def wiki_page(href, base=''):
+    """Extract the name of a wiki page from a link.
+
+    Parameters
+    ----------
+    href : :class:`str`
+        A link, absolute or relative, to a wiki page.
+    base : :class:`str`, optional
+        The base URL of the Trac server.  Only links below `base` plus
+        ``/wiki/`` are wiki pages, which excludes, for example, links to
+        attachments.
+
+    Returns
+    -------
+    :class:`str`
+        The wiki page name, or ``None`` if the link is not to a wiki page.
+    """
+    path = urlparse(href).path
+    prefix = urlparse(base).path.rstrip('/') + '/wiki/'
+    if not path.startswith(prefix):
+        return None
+    return path[len(prefix):]
+
+
+def parse_timeline(text, base=''):
+    """Parse the RSS version of the Trac timeline.
+
+    Parameters
+    ----------
+    text : :class:`str`
+        The RSS document.
+    base : :class:`str`, optional
+        The base URL of the Trac server, see :func:`wiki_page`.
+
+    Returns
+    -------
+    :class:`list`
+        A list of tuples containing the wiki page name, the time of the
+        change as a :class:`~datetime.datetime`, and the author, in the
+        order they appear in the document.  Items that are not changes to
+        wiki pages, or have no time, are skipped.
+
+    Raises
+    ------
+    ValueError
+        If `text` can not be parsed.
+    """
+    try:
+        rss = ElementTree.fromstring(text)
+    except ElementTree.ParseError as e:
+        raise ValueError(str(e))
+    changes = list()
+    for item in rss.iter('item'):
+        page = wiki_page(item.findtext('link', ''), base)
+        if not page:
+            continue
+        try:
+            mtime = parsedate_to_datetime(item.findtext('pubDate', ''))
+        except (TypeError, ValueError):
+            continue
+        author = item.findtext('{http://purl.org/dc/elements/1.1/}creator')
+        changes.append((page, mtime, author))
+    return changes
+
+
+class MultipartEncoder(object):
+    """Stream a multipart/form-data request body.
+
+    File contents are read from disk as the body is sent, so memory use
+    does not depend on the size of the files.  Objects of this class can
+    be passed directly as the `data` argument of :mod:`requests` methods.
+
+    Parameters
+    ----------
+    fields : :class:`list`
+        A list of tuples containing the field name and value.  The value
+        is either a :class:`str`, or a tuple containing the file name, a
+        file object open in binary mode, and the content type.
+    callback : callable, optional
+        Called as ``callback(bytes_read, total_bytes)`` as the body is read,
+        for example to report progress.
+
+    Attributes
+    ----------
+    content_type : :class:`str`
+        The value of the Content-Type header, including the boundary.
+    """
+
+    def __init__(self, fields, callback=None):
+        self.fields = list(fields)
+        self.callback = callback
+        self.boundary = uuid4().hex
+        self.content_type = 'multipart/form-data; boundary=' + self.boundary
+        self._start = dict()
+        for name, value in self.fields:
+            if isinstance(value, tuple):
+                self._start[name] = value[1].tell()
+        self.rewind()
+        return
+
+    def _size(self, f):
+        """Number of bytes remaining in file object `f`.
+        """
+        try:
+            return os.fstat(f.fileno()).st_size - f.tell()
+        except (AttributeError, OSError, ValueError):
+            here = f.tell()
+            f.seek(0, os.SEEK_END)
+            size = f.tell() - here
+            f.seek(here)
+            return size
+
+    def rewind(self):
+        """Prepare to read the body from the beginning, for example after
+        changing :attr:`fields`.
+        """
+        self._parts = list()
+        self.len = 0
+        for name, value in self.fields:
+            if isinstance(value, tuple):
+                fname, f, ctype = value
+                f.seek(self._start.get(name, 0))
+                header = ('--{0}\r\nContent-Disposition: form-data; ' +
+                          'name="{1}"; filename="{2}"\r\n' +
+                          'Content-Type: {3}\r\n\r\n')
+                header = header.format(self.boundary, name,
+                                       fname.replace('"', '%22'),
+                                       ctype).encode('utf-8')
+                self._parts.append(BytesIO(header))
+                self._parts.append(f)
+                self._parts.append(BytesIO(b'\r\n'))
+                self.len += len(header) + self._size(f) + 2
+            else:
+                part = ('--{0}\r\nContent-Disposition: form-data; ' +
+                        'name="{1}"\r\n\r\n{2}\r\n')
+                part = part.format(self.boundary, name,
+                                   value).encode('utf-8')
+                self._parts.append(BytesIO(part))
+                self.len += len(part)
+        end = '--{0}--\r\n'.format(self.boundary).encode('utf-8')
+        self._parts.append(BytesIO(end))
+        self.len += len(end)
+        self._read = 0
+        return
+
+    def replace(self, name, value):
+        """Replace the value of a field and rewind.
+
+        Parameters
+        ----------
+        name : :class:`str`
+            Name of the field.
+        value : :class:`str`
+            New value.
+        """
+        self.fields = [(n, value if n == name else v) for n, v in self.fields]
+        self.rewind()
+        return
+
+    def __len__(self):
+        return self.len
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(2**16)
+            if not chunk:
+                return
+            yield chunk
+
+    def read(self, size=-1):
+        """Read up to `size` bytes of the body.
+
+        Parameters
+        ----------
+        size : :class:`int`, optional
+            Number of bytes to read.  If negative, read the whole body.
+
+        Returns
+        -------
+        :class:`bytes`
+            The data read.  An empty string indicates the end of the body.
+        """
+        chunks = list()
+        n = 0
+        while self._parts and (size < 0 or n < size):
+            chunk = self._parts[0].read(-1 if size < 0 else size - n)
+            if chunk:
+                chunks.append(chunk)
+                n += len(chunk)
+            else:
+                self._parts.pop(0)
+        self._read += n
+        if self.callback is not None and n > 0:
+            self.callback(self._read, self.len)
+        return b''.join(chunks)
+
+
 class SimpleAttachmentHTMLParser(HTMLParser):
     """Parse an attachment list page.
 
@@ -42,11 +323,15 @@ class SimpleAttachmentHTMLParser(HTMLParser):
     ----------
     mtimere : Regular Expression
         Regular Expression for extracting modification times.
+    done : :class:`bool`
+        Set to ``True`` when the end of the list is found, so the rest of
+        the page need not be parsed.
     """
-    mtimere = re.compile(r'/timeline\?from=([0-9T:-]+)&precision=second')
+    mtimere = re.compile(r'/timeline\?from=([0-9T:+Z-]+)&precision=second')
 
     def __init__(self):
         HTMLParser.__init__(self)
+        self.done = False
         self.found_div = False
         self.div_id = 'attachments'
         self.found_list = False
@@ -135,6 +420,7 @@ class SimpleAttachmentHTMLParser(HTMLParser):
         if tag == 'dl' and self.found_div:
             self.found_div = False
             self.found_list = False
+            self.done = True
         if tag == 'dd' and self.found_comment:
             self.found_comment = False
         return
@@ -145,10 +431,17 @@ class SimpleIndexHTMLParser(HTMLParser):
 
     This parser should be capable of handling Trac 1.0-style Index pages
     as well as older versions.
+
+    Attributes
+    ----------
+    done : :class:`bool`
+        Set to ``True`` when the end of the index is found, so the rest of
+        the page need not be parsed.
     """
 
     def __init__(self):
         HTMLParser.__init__(self)
+        self.done = False
         self.found_h1 = None
         self.h1_attr = {'h1': 'id', 'div': 'class'}
         self.h1_id = {'h1': 'TitleIndex', 'div': 'titleindex'}
@@ -178,8 +471,10 @@ class SimpleIndexHTMLParser(HTMLParser):
     def handle_endtag(self, tag):
         if tag == 'ul' and self.found_h1 == 'h1':
             self.found_h1 = None
+            self.done = True
         if tag == 'div' and self.found_h1 == 'div':
             self.found_h1 = None
+            self.done = True
         return
 
 
@@ -191,10 +486,14 @@ class SimpleWikiHTMLParser(HTMLParser):
     ----------
     search_value : :class:`str`
         The embedded value found in the form.  Initially set to ``None``.
+    done : :class:`bool`
+        Set to ``True`` when the value is found, so the rest of the page
+        need not be parsed.
     """
 
     def __init__(self, search='token'):
         HTMLParser.__init__(self)
+        self.done = False
         self.found_form = False
         self.search_value = None
         self.search = search
@@ -216,6 +515,7 @@ class SimpleWikiHTMLParser(HTMLParser):
                     found_token = False
                 if found_token:
                     self.search_value = dattrs['value']
+                    self.done = True
         else:
             if tag == 'form':
                 #
@@ -233,3 +533,60 @@ class SimpleWikiHTMLParser(HTMLParser):
         if tag == 'form' and self.found_form:
             self.found_form = False
         return
+
+
+class SimpleRecentChangesHTMLParser(HTMLParser):
+    """Parse the Trac RecentChanges page.
+
+    Only the date of each change is available, so times are set to
+    midnight UTC.
+
+    Parameters
+    ----------
+    base : :class:`str`, optional
+        The base URL of the Trac server, see :func:`wiki_page`.
+
+    Attributes
+    ----------
+    date_formats : :class:`tuple`
+        Formats tried when parsing the date headings.  Numeric dates are
+        read month first, as in the default Trac locale; day first
+        formats would be ambiguous.
+    """
+    date_formats = ('%m/%d/%y', '%m/%d/%Y', '%Y-%m-%d', '%b %d, %Y')
+
+    def __init__(self, base=''):
+        HTMLParser.__init__(self)
+        self.base = base
+        self.found_h3 = False
+        self.current_date = None
+        self.changes = list()
+        return
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'h3':
+            self.found_h3 = True
+            self.current_date = None
+        if tag == 'a' and self.current_date is not None:
+            page = wiki_page(dict(attrs).get('href', ''), self.base)
+            if page and '?' not in dict(attrs)['href']:
+                self.changes.append((page, self.current_date, None))
+        return
+
+    def handle_data(self, data):
+        if self.found_h3:
+            for f in self.date_formats:
+                try:
+                    d = datetime.strptime(data.strip(), f)
+                except ValueError:
+                    continue
+                self.current_date = d.replace(tzinfo=timezone.utc)
+                break
+        return
+
+    def handle_endtag(self, tag):
+        if tag == 'h3':
+            self.found_h3 = False
+        if tag == 'ul':
+            self.current_date = None
+        return